@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from metrics import get_logger
+
+log = get_logger(__name__)
+
+# Semantic answer cache for chatbot.py: a finished answer is reused when a new question embeds
+# within ANSWER_CACHE_MIN_SIMILARITY of a cached one, retrieved exactly the same chunks, and the
+# FAISS index has not been swapped since. Disabled unless ANSWER_CACHE=1.
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "0") == "1"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "500"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # Seconds
+ANSWER_CACHE_MIN_SIMILARITY = float(os.getenv("ANSWER_CACHE_MIN_SIMILARITY", "0.97"))
+REPLAY_CHUNK_CHARS = 64  # Cached answers are streamed back in pieces of this size
+
+_answers = OrderedDict()  # (corpus version, row id set, normalized query) -> entry
+_answers_lock = threading.Lock()
+_corpus_version = None
+
+ANSWER_CACHE_STATS = {
+    "hits": 0,
+    "misses": 0,
+    "stores": 0,
+    "evictions": 0,
+    "invalidations": 0,
+    "seconds_saved": 0.0,
+    "input_tokens_saved": 0,
+    "output_tokens_saved": 0
+}
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def _check_version(corpus_version):
+    """Drops every cached answer once the corpus version moves (caller holds the lock)."""
+    global _corpus_version
+    if corpus_version != _corpus_version:
+        if _answers:
+            ANSWER_CACHE_STATS["invalidations"] += 1
+            ANSWER_CACHE_STATS["evictions"] += len(_answers)
+            _answers.clear()
+        _corpus_version = corpus_version
+
+def lookup_answer(query, query_embedding, row_ids, corpus_version):
+    """Returns the cached entry for a semantically equivalent question over the same chunks, or None."""
+    if not ANSWER_CACHE_ENABLED or query_embedding is None:
+        return None
+
+    scope = frozenset(int(row_id) for row_id in row_ids)
+    query_vector = _unit(query_embedding)
+    now = time.time()
+    best, best_similarity = None, ANSWER_CACHE_MIN_SIMILARITY
+
+    with _answers_lock:
+        _check_version(corpus_version)
+        for key, entry in list(_answers.items()):
+            if now - entry["created_at"] > ANSWER_CACHE_TTL:
+                del _answers[key]
+                ANSWER_CACHE_STATS["evictions"] += 1
+                continue
+            if key[1] != scope:
+                continue
+            similarity = float(np.dot(entry["embedding"], query_vector))
+            if similarity >= best_similarity:
+                best, best_similarity = key, similarity
+
+        if best is None:
+            ANSWER_CACHE_STATS["misses"] += 1
+            return None
+
+        _answers.move_to_end(best)
+        entry = _answers[best]
+        ANSWER_CACHE_STATS["hits"] += 1
+        ANSWER_CACHE_STATS["seconds_saved"] += entry["seconds"]
+        ANSWER_CACHE_STATS["input_tokens_saved"] += entry["input_tokens"]
+        ANSWER_CACHE_STATS["output_tokens_saved"] += entry["output_tokens"]
+
+    log.debug("♻️ Answer cache hit for '%s' (similarity %.4f, matched '%s')", query, best_similarity, best[2])
+    return entry
+
+def store_answer(query, query_embedding, row_ids, corpus_version, html, input_tokens, output_tokens, seconds):
+    """Caches a finished answer, evicting the least recently used entries over ANSWER_CACHE_SIZE."""
+    if not ANSWER_CACHE_ENABLED or query_embedding is None or not html:
+        return
+
+    key = (corpus_version, frozenset(int(row_id) for row_id in row_ids), " ".join(query.lower().split()))
+    entry = {
+        "embedding": _unit(query_embedding),
+        "html": html,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "seconds": seconds,
+        "created_at": time.time()
+    }
+    with _answers_lock:
+        _check_version(corpus_version)
+        _answers[key] = entry
+        _answers.move_to_end(key)
+        ANSWER_CACHE_STATS["stores"] += 1
+        while len(_answers) > ANSWER_CACHE_SIZE:
+            _answers.popitem(last=False)
+            ANSWER_CACHE_STATS["evictions"] += 1
+
+def replay_answer(entry):
+    """Streams a cached answer back in small pieces, like a live completion."""
+    html = entry["html"]
+    for start in range(0, len(html), REPLAY_CHUNK_CHARS):
+        yield html[start:start + REPLAY_CHUNK_CHARS]
+
+def clear_answer_cache():
+    with _answers_lock:
+        _answers.clear()
+
+def get_answer_cache_stats():
+    """Returns answer cache counters, hit ratio and what hits have saved so far."""
+    stats = dict(ANSWER_CACHE_STATS)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    stats["seconds_saved"] = round(stats["seconds_saved"], 3)
+    stats["entries"] = len(_answers)
+    stats["enabled"] = ANSWER_CACHE_ENABLED
+    return stats
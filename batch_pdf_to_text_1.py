@@ -1,7 +1,11 @@
 import pdfplumber
 import os
-import re
-import pandas as pd
+import hashlib
+import json
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from recipe_parser import format_table, table_lines, parse_recipe
 
 # Define input and output paths
 INPUT_FOLDER = "Inputs"
@@ -12,189 +16,62 @@ os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 os.makedirs(os.path.join(OUTPUT_FOLDER, "flattened"), exist_ok=True)
 os.makedirs(os.path.join(OUTPUT_FOLDER, "structured"), exist_ok=True)
 
-def format_table(table):
-    """Formats extracted tables dynamically, merging stacked headers and reshaping if necessary."""
-    if not table:
-        return ""
-
-    df = pd.DataFrame(table).fillna("")  # Convert to DataFrame and fill empty values
-    
-    # Detect and merge stacked headers dynamically
-    num_header_rows = 0
-    for idx, row in df.iterrows():
-        if row.isnull().sum() > len(row) // 2:  # Detects when rows are mostly empty
-            num_header_rows += 1
-        else:
-            break  # Stop when we reach real data
-
-    # Ensure we have valid header rows
-    if num_header_rows >= len(df):
-        return df.to_string(index=False, header=True)  # If no valid headers, return as-is
-
-    # Merge headers only if we have valid header data
-    new_columns = [' '.join(filter(None, col)).strip() for col in zip(*df.iloc[:num_header_rows].values)]
-    
-    # Ensure new column length matches DataFrame width
-    if len(new_columns) == len(df.columns):
-        df.columns = new_columns
-        df = df.iloc[num_header_rows:].reset_index(drop=True)
-
-    # Reshape if necessary (detecting numeric-based category columns)
-    potential_numeric_columns = [col for col in df.columns if df[col].apply(lambda x: str(x).replace('.', '', 1).isdigit()).sum() > len(df) * 0.8]
-    if len(potential_numeric_columns) > 1:
-        df = df.melt(id_vars=[col for col in df.columns if col not in potential_numeric_columns], 
-                     var_name="Dynamic Category", value_name="Value")
-
-    return df.to_string(index=False, header=True)  # Preserve headers for readability
-
-# Loop through all PDFs in the input folder
-pdf_files = [f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith(".pdf")]
-
-if not pdf_files:
-    print("No PDFs found in the 'Inputs' folder.")
-
-for filename in pdf_files:
+def output_paths(filename):
+    """Returns the (.txt, structured .json, flattened .txt) output paths for a PDF."""
+    stem = os.path.splitext(filename)[0]
+    return (
+        os.path.join(OUTPUT_FOLDER, f"{stem}.txt"),
+        os.path.join(OUTPUT_FOLDER, "structured", f"{stem}.json"),
+        os.path.join(OUTPUT_FOLDER, "flattened", f"{stem}.txt")
+    )
+
+def file_content_hash(path):
+    """Returns the sha256 of a file, read in blocks so large PDFs don't load into memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_entry(filename):
+    """Returns the (size, mtime, content_hash) source_manifest entry for a PDF in the input folder."""
+    path = os.path.join(INPUT_FOLDER, filename)
+    st = os.stat(path)
+    return st.st_size, st.st_mtime, file_content_hash(path)
+
+def extract_pdf(filename):
+    """Extracts one PDF from the input folder into text, structured JSON and flattened outputs."""
     pdf_path = os.path.join(INPUT_FOLDER, filename)
-    output_txt_path = os.path.join(OUTPUT_FOLDER, f"{os.path.splitext(filename)[0]}.txt")
-    output_json_path = os.path.join(OUTPUT_FOLDER, "structured", f"{os.path.splitext(filename)[0]}.json")
-    output_flattened_path = os.path.join(OUTPUT_FOLDER, "flattened", f"{os.path.splitext(filename)[0]}.txt")
+    output_txt_path, output_json_path, output_flattened_path = output_paths(filename)
 
     structured_data = []
-    recipe = {
-        "title": "",
-        "servings": "",
-        "cost": "",
-        "image_path": "",
-        "ingredients": [],
-        "directions": [],
-        "nutrition": {},
-        "myplate": {},
-        "source": filename
-    }
-    formatted_tables = {}  # Dictionary to store extracted tables with their locations
-
-    # === PASS 1: Extract Tables and Store Locations ===
+    pages = []  # (page text, table lines) for the recipe parser
+
+    # === Single pass: extract each page's tables, then its text with table placeholders ===
     with pdfplumber.open(pdf_path) as pdf:
         for i, page in enumerate(pdf.pages):
             tables = page.extract_tables()
-            if tables:
-                formatted_tables[i] = [format_table(table) for table in tables]
+            formatted_tables = [format_table(table) for table in tables] if tables else []
+            table_texts = table_lines(formatted_tables)
 
-    # === PASS 2: Extract Text and Insert Table Placeholders ===
-    with pdfplumber.open(pdf_path) as pdf:
-        for i, page in enumerate(pdf.pages):
             structured_data.append(f"\n=== PAGE {i+1} ===\n")
 
             text = page.extract_text()
+            pages.append((text, table_texts))
             if text:
-                lines = text.splitlines()
-                table_texts = set()
-
-                # On first page, extract title, servings, cost, image_path
-                if i == 0:
-                    # Extract title from largest header line (heuristic: longest line with uppercase words)
-                    possible_titles = [line.strip() for line in lines if line.strip() and sum(1 for c in line if c.isupper()) > len(line)/2]
-                    if possible_titles:
-                        recipe["title"] = possible_titles[0]
-                    else:
-                        # fallback: first non-empty line
-                        for line in lines:
-                            if line.strip():
-                                recipe["title"] = line.strip()
-                                break
-
-                    # Extract servings and cost by scanning lines for "Makes" and "Total Cost"
-                    for line in lines:
-                        servings_match = re.search(r"Makes:\s*(\d+)\s*Servings?", line, re.IGNORECASE)
-                        if servings_match:
-                            recipe["servings"] = servings_match.group(1)
-                        # Flexible cost extraction: match 1–4 literal $ symbols, possibly with spaces
-                        cost_match = re.search(r"Total Cost:\s*([$\s]{1,4})", line, re.IGNORECASE)
-                        if cost_match:
-                            recipe["cost"] = cost_match.group(1).strip()
-
-                    # Image path placeholder (skip actual image saving)
-                    recipe["image_path"] = ""
-
-                # Collect all table text from stored tables
-                if i in formatted_tables:
-                    for table in formatted_tables[i]:
-                        table_texts.update(table.splitlines())
-
-                # Parse sections: Ingredients, Directions, Nutrition Information, MyPlate Food Groups
-                current_section = None
-                for line in lines:
-                    line_strip = line.strip()
-                    if not line_strip or line_strip in table_texts:
-                        continue
-
-                    # Detect section headers
-                    if re.match(r"Ingredients?", line_strip, re.IGNORECASE):
-                        current_section = "ingredients"
-                        continue
-                    elif re.match(r"Directions?", line_strip, re.IGNORECASE):
-                        current_section = "directions"
-                        continue
-                    elif re.match(r"Nutrition Information", line_strip, re.IGNORECASE):
-                        current_section = "nutrition"
-                        continue
-                    elif re.match(r"MyPlate Food Groups", line_strip, re.IGNORECASE):
-                        current_section = "myplate"
-                        continue
-                    elif re.match(r"Source", line_strip, re.IGNORECASE):
-                        current_section = None
-                        continue
-
-                    # Parse content by section
-                    if current_section == "ingredients":
-                        # Stop if next section header is found
-                        if re.match(r"Directions?", line_strip, re.IGNORECASE):
-                            current_section = "directions"
-                            continue
-                        # Accept bullet lines (starting with -, *, •, or digits + dot)
-                        if re.match(r"^[-\*\u2022]\s*(.+)", line_strip):
-                            ingredient = re.sub(r"^[-\*\u2022]\s*", "", line_strip)
-                            recipe["ingredients"].append(ingredient)
-                        elif line_strip and not re.match(r"^\d+\. ", line_strip):
-                            # Also accept lines that are not numbered steps as ingredients
-                            recipe["ingredients"].append(line_strip)
-                    elif current_section == "directions":
-                        # Accept numbered steps
-                        step_match = re.match(r"^\d+\.\s*(.+)", line_strip)
-                        if step_match:
-                            recipe["directions"].append(step_match.group(1))
-                        elif line_strip:
-                            # Also accept lines without numbering if no steps yet
-                            if not recipe["directions"]:
-                                recipe["directions"].append(line_strip)
-                            else:
-                                # Possibly continuation of last step
-                                recipe["directions"][-1] += " " + line_strip
-                    elif current_section == "nutrition":
-                        # Parse lines like Nutrient: Value
-                        nut_match = re.match(r"^([^:]+):\s*(.+)$", line_strip)
-                        if nut_match:
-                            key = nut_match.group(1).strip()
-                            val = nut_match.group(2).strip()
-                            recipe["nutrition"][key] = val
-                    elif current_section == "myplate":
-                        # Parse pairs like Group: Value
-                        mp_match = re.match(r"^([^:]+):\s*(.+)$", line_strip)
-                        if mp_match:
-                            key = mp_match.group(1).strip()
-                            val = mp_match.group(2).strip()
-                            recipe["myplate"][key] = val
-
-                for j in range(len(lines)):
-                    if lines[j] not in table_texts:
-                        structured_data.append(lines[j])
+                for line in text.splitlines():
+                    if line not in table_texts:
+                        structured_data.append(line)
 
             # Insert Table Placeholder with Clear Formatting
-            if i in formatted_tables:
+            if formatted_tables:
                 structured_data.append(f"\n=== PAGE {i+1} - TABLE(S) ===\n")
-                structured_data.append("\n\n".join(formatted_tables[i]))  # Add extra spacing for clarity
+                structured_data.append("\n\n".join(formatted_tables))  # Add extra spacing for clarity
                 structured_data.append("=" * 40)  # Table separator
 
+    # Parse sections: Ingredients, Directions, Nutrition Information, MyPlate Food Groups
+    recipe = parse_recipe(pages, filename)
+
     # Save structured text output
     with open(output_txt_path, "w", encoding="utf-8") as f:
         f.write("\n".join(structured_data))
@@ -202,7 +79,6 @@ for filename in pdf_files:
     print(f"✅ Extraction complete for {filename}! Check output: {output_txt_path}")
 
     # Save structured JSON
-    import json
     with open(output_json_path, "w") as jf:
         json.dump(recipe, jf, indent=2)
 
@@ -215,4 +91,47 @@ for filename in pdf_files:
         tf.write("DIRECTIONS:\n" + "\n".join(recipe.get("directions", [])) + "\n\n")
         tf.write("NUTRITION:\n" + "\n".join([f"{k}: {v}" for k, v in recipe.get("nutrition", {}).items()]) + "\n\n")
         tf.write("FOOD GROUPS:\n" + "\n".join([f"{k}: {v}" for k, v in recipe.get("myplate", {}).items()]) + "\n\n")
-        tf.write(f"SOURCE: {recipe.get('source', '')}\n")
\ No newline at end of file
+        tf.write(f"SOURCE: {recipe.get('source', '')}\n")
+
+def _extract_pdf_safely(filename):
+    """Process-pool entry point: never raises, so one bad PDF can't abort the batch."""
+    try:
+        extract_pdf(filename)
+        return filename, None
+    except Exception:
+        return filename, traceback.format_exc()
+
+def extract_all(pdf_files, workers=None):
+    """Extracts PDFs across a process pool and returns {filename: error} for the files that failed."""
+    failures = {}
+    if workers == 1:
+        results = map(_extract_pdf_safely, pdf_files)
+        for filename, error in results:
+            if error:
+                failures[filename] = error
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_extract_pdf_safely, filename) for filename in pdf_files]
+            for future in as_completed(futures):
+                filename, error = future.result()
+                if error:
+                    failures[filename] = error
+
+    for filename, error in failures.items():
+        print(f"❌ Extraction failed for {filename}:\n{error}")
+    print(f"📄 Extracted {len(pdf_files) - len(failures)}/{len(pdf_files)} PDFs ({len(failures)} failed).")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract recipe PDFs into text, structured JSON and flattened outputs.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("EXTRACT_WORKERS", "0")) or None,
+                        help="Worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    # Loop through all PDFs in the input folder
+    pdf_files = [f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith(".pdf")]
+
+    if not pdf_files:
+        print("No PDFs found in the 'Inputs' folder.")
+    else:
+        extract_all(pdf_files, workers=args.workers)
@@ -0,0 +1,82 @@
+import argparse
+import glob
+import json
+import os
+import time
+from recipe_parser import parse_recipe
+
+# Micro-benchmark for recipe_parser over the Outputs/structured corpus.
+# Each structured recipe is rendered back into MyPlate-style page text, parsed, and checked
+# against the original so throughput numbers are only reported for a parser that still works.
+# Usage: python bench_recipe_parser.py --repeat 200
+
+STRUCTURED_FOLDER = "Outputs/structured"
+
+def render_pages(recipe):
+    """Renders a structured recipe as the page text pdfplumber would hand the parser."""
+    first_page = [
+        recipe["title"],
+        f"Makes: {recipe['servings']} Servings" if recipe["servings"] else "",
+        f"Total Cost: {recipe['cost']}" if recipe["cost"] else "",
+        "Ingredients"
+    ]
+    first_page += [f"- {item}" for item in recipe["ingredients"]]
+    second_page = ["Directions"]
+    second_page += [f"{n}. {step}" for n, step in enumerate(recipe["directions"], 1)]
+    third_page = ["Nutrition Information"]
+    third_page += [f"{key}: {value}" for key, value in recipe["nutrition"].items()]
+    third_page += ["MyPlate Food Groups"]
+    third_page += [f"{key}: {value}" for key, value in recipe["myplate"].items()]
+    third_page += ["Source", recipe["source"]]
+    return [("\n".join(page), frozenset()) for page in (first_page, second_page, third_page)]
+
+def load_corpus(folder=STRUCTURED_FOLDER):
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(folder, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            recipe = json.load(f)
+        corpus.append((recipe, render_pages(recipe)))
+    return corpus
+
+def run_benchmark(repeat=100, folder=STRUCTURED_FOLDER):
+    corpus = load_corpus(folder)
+    if not corpus:
+        print(f"🚨 No structured recipes found in `{folder}`.")
+        return None
+
+    mismatches = 0
+    for recipe, pages in corpus:
+        parsed = parse_recipe(pages, recipe["source"])
+        for key in ("ingredients", "directions", "nutrition", "myplate"):
+            if parsed[key] != recipe[key]:
+                mismatches += 1
+                print(f"⚠️ {recipe['source']}: parsed {key} differs from the structured output")
+
+    lines = sum(text.count("\n") + 1 for _, pages in corpus for text, _ in pages)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for recipe, pages in corpus:
+            parse_recipe(pages, recipe["source"])
+    elapsed = time.perf_counter() - start
+
+    parsed_recipes = len(corpus) * repeat
+    report = {
+        "recipes": len(corpus),
+        "repeat": repeat,
+        "mismatches": mismatches,
+        "seconds": round(elapsed, 4),
+        "recipes_per_second": round(parsed_recipes / elapsed, 1),
+        "lines_per_second": round(lines * repeat / elapsed, 1),
+        "microseconds_per_recipe": round(elapsed / parsed_recipes * 1e6, 2)
+    }
+    print(f"⏱️ Parsed {parsed_recipes} recipes in {elapsed:.3f}s "
+          f"({report['recipes_per_second']} recipes/s, {report['microseconds_per_recipe']} µs/recipe, "
+          f"{mismatches} mismatches)")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark recipe_parser over Outputs/structured.")
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--folder", default=STRUCTURED_FOLDER)
+    args = parser.parse_args()
+    run_benchmark(repeat=args.repeat, folder=args.folder)
@@ -1,13 +1,33 @@
-from flask import Flask, request, jsonify, Response, render_template, session
+from flask import Flask, request, jsonify, Response, render_template, g
 import openai
 import os
 import time
 import json
 import re
 from dotenv import load_dotenv
-from search_faiss_5 import search_and_filter
-from flask_session import Session
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from search_faiss_5 import (
+    hybrid_search, resolve_scope, get_query_cache_stats, get_search_stats, peek_query_embedding, prefetch_retrieval,
+    prefetch_embedding, cancel_prefetch
+)
+from faiss_index_4 import get_faiss_index, get_index_metrics, get_index_generation
+from ingredient_index import FILTER_MAX_RECIPES, filter_recipes
+from answer_cache import lookup_answer, store_answer, replay_answer, get_answer_cache_stats
+from tokenization import count_tokens, count_message_tokens
+from context_packer import CONTEXT_TOKEN_BUDGET, pack_context, get_pack_stats
+from history_compaction import (
+    prompt_history, fit_history, record_compaction, note_message_tokens, uncompacted_history_tokens,
+    drop_stale_refs, schedule_summary, compaction_report, load_compacted_session
+)
+from db import DB_PATH, get_connection
+from session_store import (
+    SESSION_COOKIE, new_token_usage, new_session, new_session_id, save_session,
+    delete_session, merge_context_refs, hydrate_context
+)
+from query_router import route_query, record_retrieval, get_router_stats
+from metrics import get_logger, stage_timer, record_stage, log_timings, server_timing, render_metrics
+
+log = get_logger(__name__)
 
 load_dotenv()
 API_KEY = os.getenv("OPENAI_API_KEY")
@@ -16,10 +36,21 @@ client = openai.OpenAI(api_key=API_KEY)
 app = Flask(__name__)
 app.secret_key = os.getenv("CHAT_SESSION_KEY")
 
-app.config["SESSION_TYPE"] = "filesystem"
-app.config["SESSION_FILE_DIR"] = "./.flask_session"
-app.config["SESSION_PERMANENT"] = False  # avoids stale data from old sessions
-Session(app)
+def get_chat_session():
+    """Returns (sid, session) for this request, loaded from session_store once per request."""
+    if "chat_session" not in g:
+        sid = request.cookies.get(SESSION_COOKIE)
+        if not sid:
+            sid = g.new_sid = new_session_id()
+        g.sid, g.chat_session = sid, load_compacted_session(sid)
+    return g.sid, g.chat_session
+
+@app.after_request
+def set_session_cookie(response):
+    sid = g.get("new_sid")
+    if sid:
+        response.set_cookie(SESSION_COOKIE, sid, httponly=True, samesite="Lax")
+    return response
 
 def is_new_topic(query, last_topic):
     lowered_query = query.lower()
@@ -28,23 +59,52 @@ def is_new_topic(query, last_topic):
     reset_keywords = ["clear everything", "reset from scratch", "reset conversation"]
     return any(keyword in lowered_query for keyword in reset_keywords)
 
-def is_followup_query(query):
-    followup_keywords = ["compare", "which one", "these", "those", "the second", "that one", "how about", "what about"]
-    return any(kw in query.lower() for kw in followup_keywords)
+SCOPE_KEYS = ("row_ids", "filenames", "labels", "where")
+
+def search_scope(requested_scope, routed):
+    """Row ids a /search may retrieve from, or None for the whole index.
+
+    An explicit request scope ({"row_ids", "filenames", "labels", "where"}) wins; otherwise a
+    "scoped" route ("compare those with tofu") is limited to the recipes the router picked: those
+    already in context plus any matching the new words. Raises ValueError for a malformed scope.
+    """
+    if requested_scope:
+        if not isinstance(requested_scope, dict) or set(requested_scope) - set(SCOPE_KEYS):
+            raise ValueError(f"scope must be an object with any of: {', '.join(SCOPE_KEYS)}")
+        return resolve_scope(**requested_scope)
+    if routed["route"] == "scoped":
+        return resolve_scope(filenames=routed["filenames"])
+    return None
+
+def retrieve(user_query, route, scope, prefetch=None, timings=None):
+    """Hybrid search for a routed turn; a followup is answered from the existing context and skips it."""
+    if route == "followup":
+        return []
+    start = time.time()
+    grouped_results = hybrid_search(user_query, row_id_scope=scope, prefetch=prefetch, timings=timings)
+    if scope is None:
+        record_retrieval(time.time() - start)
+    return grouped_results
 
 @app.route("/")
 def home():
-    session.clear()
-    session["token_usage"] = {
-        "input_tokens": 0,
-        "output_tokens": 0,
-        "estimated_cost_usd": 0.0
-    }
+    delete_session(request.cookies.get(SESSION_COOKIE))
+    g.new_sid = new_session_id()
+    save_session(g.new_sid, new_session())
     return render_template("index.html")
 
-def stream_gpt_response(user_query, context_text, chat_history):
-    MAX_CHAT_HISTORY = 6
-    chat_history = chat_history[-MAX_CHAT_HISTORY:]
+MAX_CHAT_HISTORY = 6
+
+def add_token_usage(usage, input_token_count, output_token_count):
+    """Adds one answer's tokens and estimated gpt-4o cost to a session's usage dict."""
+    usage["input_tokens"] += input_token_count
+    usage["output_tokens"] += output_token_count
+    input_cost = input_token_count * 0.005 / 1000
+    output_cost = output_token_count * 0.015 / 1000
+    usage["estimated_cost_usd"] += input_cost + output_cost
+
+def build_messages(user_query, context_text, history):
+    """Builds the gpt-4o message list: system prompt, prepared history messages and the query with its context."""
     messages = [{
         "role": "system",
         "content": (
@@ -64,57 +124,119 @@ def stream_gpt_response(user_query, context_text, chat_history):
             "If the information is not available, say so clearly and politely."
         )
     }]
-    for msg in chat_history:
-        if msg["content"] != "Generating response...":
-            messages.append({"role": msg["role"], "content": msg["content"]})
+    messages.extend(history)
 
     messages.append({
         "role": "user",
         "content": f"{user_query}\n\n### Relevant Data:\n{context_text}"
     })
 
-    import tiktoken
-    encoding = tiktoken.encoding_for_model("gpt-4o")
-    input_token_count = sum(len(encoding.encode(m["content"])) for m in messages)
-    print(f"🧮 Total token count into GPT: {input_token_count}")
+    return messages
 
-    response = client.chat.completions.create(
+def select_context_chunks(grouped_results, previous_chunks=None):
+    """Flattens grouped search results into best-first chunks; falls back to the previous context when nothing matched."""
+    ordered_chunks = []
+    if not grouped_results and previous_chunks:
+        log.debug("🔁 Using previous context due to follow-up query.")
+        return sorted(previous_chunks, key=lambda x: x["chunk_index"])
+
+    seen_row_ids = set()
+    for recipe in grouped_results:
+        for r in recipe["chunks"]:
+            row_id = int(r["row_id"])
+            if row_id not in seen_row_ids:
+                ordered_chunks.append({
+                    "row_id": r["row_id"],
+                    "filename": recipe["filename"],
+                    "chunk_index": r["chunk_index"],
+                    "distance_score": r["distance_score"],
+                    "text": r.get("text", "[No content found]"),
+                    "token_count": r.get("token_count")
+                })
+                seen_row_ids.add(row_id)
+    ordered_chunks.sort(key=lambda x: x["distance_score"])
+    return ordered_chunks
+
+def prepare_prompt(user_query, ordered_chunks, chat):
+    """Builds this turn's compacted prompt under INPUT_TOKEN_CEILING (see history_compaction).
+
+    History (summary plus recent turns, current query excluded) is fitted first and context is
+    packed into what is left. Returns (messages, context row ids, input tokens) and records the
+    turn's before/after token counts in the session.
+    """
+    history = prompt_history(chat.get("summary"), chat["chat_history"][:-1][-MAX_CHAT_HISTORY:])
+    fixed_tokens = count_message_tokens(build_messages(user_query, "", []))
+    history, history_tokens, context_budget = fit_history(fixed_tokens, history)
+    context_text, context_row_ids, pack_stats = pack_context(ordered_chunks, min(CONTEXT_TOKEN_BUDGET, context_budget))
+    messages = build_messages(user_query, context_text, history)
+
+    input_tokens = fixed_tokens + history_tokens + pack_stats["tokens"]
+    record_compaction(chat, input_tokens - history_tokens + uncompacted_history_tokens(chat, MAX_CHAT_HISTORY), input_tokens)
+    log.debug("🧮 Total token count into GPT: %d (history %d, context %d)", input_tokens, history_tokens, pack_stats["tokens"])
+    return messages, context_row_ids, input_tokens
+
+# Threads that open model streams, so /search can return and flush its headers while the request is in flight
+LLM_START_WORKERS = int(os.getenv("LLM_START_WORKERS", "32"))
+_llm_pool = ThreadPoolExecutor(max_workers=LLM_START_WORKERS, thread_name_prefix="llm-start")
+
+def close_stream(pending):
+    """Done-callback closing the stream of a finished create() call; failed calls have nothing to close."""
+    if not pending.cancelled() and pending.exception() is None:
+        pending.result().close()
+
+def stream_gpt_response(messages, input_token_count, on_complete=None, timings=None, request_start=None):
+    """Starts the gpt-4o request right away and returns a generator over the answer text.
+
+    The generator's first (empty) chunk makes the server send the response headers before the
+    model has answered. The model's stages (llm_first_token, first_token since request_start,
+    llm_complete) are recorded like the others, and the request's breakdown is logged at the end.
+    """
+    start = time.perf_counter()
+    pending = _llm_pool.submit(
+        client.chat.completions.create,
         model="gpt-4o",
         messages=messages,
         stream=True
     )
 
     def generate():
-        output_token_count = 0
-        full_text = ""
-        for chunk in response:
-            if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
-                text = chunk.choices[0].delta.content
-                full_text += text
-                output_token_count += len(encoding.encode(text))
-                yield text
-
-        # Update session usage outside of response streaming
-        from flask import has_request_context
-        if has_request_context():
-            if "token_usage" not in session:
-                session["token_usage"] = {
-                    "input_tokens": 0,
-                    "output_tokens": 0,
-                    "estimated_cost_usd": 0.0
-                }
-
-            session["token_usage"]["input_tokens"] += input_token_count
-            session["token_usage"]["output_tokens"] += output_token_count
-            input_cost = input_token_count * 0.005 / 1000
-            output_cost = output_token_count * 0.015 / 1000
-            session["token_usage"]["estimated_cost_usd"] += input_cost + output_cost
-
-            print(f"💵 Input Tokens: {input_token_count} | Output Tokens: {output_token_count}")
-            print(f"💰 Session Estimated Cost: ${session['token_usage']['estimated_cost_usd']:.4f}")
-        else:
-            print(f"💵 Input Tokens: {input_token_count} | Output Tokens: {output_token_count}")
-            print("⚠️ No request context, token usage not tracked in session.")
+        try:
+            yield ""
+            try:
+                response = pending.result()
+            except Exception as e:
+                log.warning("⚠️ GPT request failed: %s", e)
+                yield f"<p>⚠️ The answer could not be generated: {e}</p>"
+                return
+
+            parts = []
+            for chunk in response:
+                if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
+                    text = chunk.choices[0].delta.content
+                    if not parts:
+                        now = time.perf_counter()
+                        record_stage(timings, "llm_first_token", now - start)
+                        if request_start is not None:
+                            record_stage(timings, "first_token", now - request_start)
+                    parts.append(text)
+                    yield text
+        finally:
+            # A client that disconnects closes the generator early; release the model's stream
+            # (or drop the request if it hasn't started) so the upstream connection isn't leaked
+            if not pending.cancel():
+                pending.add_done_callback(close_stream)
+
+        # Count the finished answer once instead of encoding every streamed delta
+        full_text = "".join(parts)
+        output_token_count = count_tokens(full_text, "gpt-4o")
+        seconds = time.perf_counter() - start
+
+        log.debug("💵 Input Tokens: %d | Output Tokens: %d", input_token_count, output_token_count)
+        record_stage(timings, "llm_complete", seconds)
+        if timings is not None:
+            log_timings(log, timings)
+        if on_complete:
+            on_complete(full_text, input_token_count, output_token_count, seconds)
 
     return generate()
 
@@ -125,110 +247,179 @@ def search():
     if not user_query:
         return jsonify({"error": "Query cannot be empty."}), 400
 
-    print(f"🔍 User Query: {user_query}")
+    log.debug("🔍 User Query: %s", user_query)
 
     # Reset chat handling
     if "__reset_chat__" in user_query:
-        print("🔄 Reset command received. Clearing session.")
-        session.clear()
+        log.debug("🔄 Reset command received. Clearing session.")
+        save_session(get_chat_session()[0], new_session())
         return jsonify({"message": "Chat session has been reset."}), 200
 
-    if "chat_history" not in session:
-        session["chat_history"] = []
-    session["chat_history"].append({"role": "user", "content": user_query})
-    session["last_user_query"] = user_query
-
-    grouped_results = search_and_filter(user_query)
-
-    ordered_chunks = []
-    if not grouped_results and "context_chunks_json" in session:
-        print("🔁 Using previous context due to follow-up query.")
-        ordered_chunks = sorted(session["context_chunks_json"], key=lambda x: x["chunk_index"])
+    # The keyword lookup needs only the query, so it runs while the session loads. The embedding
+    # starts as soon as the route says the turn needs a search: a followup is answered from context
+    # and must not pay for one.
+    request_start = time.perf_counter()
+    timings = {}
+    prefetch = prefetch_retrieval(user_query, embed=False, timings=timings)
+    with stage_timer(timings, "session"):
+        sid, chat = get_chat_session()
+
+    previous_query = chat.get("last_user_query")
+    chat["chat_history"].append({"role": "user", "content": user_query})
+    chat["last_user_query"] = user_query
+    note_message_tokens(chat, count_tokens(user_query, "gpt-4o"))
+    chat["turn"] = chat.get("turn", 0) + 1
+    chat["context_refs"] = drop_stale_refs(chat["context_refs"], chat["turn"])
+
+    # Follow-ups answerable from the current context skip embedding and search entirely
+    with stage_timer(timings, "route"):
+        previous_chunks = hydrate_context(chat["context_refs"]) if chat["context_refs"] else []
+        routed = route_query(user_query, previous_query, previous_chunks, explicit_scope=bool(data.get("scope")))
+        route = routed["route"]
+    if route == "followup":
+        cancel_prefetch(prefetch)
     else:
-        seen_row_ids = set()
-        for recipe in grouped_results:
-            for r in recipe["chunks"]:
-                row_id = int(r["row_id"])
-                if row_id not in seen_row_ids:
-                    ordered_chunks.append({
-                        "row_id": r["row_id"],
-                        "chunk_index": r["chunk_index"],
-                        "distance_score": r["distance_score"],
-                        "text": r.get("text", "[No content found]")
-                    })
-                    seen_row_ids.add(row_id)
-        ordered_chunks.sort(key=lambda x: x["distance_score"])
-
-    # Store result in session
-    if "context_chunks_json" not in session:
-        session["context_chunks_json"] = []
-    existing_ids = {c["row_id"] for c in session["context_chunks_json"]}
-
-    new_context_chunks = []
-    for chunk in ordered_chunks:
-        if chunk["row_id"] not in existing_ids:
-            new_context_chunks.append({
-                "row_id": chunk["row_id"],
-                "chunk_index": chunk["chunk_index"],
-                "distance_score": round(chunk["distance_score"], 4),
-                "text": chunk.get("text", "[No content found]")
-            })
-
-    session["context_chunks_json"].extend(new_context_chunks)
-    print(f"🧠 Context size now: {len(session['context_chunks_json'])}")
-
-    # Token-aware context trim
-    import tiktoken
-    encoding = tiktoken.encoding_for_model("gpt-4")
-    token_budget = 21000
-    context_chunks = []
-    total_tokens = 0
-
-    for r in ordered_chunks:
-        text = r["text"].strip()
-        if "cid:" in text and len(text) < 200:
-            continue
-        formatted = (
-            f"[Row ID: {r['row_id']} | Chunk: {r['chunk_index']} | Score: {r['distance_score']}]\n{text}"
-        )
-        token_len = len(encoding.encode(formatted))
-        if total_tokens + token_len > token_budget:
-            break
-        context_chunks.append(formatted)
-        total_tokens += token_len
-
-    context_text = "\n\n".join(context_chunks)
-    print(f"📦 Prepared {len(context_chunks)} context chunks — {total_tokens} tokens total")
-
-    session["chat_history"].append({"role": "assistant", "content": "Generating response..."})
+        prefetch_embedding(prefetch, user_query, timings)  # Runs alongside scope resolution and the keyword lookup
     try:
-        return Response(stream_gpt_response(user_query, context_text, session["chat_history"]), content_type='text/event-stream')
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        scope = search_scope(data.get("scope"), routed)
+    except ValueError as e:
+        cancel_prefetch(prefetch)
+        return jsonify({"error": str(e)}), 400
+
+    with stage_timer(timings, "retrieve"):
+        grouped_results = retrieve(user_query, route, scope, prefetch, timings)
+    ordered_chunks = select_context_chunks(grouped_results, previous_chunks)
+    with stage_timer(timings, "pack"):
+        messages, context_row_ids, input_token_count = prepare_prompt(user_query, ordered_chunks, chat)
+    chat["context_refs"] = merge_context_refs(chat["context_refs"], ordered_chunks, chat["turn"])
+
+    # Only first-turn answers over fresh retrieval are cacheable; later turns depend on the conversation
+    cacheable = bool(grouped_results) and chat["turn"] == 1
+    query_embedding = peek_query_embedding(user_query) if cacheable else None
+    corpus_version = get_index_generation()
+    if cacheable:
+        cached = lookup_answer(user_query, query_embedding, context_row_ids, corpus_version)
+        if cached:
+            chat["chat_history"].append({"role": "assistant", "content": cached["html"]})
+            note_message_tokens(chat, cached["output_tokens"])
+            save_session(sid, chat)
+            log_timings(log, timings)
+            return Response(replay_answer(cached), content_type='text/event-stream')
+
+    reply = {"role": "assistant", "content": "Generating response..."}
+
+    def on_complete(full_text, input_tokens, output_tokens, seconds):
+        # Runs after the request has returned; the session is saved again with the answer and usage
+        reply["content"] = full_text
+        add_token_usage(chat["token_usage"], input_tokens, output_tokens)
+        note_message_tokens(chat, output_tokens)
+        save_session(sid, chat)
+        log.debug("💰 Session Estimated Cost: $%.4f", chat["token_usage"]["estimated_cost_usd"])
+        if cacheable:
+            store_answer(user_query, query_embedding, context_row_ids, corpus_version,
+                         full_text, input_tokens, output_tokens, seconds)
+        schedule_summary(sid, chat)  # Folds older turns into the summary off the request path
+
+    # The model request goes out before the session save; headers are sent at once and the stream
+    # reports its own errors
+    stream = stream_gpt_response(messages, input_token_count, on_complete, timings, request_start)
+    chat["chat_history"].append(reply)
+    save_session(sid, chat)
+    return Response(stream, content_type='text/event-stream', headers={
+        "Server-Timing": server_timing(timings),
+        "X-Accel-Buffering": "no"  # Tells nginx-style proxies not to hold back the stream
+    })
 
 @app.route("/session-cost")
 def session_cost():
-    usage = session.get("token_usage", {
-        "input_tokens": 0,
-        "output_tokens": 0,
-        "estimated_cost_usd": 0.0
-    })
+    chat = get_chat_session()[1]
+    usage = dict(chat.get("token_usage", new_token_usage()))
+    usage["compaction"] = compaction_report(chat)
     return jsonify(usage)
 
 
 # New route to list recipe titles from the database
+def fetch_recipe_titles(db_path=DB_PATH):
+    rows = get_connection(db_path).execute("SELECT DISTINCT(filename) FROM recipe_embeddings").fetchall()
+    return [row[0] for row in rows]
+
 @app.route("/list-titles")
 def list_titles():
-    db_path = "recipe_text_chunks.db"  # Update path if your DB is elsewhere
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT DISTINCT(filename) FROM recipe_embeddings")
-            rows = cursor.fetchall()
-            titles = [row[0] for row in rows]
-        return jsonify({"titles": titles})
+        return jsonify({"titles": fetch_recipe_titles()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/recipes/filter")
+def recipes_filter():
+    """Exact ingredient/nutrition filter, e.g. ?q=beans AND NOT pork, calories < 400. No embeddings or LLM."""
+    query = request.args.get("q", "").strip()
+    limit = request.args.get("limit", FILTER_MAX_RECIPES, type=int)
+    try:
+        recipes = filter_recipes(query, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"filter": query, "count": len(recipes), "recipes": recipes})
+
+@app.route("/index-stats")
+def index_stats():
+    return jsonify(get_index_metrics())
+
+@app.route("/cache-stats")
+def cache_stats():
+    return jsonify({
+        "query_embeddings": get_query_cache_stats(),
+        "search": get_search_stats(),
+        "answers": get_answer_cache_stats(),
+        "router": get_router_stats()
+    })
+
+def metric_families():
+    """Cache, search, routing, packing and index counters as render_metrics families."""
+    query_cache, answers = get_query_cache_stats(), get_answer_cache_stats()
+    search, router, packs, index = get_search_stats(), get_router_stats(), get_pack_stats(), get_index_metrics()
+    return [
+        ("recipe_query_embedding_cache_lookups_total", "counter", "Query embedding lookups by result.", [
+            ({"result": "memory_hit"}, query_cache["memory_hits"]),
+            ({"result": "disk_hit"}, query_cache["disk_hits"]),
+            ({"result": "miss"}, query_cache["misses"])
+        ]),
+        ("recipe_query_embedding_cache_hit_ratio", "gauge", "Share of query embeddings served from cache.",
+         [(None, query_cache["hit_ratio"])]),
+        ("recipe_query_embedding_cache_entries", "gauge", "Query embeddings held in memory.",
+         [(None, query_cache["memory_entries"])]),
+        ("recipe_embedding_api_calls_total", "counter", "Embeddings API requests.", [(None, query_cache["api_calls"])]),
+        ("recipe_answer_cache_lookups_total", "counter", "Answer cache lookups by result.", [
+            ({"result": "hit"}, answers["hits"]),
+            ({"result": "miss"}, answers["misses"])
+        ]),
+        ("recipe_answer_cache_hit_ratio", "gauge", "Share of answer cache lookups that hit.", [(None, answers["hit_ratio"])]),
+        ("recipe_answer_cache_entries", "gauge", "Answers held in the answer cache.", [(None, answers["entries"])]),
+        ("recipe_searches_total", "counter", "Retrievals by search mode.",
+         [({"mode": mode}, count) for mode, count in search.items()]),
+        ("recipe_routes_total", "counter", "Chat turns by query route.",
+         [({"route": route}, router[route]) for route in ("followup", "scoped", "search")]),
+        ("recipe_context_packs_total", "counter", "Context packs by packing path.", [
+            ({"path": "fast"}, packs["fast_path"]),
+            ({"path": "knapsack"}, packs["knapsack"])
+        ]),
+        ("recipe_context_tokens_total", "counter", "Context tokens packed into prompts.", [(None, packs["tokens_packed"])]),
+        ("recipe_index_vectors", "gauge", "Vectors in the resident FAISS index.", [(None, index["ntotal"])]),
+        ("recipe_index_bytes", "gauge", "Size of the FAISS index file.", [(None, index["index_bytes"])]),
+        ("recipe_index_generation", "gauge", "Generation of the resident FAISS index.", [(None, index["generation"])]),
+        ("recipe_index_swaps_total", "counter", "Hot swaps of the resident FAISS index.", [(None, index["swaps"])]),
+        ("recipe_chunk_store_rows", "gauge", "Chunks in the resident chunk store.", [(None, index["chunk_store_rows"])]),
+        ("recipe_chunk_store_bytes", "gauge", "Chunk text bytes in the resident chunk store.",
+         [(None, index["chunk_store_bytes"])]),
+        ("recipe_chunk_store_misses_total", "counter", "Hits hydrated from SQLite instead of the chunk store.",
+         [(None, index["chunk_store_misses"])])
+    ]
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint: stage latency histograms plus cache, search and index metrics."""
+    return Response(render_metrics(metric_families()), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
+    get_faiss_index()  # Load the index once before serving requests
     app.run(host="0.0.0.0", port=5001, debug=True)
\ No newline at end of file
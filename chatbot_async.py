@@ -0,0 +1,254 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, request, jsonify, Response, render_template, g
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+from search_faiss_5 import (
+    hybrid_search_async, get_async_client, get_query_cache_stats, get_search_stats, peek_query_embedding,
+    prefetch_retrieval_async, prefetch_embedding_async, cancel_prefetch
+)
+from faiss_index_4 import get_faiss_index, get_index_metrics, get_index_generation
+from ingredient_index import FILTER_MAX_RECIPES, filter_recipes
+from answer_cache import lookup_answer, store_answer, replay_answer, get_answer_cache_stats
+from tokenization import count_tokens
+from chatbot import (
+    search_scope, add_token_usage, select_context_chunks, prepare_prompt, fetch_recipe_titles, metric_families
+)
+from query_router import route_query, record_retrieval, get_router_stats
+from metrics import get_logger, stage_timer, record_stage, log_timings, server_timing, render_metrics
+from history_compaction import (
+    note_message_tokens, drop_stale_refs, schedule_summary, compaction_report, load_compacted_session
+)
+from session_store import (
+    SESSION_COOKIE, new_token_usage, new_session, new_session_id, save_session,
+    delete_session, merge_context_refs, hydrate_context
+)
+
+log = get_logger(__name__)
+
+# ASGI version of chatbot.py for concurrent users. Same routes and streaming contract, but every
+# streamed answer is an asyncio task on one pooled AsyncOpenAI client instead of a blocked worker.
+# Usage: python chatbot_async.py   (or: hypercorn chatbot_async:app --bind 0.0.0.0:5001)
+
+app = Quart(__name__)
+app.config["RESPONSE_TIMEOUT"] = None  # Long answers stream for longer than Quart's 60s default
+
+# Threads for blocking work (FAISS, SQLite, tokenizing); asyncio's default pool is only cpu_count + 4
+WORKER_THREADS = int(os.getenv("CHAT_WORKER_THREADS", "32"))
+
+async def get_chat_session():
+    """Returns (sid, session) for this request from session_store, the same store chatbot.py uses."""
+    sid = request.cookies.get(SESSION_COOKIE)
+    if not sid:
+        sid = g.new_sid = new_session_id()
+    return sid, await asyncio.to_thread(load_compacted_session, sid)
+
+@app.before_serving
+async def start_worker_pool():
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=WORKER_THREADS))
+
+@app.after_request
+async def set_session_cookie(response):
+    sid = g.get("new_sid")
+    if sid:
+        response.set_cookie(SESSION_COOKIE, sid, httponly=True, samesite="Lax")
+    return response
+
+def start_gpt_stream_async(messages):
+    """Opens the gpt-4o stream as a task, so the request is in flight before the response starts."""
+    return asyncio.create_task(get_async_client().chat.completions.create(
+        model="gpt-4o",
+        messages=messages,
+        stream=True
+    ))
+
+async def stream_gpt_response_async(pending, input_token_count, on_complete=None, timings=None, request_start=None):
+    """Async generator yielding answer text from a stream opened by start_gpt_stream_async.
+
+    The model's stages are recorded as in chatbot.stream_gpt_response and the request's breakdown is logged at the end.
+    """
+    start = time.perf_counter()
+    try:
+        try:
+            response = await pending
+        except Exception as e:
+            log.warning("⚠️ GPT request failed: %s", e)
+            yield f"<p>⚠️ The answer could not be generated: {e}</p>"
+            return
+
+        parts = []
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                text = chunk.choices[0].delta.content
+                if not parts:
+                    now = time.perf_counter()
+                    record_stage(timings, "llm_first_token", now - start)
+                    if request_start is not None:
+                        record_stage(timings, "first_token", now - request_start)
+                parts.append(text)
+                yield text
+    finally:
+        # A client that disconnects closes the generator early; stop the request or release the
+        # model's stream so the upstream connection isn't leaked
+        if not pending.done():
+            pending.cancel()
+        elif not pending.cancelled() and pending.exception() is None:
+            await pending.result().close()
+
+    full_text = "".join(parts)
+    output_token_count = await asyncio.to_thread(count_tokens, full_text, "gpt-4o")
+    seconds = time.perf_counter() - start
+    log.debug("💵 Input Tokens: %d | Output Tokens: %d", input_token_count, output_token_count)
+    record_stage(timings, "llm_complete", seconds)
+    if timings is not None:
+        log_timings(log, timings)
+    if on_complete:
+        await asyncio.to_thread(on_complete, full_text, input_token_count, output_token_count, seconds)
+
+@app.route("/")
+async def home():
+    await asyncio.to_thread(delete_session, request.cookies.get(SESSION_COOKIE))
+    g.new_sid = new_session_id()
+    await asyncio.to_thread(save_session, g.new_sid, new_session())
+    return await render_template("index.html")
+
+@app.route("/search", methods=["POST"])
+async def search():
+    data = await request.get_json()
+    user_query = data.get("query", "").strip().lower()
+    if not user_query:
+        return jsonify({"error": "Query cannot be empty."}), 400
+
+    log.debug("🔍 User Query: %s", user_query)
+
+    # Reset chat handling
+    if "__reset_chat__" in user_query:
+        log.debug("🔄 Reset command received. Clearing session.")
+        await asyncio.to_thread(save_session, (await get_chat_session())[0], new_session())
+        return jsonify({"message": "Chat session has been reset."}), 200
+
+    # The keyword lookup needs only the query, so it runs while the session loads. The embedding
+    # starts as soon as the route says the turn needs a search: a followup is answered from context
+    # and must not pay for one.
+    request_start = time.perf_counter()
+    timings = {}
+    prefetch = prefetch_retrieval_async(user_query, embed=False, timings=timings)
+    with stage_timer(timings, "session"):
+        sid, chat = await get_chat_session()
+
+    previous_query = chat.get("last_user_query")
+    chat["chat_history"].append({"role": "user", "content": user_query})
+    chat["last_user_query"] = user_query
+    note_message_tokens(chat, await asyncio.to_thread(count_tokens, user_query, "gpt-4o"))
+    chat["turn"] = chat.get("turn", 0) + 1
+    chat["context_refs"] = drop_stale_refs(chat["context_refs"], chat["turn"])
+
+    # Follow-ups answerable from the current context skip embedding and search entirely
+    with stage_timer(timings, "route"):
+        previous_chunks = await asyncio.to_thread(hydrate_context, chat["context_refs"]) if chat["context_refs"] else []
+        routed = await asyncio.to_thread(route_query, user_query, previous_query, previous_chunks, bool(data.get("scope")))
+        route = routed["route"]
+    if route == "followup":
+        cancel_prefetch(prefetch)
+    else:
+        prefetch_embedding_async(prefetch, user_query, timings)  # Runs alongside scope resolution and the keyword lookup
+    try:
+        scope = await asyncio.to_thread(search_scope, data.get("scope"), routed)
+    except ValueError as e:
+        cancel_prefetch(prefetch)
+        return jsonify({"error": str(e)}), 400
+
+    grouped_results = []
+    if route != "followup":
+        start = time.time()
+        with stage_timer(timings, "retrieve"):
+            grouped_results = await hybrid_search_async(user_query, scope, prefetch, timings)
+        if scope is None:
+            record_retrieval(time.time() - start)
+    ordered_chunks = select_context_chunks(grouped_results, previous_chunks)
+    with stage_timer(timings, "pack"):
+        messages, context_row_ids, input_token_count = await asyncio.to_thread(prepare_prompt, user_query, ordered_chunks, chat)
+    chat["context_refs"] = merge_context_refs(chat["context_refs"], ordered_chunks, chat["turn"])
+
+    cacheable = bool(grouped_results) and chat["turn"] == 1
+    query_embedding = peek_query_embedding(user_query) if cacheable else None
+    corpus_version = get_index_generation()
+    if cacheable:
+        cached = lookup_answer(user_query, query_embedding, context_row_ids, corpus_version)
+        if cached:
+            chat["chat_history"].append({"role": "assistant", "content": cached["html"]})
+            note_message_tokens(chat, cached["output_tokens"])
+            await asyncio.to_thread(save_session, sid, chat)
+            log_timings(log, timings)
+            return Response(replay_answer(cached), content_type="text/event-stream")
+
+    # The model request goes out before the session save; its answer streams once the response starts
+    pending = start_gpt_stream_async(messages)
+    reply = {"role": "assistant", "content": "Generating response..."}
+    chat["chat_history"].append(reply)
+    await asyncio.to_thread(save_session, sid, chat)
+
+    def on_complete(full_text, input_tokens, output_tokens, seconds):
+        reply["content"] = full_text
+        add_token_usage(chat["token_usage"], input_tokens, output_tokens)
+        note_message_tokens(chat, output_tokens)
+        save_session(sid, chat)
+        if cacheable:
+            store_answer(user_query, query_embedding, context_row_ids, corpus_version,
+                         full_text, input_tokens, output_tokens, seconds)
+        schedule_summary(sid, chat)
+
+    return Response(
+        stream_gpt_response_async(pending, input_token_count, on_complete, timings, request_start),
+        content_type="text/event-stream",
+        headers={"Server-Timing": server_timing(timings), "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/session-cost")
+async def session_cost():
+    sid, chat = await get_chat_session()
+    usage = dict(chat.get("token_usage", new_token_usage()))
+    usage["compaction"] = await asyncio.to_thread(compaction_report, chat)
+    return jsonify(usage)
+
+@app.route("/list-titles")
+async def list_titles():
+    try:
+        return jsonify({"titles": await asyncio.to_thread(fetch_recipe_titles)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/recipes/filter")
+async def recipes_filter():
+    query = request.args.get("q", "").strip()
+    limit = request.args.get("limit", FILTER_MAX_RECIPES, type=int)
+    try:
+        recipes = await asyncio.to_thread(filter_recipes, query, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"filter": query, "count": len(recipes), "recipes": recipes})
+
+@app.route("/index-stats")
+async def index_stats():
+    return jsonify(get_index_metrics())
+
+@app.route("/cache-stats")
+async def cache_stats():
+    return jsonify({
+        "query_embeddings": get_query_cache_stats(),
+        "search": get_search_stats(),
+        "answers": get_answer_cache_stats(),
+        "router": get_router_stats()
+    })
+
+@app.route("/metrics")
+async def metrics():
+    return Response(render_metrics(metric_families()), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+if __name__ == "__main__":
+    get_faiss_index()  # Load the index once before serving requests
+    config = Config()
+    config.bind = [os.getenv("CHAT_BIND", "0.0.0.0:5001")]
+    asyncio.run(serve(app, config))
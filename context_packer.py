@@ -0,0 +1,191 @@
+import os
+import time
+import numpy as np
+from keyword_index import recipe_title
+from tokenization import count_tokens_batch
+from metrics import get_logger
+
+log = get_logger(__name__)
+
+# Token-aware context packing for the chat prompt. Works from the token_count stored with every
+# chunk at ingest, so no chunk text is re-encoded per request:
+#   1. drop junk chunks and exact duplicates, and stitch split_large_text sub-chunks of one chunk
+#      back together without their overlapping text
+#   2. if everything fits the budget, take it all (the common case)
+#   3. otherwise choose the most relevant set that fits as a 0/1 knapsack
+#   4. emit one block per recipe, "### <title>" then its chunks in recipe order
+# Recipe headers replace the per-chunk "[Row ID | Chunk | Score]" headers of the old format.
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "21000"))
+KNAPSACK_GRANULARITY = 32  # Tokens per knapsack weight unit; weights round up, so results never overflow
+OVERLAP_PROBE_CHARS = 32  # Prefix of a sub-chunk searched for in the previous one
+OVERLAP_MAX_CHARS = 4000  # Tail of the previous sub-chunk searched; split overlap is ~100 tokens
+
+PACK_STATS = {
+    "packs": 0,
+    "fast_path": 0,
+    "knapsack": 0,
+    "chunks_in": 0,
+    "chunks_packed": 0,
+    "tokens_packed": 0,
+    "tokens_deduped": 0,
+    "total_us": 0.0
+}
+
+def is_junk_chunk(text):
+    """Short chunks of unmapped PDF glyphs ("(cid:123)") carry nothing readable."""
+    return "cid:" in text and len(text.strip()) < 200
+
+def relevance(chunk):
+    """Positive value for the knapsack: 1 at distance 0, falling as the distance grows."""
+    distance = chunk.get("distance_score")
+    return 1.0 / (1.0 + max(distance, 0.0)) if distance is not None else 0.5
+
+def overlap_length(previous, following):
+    """Length of the longest suffix of previous that is also a prefix of following."""
+    probe = following[:OVERLAP_PROBE_CHARS]
+    if not probe:
+        return 0
+    window_start = max(0, len(previous) - OVERLAP_MAX_CHARS)
+    position = previous.find(probe, window_start)
+    while position != -1:
+        length = len(previous) - position
+        if following.startswith(previous[position:]):
+            return length
+        position = previous.find(probe, position + 1)
+    return 0
+
+def merge_units(chunks):
+    """Turns chunks into packing units: one per (recipe, chunk_index), with sub-chunks stitched together.
+
+    Each unit is {"filename", "chunk_index", "row_ids", "text", "tokens", "value"}. Returns
+    (units, tokens removed as duplicate or overlapping text).
+    """
+    units = {}
+    seen_texts = set()
+    deduped = 0
+    # Sub-chunks were inserted in text order, so row id order is reading order within a chunk
+    for chunk in sorted(chunks, key=lambda c: int(c["row_id"])):
+        text = chunk["text"].strip()
+        tokens = chunk.get("token_count") or 0
+        key = (chunk.get("filename"), chunk["chunk_index"])
+        if (key[0], text) in seen_texts:
+            deduped += tokens
+            continue
+        seen_texts.add((key[0], text))
+
+        unit = units.get(key)
+        if unit is None:
+            units[key] = {
+                "filename": key[0],
+                "chunk_index": chunk["chunk_index"],
+                "row_ids": [chunk["row_id"]],
+                "text": text,
+                "tokens": tokens,
+                "value": relevance(chunk)
+            }
+            continue
+
+        overlap = overlap_length(unit["text"], text)
+        overlap_tokens = round(tokens * overlap / len(text)) if text else 0
+        unit["text"] += text[overlap:] if overlap else "\n" + text
+        unit["tokens"] += tokens - overlap_tokens
+        unit["row_ids"].append(chunk["row_id"])
+        unit["value"] = max(unit["value"], relevance(chunk))
+        deduped += overlap_tokens
+    return list(units.values()), deduped
+
+def knapsack(weights, values, capacity):
+    """Indexes of the items with the largest total value whose weights fit capacity (0/1 knapsack).
+
+    Dynamic programming over integer capacities, one vectorized row update per item.
+    """
+    best = np.zeros(capacity + 1)
+    taken = np.zeros((len(weights), capacity + 1), dtype=bool)
+    for i, (weight, value) in enumerate(zip(weights, values)):
+        if weight > capacity:
+            continue
+        with_item = best[:capacity + 1 - weight] + value
+        improved = with_item > best[weight:]
+        taken[i, weight:] = improved
+        best[weight:] = np.where(improved, with_item, best[weight:])
+
+    chosen, remaining = [], capacity
+    for i in range(len(weights) - 1, -1, -1):
+        if taken[i, remaining]:
+            chosen.append(i)
+            remaining -= weights[i]
+    return chosen[::-1]
+
+def format_blocks(units, headers):
+    """One block per recipe, recipes by best relevance, chunks within a recipe in recipe order."""
+    by_recipe = {}
+    for unit in units:
+        by_recipe.setdefault(unit["filename"], []).append(unit)
+    ordered = sorted(by_recipe.items(), key=lambda item: -max(u["value"] for u in item[1]))
+    blocks = []
+    for filename, recipe_units in ordered:
+        recipe_units.sort(key=lambda u: u["chunk_index"])
+        blocks.append(headers[filename] + "\n" + "\n\n".join(u["text"] for u in recipe_units))
+    return "\n\n".join(blocks)
+
+def pack_context(chunks, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Packs chunk dicts (row_id, filename, chunk_index, distance_score, text, token_count) into prompt context.
+
+    Returns (context_text, row ids used, stats). Chunks without a stored token_count are counted here.
+    """
+    start = time.perf_counter()
+    candidates = [c for c in chunks if not is_junk_chunk(c["text"])]
+    missing = [c for c in candidates if not c.get("token_count")]
+    if missing:
+        for chunk, count in zip(missing, count_tokens_batch([c["text"] for c in missing], "gpt-4")):
+            chunk["token_count"] = count
+
+    units, deduped = merge_units(candidates)
+    filenames = list(dict.fromkeys(u["filename"] for u in units))
+    headers = {filename: f"### {recipe_title(filename or '')}" for filename in filenames}
+    header_tokens = dict(zip(filenames, count_tokens_batch([headers[f] for f in filenames], "gpt-4")))
+    # Block separators and header newlines are about one token each
+    reserved = sum(header_tokens.values()) + 2 * len(filenames) + len(units)
+    capacity = token_budget - reserved
+
+    fast_path = sum(u["tokens"] for u in units) <= capacity
+    if fast_path:
+        selected = units
+        PACK_STATS["fast_path"] += 1
+    else:
+        weights = [-(-u["tokens"] // KNAPSACK_GRANULARITY) for u in units]  # Round up
+        chosen = knapsack(weights, [u["value"] for u in units], max(capacity, 0) // KNAPSACK_GRANULARITY)
+        selected = [units[i] for i in chosen]
+        PACK_STATS["knapsack"] += 1
+
+    used = {u["filename"] for u in selected}
+    tokens = sum(u["tokens"] for u in selected) + sum(header_tokens[f] + 2 for f in used) + len(selected)
+    context_text = format_blocks(selected, headers)
+    row_ids = [row_id for u in selected for row_id in u["row_ids"]]
+    elapsed_us = (time.perf_counter() - start) * 1e6
+
+    PACK_STATS["packs"] += 1
+    PACK_STATS["chunks_in"] += len(chunks)
+    PACK_STATS["chunks_packed"] += len(row_ids)
+    PACK_STATS["tokens_packed"] += tokens
+    PACK_STATS["tokens_deduped"] += deduped
+    PACK_STATS["total_us"] += elapsed_us
+    stats = {
+        "chunks": len(chunks),
+        "packed_chunks": len(row_ids),
+        "recipes": len(used),
+        "tokens": tokens,
+        "deduped_tokens": deduped,
+        "budget": token_budget,
+        "fast_path": fast_path,
+        "pack_us": round(elapsed_us, 1)
+    }
+    log.debug("📦 Packed %d/%d chunks from %d recipes — %d tokens (%d deduped) in %.0f µs",
+              len(row_ids), len(chunks), len(used), tokens, deduped, elapsed_us)
+    return context_text, row_ids, stats
+
+def get_pack_stats():
+    stats = dict(PACK_STATS)
+    stats["avg_pack_us"] = round(stats["total_us"] / stats["packs"], 1) if stats["packs"] else 0.0
+    return stats
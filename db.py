@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import threading
+import weakref
+
+# Shared SQLite access for the chunk store and the small side databases (embedding cache, query
+# cache, chat sessions). Each thread keeps one open, configured connection per database file, so
+# ingest and serving don't pay connect + PRAGMA cost per operation. When a thread exits, its
+# connections go to a small idle pool per database for the next new thread: servers that start a
+# thread per request (the Flask dev server) reuse them instead of reconnecting every request.
+
+DB_PATH = "recipe_text_chunks.db"
+BATCH_SIZE = 500  # Bound parameters per IN (...) list; stays well under SQLite's limit
+
+MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # Bytes
+CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_KB", "65536"))
+BUSY_TIMEOUT = 10  # Seconds
+IDLE_CONNECTIONS = int(os.getenv("SQLITE_IDLE_CONNECTIONS", "8"))  # Kept per database after their thread exits
+
+_local = threading.local()
+_idle = {}  # Pool key -> connections released by finished threads
+_idle_lock = threading.Lock()
+POOL_STATS = {
+    "connects": 0,
+    "reuses": 0,
+    "handoffs": 0  # Connections a new thread took over from a finished one
+}
+
+class _ThreadMarker:
+    """Lives in a thread's local storage; its finalizer releases the thread's connections at exit."""
+
+def _release_connections(connections):
+    """Moves a finished thread's connections to the idle pool, closing any beyond IDLE_CONNECTIONS."""
+    for key, conn in connections.items():
+        with _idle_lock:
+            idle = _idle.setdefault(key, [])
+            if key != ":memory:" and len(idle) < IDLE_CONNECTIONS:
+                idle.append(conn)
+                continue
+        conn.close()
+    connections.clear()
+
+def configure_connection(conn):
+    """Applies the PRAGMAs every connection in this project runs with."""
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")  # Safe with WAL; commits skip the extra fsync
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE};")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB};")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+
+def _pool_key(db_path):
+    return db_path if db_path == ":memory:" else os.path.abspath(db_path)
+
+def get_connection(db_path=DB_PATH, schema=None):
+    """Returns this thread's connection to db_path, opening and configuring it on first use.
+
+    schema (SQL script) runs once when this thread first gets the connection, for CREATE ... IF NOT EXISTS.
+    Pooled connections are shared by every caller on the thread: use `with conn:` for
+    transactions and don't close them.
+    """
+    connections = _local.__dict__.get("connections")
+    if connections is None:
+        connections = _local.connections = {}
+        _local.marker = _ThreadMarker()
+        weakref.finalize(_local.marker, _release_connections, connections)
+    key = _pool_key(db_path)
+    conn = connections.get(key)
+    if conn is not None:
+        POOL_STATS["reuses"] += 1
+        return conn
+
+    with _idle_lock:
+        idle = _idle.get(key)
+        conn = idle.pop() if idle else None
+    if conn is not None:
+        POOL_STATS["handoffs"] += 1
+    else:
+        # Only one thread uses a connection at a time; it may change threads through the idle pool
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, cached_statements=256, check_same_thread=False)
+        configure_connection(conn)
+        POOL_STATS["connects"] += 1
+    if schema:
+        conn.executescript(schema)
+    connections[key] = conn
+    return conn
+
+def close_connection(db_path=None):
+    """Closes this thread's pooled connection to db_path, or all of them."""
+    connections = _local.__dict__.get("connections", {})
+    keys = list(connections) if db_path is None else [_pool_key(db_path)]
+    for key in keys:
+        conn = connections.pop(key, None)
+        if conn is not None:
+            conn.close()
+
+def select_in(conn, query, ids, params=(), batch_size=BATCH_SIZE):
+    """Runs query once per batch of ids and returns all rows.
+
+    query contains a single {placeholders} marker for the IN list; params are bound before the ids.
+    """
+    ids = list(ids)
+    rows = []
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        rows.extend(conn.execute(
+            query.format(placeholders=",".join("?" * len(batch))), list(params) + batch
+        ).fetchall())
+    return rows
+
+def get_pool_stats():
+    return dict(POOL_STATS)
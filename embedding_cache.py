@@ -0,0 +1,103 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import numpy as np
+from db import get_connection, select_in
+
+# Persistent embedding cache keyed by (model, normalized chunk text).
+# Lives in its own database so it survives setup_text_db.py dropping recipe_embeddings.
+
+EMBEDDING_CACHE_DB = os.getenv("EMBEDDING_CACHE_DB", "embedding_cache.db")
+MAX_CACHE_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+CACHE_STATS = {
+    "hits": 0,
+    "misses": 0,
+    "stores": 0,
+    "evictions": 0
+}
+
+_cache_sizes = {}  # db_path -> entry count, counted once per process and then kept up to date by puts
+_size_lock = threading.Lock()
+
+CACHE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS embedding_cache (
+        cache_key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        embedding BLOB NOT NULL,
+        last_used REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache(last_used);
+"""
+
+def _connect(db_path=EMBEDDING_CACHE_DB):
+    return get_connection(db_path, schema=CACHE_SCHEMA)
+
+def normalize_chunk_text(text):
+    """Collapses whitespace so formatting-only changes still hit the cache."""
+    return re.sub(r"\s+", " ", text).strip()
+
+def cache_key(model, text):
+    """Content address for one chunk under one embedding model."""
+    return hashlib.sha256(f"{model}\0{normalize_chunk_text(text)}".encode("utf-8")).hexdigest()
+
+def get_cached_embeddings(model, texts, db_path=EMBEDDING_CACHE_DB):
+    """Returns {position: float32 vector} for every text already in the cache."""
+    keys = [cache_key(model, text) for text in texts]
+    conn = _connect(db_path)
+    found = dict(select_in(conn, "SELECT cache_key, embedding FROM embedding_cache WHERE cache_key IN ({placeholders})", keys))
+
+    hits = {i: np.frombuffer(found[key], dtype=np.float32) for i, key in enumerate(keys) if key in found}
+    if found:
+        with conn:
+            conn.executemany(
+                "UPDATE embedding_cache SET last_used = ? WHERE cache_key = ?",
+                [(time.time(), key) for key in found]
+            )
+
+    CACHE_STATS["hits"] += len(hits)
+    CACHE_STATS["misses"] += len(texts) - len(hits)
+    return hits
+
+def put_cached_embeddings(model, texts, embeddings, db_path=EMBEDDING_CACHE_DB):
+    """Stores freshly generated embeddings and evicts the least recently used entries over the size cap."""
+    now = time.time()
+    rows = [
+        (cache_key(model, text), model, np.asarray(embedding, dtype=np.float32).tobytes(), now)
+        for text, embedding in zip(texts, embeddings)
+    ]
+    conn = _connect(db_path)
+    with _size_lock, conn:
+        if db_path not in _cache_sizes:
+            _cache_sizes[db_path] = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+        # rowcount of the insert is exactly the number of new entries; keys already cached get refreshed
+        added = conn.executemany(
+            "INSERT OR IGNORE INTO embedding_cache (cache_key, model, embedding, last_used) VALUES (?, ?, ?, ?)",
+            rows
+        ).rowcount
+        if added < len(rows):
+            conn.executemany(
+                "UPDATE embedding_cache SET embedding = ?, last_used = ? WHERE cache_key = ?",
+                [(embedding, last_used, key) for key, _, embedding, last_used in rows]
+            )
+        _cache_sizes[db_path] += added
+
+        overflow = _cache_sizes[db_path] - MAX_CACHE_ENTRIES
+        if overflow > 0:
+            evicted = conn.execute(
+                "DELETE FROM embedding_cache WHERE rowid IN (SELECT rowid FROM embedding_cache ORDER BY last_used ASC LIMIT ?)",
+                (overflow,)
+            ).rowcount
+            _cache_sizes[db_path] -= evicted
+            CACHE_STATS["evictions"] += evicted
+    CACHE_STATS["stores"] += len(rows)
+
+def get_cache_stats():
+    """Returns hit/miss counters plus the hit ratio for this process."""
+    stats = dict(CACHE_STATS)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    return stats
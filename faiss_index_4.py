@@ -1,127 +1,762 @@
-import sqlite3
 import faiss
 import numpy as np
-import json
 import os
 import re
+import json
+import math
+import argparse
+import threading
+import time
+import uuid
+import bisect
+from setup_text_db import migrate_embeddings_to_blob
+from db import DB_PATH, get_connection, select_in
+from keyword_index import build_keyword_index
+from ingredient_index import build_ingredient_index
+from metrics import get_logger, stage_timer
+
+log = get_logger(__name__)
 
 #IMPORTANT: run this command in terminal to create the FAISS index
 #/SlidingWindow/venv/bin/python -c "import faiss_index_4; faiss_index_4.build_and_save_index()"
+# or pick an ANN type:  python faiss_index_4.py --index-type hnsw
+# and compare settings: python faiss_index_4.py --report
 
 # Create FAISS Index from Vector Chunks to prep for Search FAISS
 
-DB_PATH = "recipe_text_chunks.db"
 FAISS_INDEX_FILE = "faiss_index.idx"  # Where the FAISS index is stored
+FAISS_META_FILE = "faiss_index.meta.json"  # Index type and parameters the index was built with
+# Chunk text side table aligned with the index ids, so hits are hydrated without SQL
+CHUNK_STORE_FILE = "faiss_index.chunks.npz"
+CHUNK_STORE_ENABLED = os.getenv("CHUNK_STORE", "1") == "1"
+SECTION_LABEL = re.compile(rb"([A-Z][A-Z ]*[A-Z]):")  # Chunk section header, e.g. b"INGREDIENTS:"
+
+# Index type for new builds: flat (exact), ivf_flat, ivf_pq or hnsw. Loading always follows the meta file.
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+# Similarity metric for new builds: "ip" stores L2-normalized vectors and ranks by cosine similarity,
+# "l2" is the original Euclidean index. Indexes built before the meta file existed are l2.
+METRIC = os.getenv("FAISS_METRIC", "ip")
+DEFAULT_INDEX_PARAMS = {
+    "nlist": None,           # IVF cells; None picks ~4*sqrt(n)
+    "nprobe": 16,            # IVF cells scanned per query
+    "pq_m": 64,              # PQ sub-quantizers; must divide the embedding dimension
+    "pq_nbits": 8,           # Bits per PQ code
+    "hnsw_m": 32,            # HNSW neighbours per node
+    "ef_construction": 80,   # HNSW build-time beam width
+    "ef_search": 64,         # HNSW query-time beam width
+    "train_sample": 50000    # Vectors sampled to train IVF/PQ quantizers
+}
+
+# Process-wide resident index. Readers grab the current tuple in one step, so a
+# swap never hands out a half-loaded index; faiss CPU searches are safe to run
+# concurrently against the same read-only index.
+_index_lock = threading.Lock()
+_resident = (None, None, None, None, 0)  # (index, meta, chunk store, files signature, generation)
+INDEX_METRICS = {
+    "loads": 0,
+    "swaps": 0,
+    "generation": 0,
+    "ntotal": 0,
+    "index_bytes": 0,
+    "last_load_seconds": 0.0,
+    "total_load_seconds": 0.0,
+    "last_swap_at": None,
+    "index_type": None,
+    "metric": None,
+    "chunk_store_rows": 0,
+    "chunk_store_bytes": 0,
+    "chunk_store_misses": 0
+}
+
+def load_embeddings(row_ids=None):
+    """Loads embeddings from SQLite for FAISS indexing, optionally only for the given row ids."""
+    conn = get_connection(DB_PATH)
 
-def load_embeddings():
-    """Loads embeddings from SQLite for FAISS indexing."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+    # One-shot upgrade for databases written before embeddings were stored as BLOBs
+    if conn.execute("SELECT COUNT(*) FROM recipe_embeddings WHERE typeof(embedding) = 'text'").fetchone()[0]:
+        migrate_embeddings_to_blob(DB_PATH)
+
+    query = """
         SELECT id, filename, chunk_index, embedding
         FROM recipe_embeddings
         WHERE is_embedded = 1 AND is_deleted = 0 AND model = ?
-    """, ("text-embedding-ada-002",))
-    
-    ids, metadata, embeddings = [], [], []
-    
-    for row in cursor.fetchall():
-        idx, filename, chunk_index, embedding = row
-        vector = np.array(json.loads(embedding), dtype=np.float32)  # Convert JSON to numpy array
-
-        ids.append(idx)
-        metadata.append((filename, chunk_index))
-        embeddings.append(vector)
-    
-    print(f"📊 Loaded {len(embeddings)} embeddings from the database.")
-    assert all(vec.shape[0] == embeddings[0].shape[0] for vec in embeddings), "Inconsistent embedding dimensions!"
-    conn.close()
-    return np.array(embeddings, dtype=np.float32), ids, metadata
-
-def build_and_save_index():
+    """
+    if row_ids is None:
+        rows = conn.execute(query, ("text-embedding-ada-002",)).fetchall()
+    else:
+        rows = select_in(conn, query + " AND id IN ({placeholders})",
+                         sorted(int(row_id) for row_id in row_ids), ("text-embedding-ada-002",))
+
+    ids = [row[0] for row in rows]
+    metadata = [(row[1], row[2]) for row in rows]
+    blobs = [row[3] for row in rows]
+
+    log.info("📊 Loaded %s embeddings from the database.", len(blobs))
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32), ids, metadata
+
+    assert len({len(blob) for blob in blobs}) == 1, "Inconsistent embedding dimensions!"
+    # Single contiguous copy of all vectors; no per-row parsing
+    embeddings = np.frombuffer(bytearray().join(blobs), dtype=np.float32).reshape(len(blobs), -1)
+    return embeddings, ids, metadata
+
+def resolve_index_params(index_type, n, d, params=None):
+    """Fills in defaults and clamps parameters to what the corpus size and dimension allow."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {INDEX_TYPES}")
+    resolved = dict(DEFAULT_INDEX_PARAMS)
+    resolved.update({key: value for key, value in (params or {}).items() if value is not None})
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = resolved["nlist"] or int(4 * math.sqrt(n))
+        # faiss wants ~39 training points per cell
+        resolved["nlist"] = max(1, min(nlist, n // 39))
+        resolved["nprobe"] = max(1, min(resolved["nprobe"], resolved["nlist"]))
+    if index_type == "ivf_pq":
+        pq_m = min(resolved["pq_m"], d)
+        while d % pq_m:
+            pq_m -= 1
+        resolved["pq_m"] = pq_m
+        resolved["pq_nbits"] = max(1, min(resolved["pq_nbits"], int(math.log2(max(n, 2)))))
+    return resolved
+
+def make_index(index_type, d, params, metric="l2"):
+    """Creates an empty index of the requested type that accepts SQLite row ids."""
+    if index_type == "flat":
+        spec = "IDMap,Flat"
+    elif index_type == "ivf_flat":
+        spec = f"IVF{params['nlist']},Flat"
+    elif index_type == "ivf_pq":
+        spec = f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_nbits']}"
+    else:
+        spec = f"IDMap,HNSW{params['hnsw_m']}"
+
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == "ip" else faiss.METRIC_L2
+    index = faiss.index_factory(d, spec, faiss_metric)
+    if index_type == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efConstruction = params["ef_construction"]
+    return index
+
+def train_index(index, embeddings, sample_size):
+    """Trains IVF/PQ quantizers on a random sample instead of the whole corpus."""
+    if index.is_trained:
+        return
+    n = embeddings.shape[0]
+    if n > sample_size:
+        sample = embeddings[np.random.default_rng(0).choice(n, sample_size, replace=False)]
+    else:
+        sample = embeddings
+    index.train(sample)
+
+def apply_search_params(index, meta, nprobe=None, ef_search=None):
+    """Sets query-time knobs (nprobe / efSearch) from the meta file or explicit overrides."""
+    params = meta.get("params", {})
+    space = faiss.ParameterSpace()
+    if meta.get("index_type") in ("ivf_flat", "ivf_pq"):
+        space.set_index_parameter(index, "nprobe", nprobe or params.get("nprobe", DEFAULT_INDEX_PARAMS["nprobe"]))
+    elif meta.get("index_type") == "hnsw":
+        space.set_index_parameter(index, "efSearch", ef_search or params.get("ef_search", DEFAULT_INDEX_PARAMS["ef_search"]))
+
+def make_id_selector(row_ids):
+    """Returns (selector, buffers to keep alive) accepting exactly row_ids.
+
+    A bitmap over 0..max id is a single bit test per vector and cheap to build from numpy; it is
+    used while it takes no more memory than the id list itself. Sparse id sets use a hash set.
+    """
+    ids = np.asarray(row_ids, dtype=np.int64)
+    max_id = int(ids.max()) if len(ids) else 0
+    if max_id < 64 * len(ids):
+        bits = np.zeros(max_id + 1, dtype=bool)
+        bits[ids] = True
+        packed = np.packbits(bits, bitorder="little")
+        return faiss.IDSelectorBitmap(len(packed), faiss.swig_ptr(packed)), packed
+    return faiss.IDSelectorBatch(ids), ids
+
+def make_search_params(index, meta, row_ids):
+    """Returns (SearchParameters, keepalive) restricting a search to row_ids.
+
+    The selector runs inside the index scan, so excluded vectors are never scored. IVF and HNSW
+    get their own parameter classes carrying the index's current nprobe / efSearch, since a
+    parameter object overrides those. Keep keepalive referenced until the search returns.
+    """
+    selector, buffers = make_id_selector(row_ids)
+    if meta.get("index_type") in ("ivf_flat", "ivf_pq"):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(index).nprobe)
+    elif meta.get("index_type") == "hnsw":
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=faiss.downcast_index(index.index).hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return params, (selector, buffers)
+
+def read_index_meta():
+    """Returns the saved index meta; indexes built before it existed are flat."""
+    if os.path.exists(FAISS_META_FILE):
+        with open(FAISS_META_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"index_type": "flat", "params": {}, "metric": "l2"}
+
+def build_index(embeddings, ids, index_type, params=None, metric=None):
+    """Builds and fills an index in memory. Returns (index, meta).
+
+    For the "ip" metric the embeddings are L2-normalized in place, so inner product is cosine similarity.
+    """
+    metric = metric or METRIC
+    n, d = embeddings.shape
+    params = resolve_index_params(index_type, n, d, params)
+    start = time.perf_counter()
+    if metric == "ip":
+        faiss.normalize_L2(embeddings)
+    index = make_index(index_type, d, params, metric)
+    train_index(index, embeddings, params["train_sample"])
+    index.add_with_ids(embeddings, np.array(ids, dtype=np.int64))
+    meta = {
+        "index_type": index_type,
+        "params": params,
+        "metric": metric,
+        "dim": d,
+        "ntotal": int(index.ntotal),
+        "built_at": time.time(),
+        "build_seconds": round(time.perf_counter() - start, 3)
+    }
+    apply_search_params(index, meta)
+    return index, meta
+
+def build_and_save_index(index_type=None, params=None, metric=None):
     """Builds FAISS index and saves it to disk with correct SQLite row mappings."""
     embeddings, ids, metadata = load_embeddings()
 
     if embeddings.shape[0] == 0:
-        print("❌ No embeddings loaded. Skipping FAISS index creation.")
+        log.error("❌ No embeddings loaded. Skipping FAISS index creation.")
         return
 
-    # Create a FAISS index (L2 distance)
-    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index_type = index_type or INDEX_TYPE
+    index, meta = build_index(embeddings, ids, index_type, params, metric)
 
-    # Convert IDs to numpy array (FAISS requires 32-bit integers)
-    id_map = np.array(ids, dtype=np.int32)
+    # Debug log just before writing the index
+    log.info("💾 Preparing to write %s/%s FAISS index with %s vectors to %s (%s)", index_type, meta['metric'], len(ids), FAISS_INDEX_FILE, meta['params'])
+    if write_index(index, meta):
+        log.info("✅ FAISS index saved with %s vectors, mapped to SQLite row IDs.", len(ids))
 
-    # FAISS index should store row mappings
-    index = faiss.IndexIDMap(index)
-    index.add_with_ids(embeddings, id_map)
+def write_index(index, meta=None, changes=None):
+    """Saves the index (and its meta) to disk atomically. Returns True on success.
 
-    # Debug log just before writing the index
-    print(f"💾 Preparing to write FAISS index with {len(ids)} vectors to {FAISS_INDEX_FILE}")
-    # Save the index to disk with error handling
+    changes is (added_ids, removed_ids) for an incremental update: the chunk store, keyword and
+    ingredient tables are then patched for those rows' recipes instead of rebuilt.
+    """
     try:
-        faiss.write_index(index, FAISS_INDEX_FILE)
-        print(f"✅ FAISS index saved with {len(ids)} vectors, mapped to SQLite row IDs.")
+        # Side tables first and meta last: the meta records the index file's signature, and serving
+        # processes only swap to an index its meta vouches for. The shared version ties the meta
+        # to the chunk store.
+        if meta is not None:
+            previous_version = meta.get("version")
+            meta["ntotal"] = int(index.ntotal)
+            meta["version"] = uuid.uuid4().hex
+            if changes is None:
+                if CHUNK_STORE_ENABLED:
+                    write_chunk_store(meta["version"])
+                build_keyword_index()
+                build_ingredient_index()
+            else:
+                added_ids, removed_ids = changes
+                if CHUNK_STORE_ENABLED:
+                    patch_chunk_store(previous_version, meta["version"], added_ids, removed_ids)
+                filenames = changed_filenames(list(added_ids) + list(removed_ids))
+                build_keyword_index(filenames)
+                build_ingredient_index(filenames=filenames)
+
+        # Write to a temp file and rename so a serving process never reads a partial index
+        tmp_path = FAISS_INDEX_FILE + ".tmp"
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, FAISS_INDEX_FILE)
+
+        if meta is not None:
+            meta["index_signature"] = list(_index_file_signature())
+            tmp_meta_path = FAISS_META_FILE + ".tmp"
+            with open(tmp_meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, indent=2)
+            os.replace(tmp_meta_path, FAISS_META_FILE)
+        return True
     except Exception as e:
-        print(f"❌ Failed to write FAISS index: {e}")
+        log.error("❌ Failed to write FAISS index: %s", e)
+        return False
+
+def changed_filenames(row_ids):
+    """Recipes the given rows (live or soft-deleted) belong to."""
+    rows = select_in(
+        get_connection(DB_PATH), "SELECT DISTINCT filename FROM recipe_embeddings WHERE id IN ({placeholders})",
+        sorted({int(row_id) for row_id in row_ids})
+    )
+    return sorted({row[0] for row in rows})
+
+def update_index(added_ids, removed_ids):
+    """Applies incremental add/remove operations to the saved index instead of rebuilding it."""
+    if not os.path.exists(FAISS_INDEX_FILE):
+        log.warning("⚠️ FAISS index not found. Building it from scratch...")
+        build_and_save_index()
+        return
+
+    meta = read_index_meta()
+    if removed_ids and meta["index_type"] == "hnsw":
+        # HNSW graphs can't drop vectors, so removals mean a rebuild with the same settings
+        log.warning("⚠️ HNSW index does not support removals. Rebuilding...")
+        build_and_save_index(meta["index_type"], meta.get("params"), meta.get("metric", "l2"))
+        return
+
+    index = faiss.read_index(FAISS_INDEX_FILE)
+    removed = 0
+    if removed_ids:
+        removed = index.remove_ids(np.array(sorted(removed_ids), dtype=np.int64))
+
+    embeddings, ids, metadata = load_embeddings(row_ids=added_ids)
+    if ids:
+        if meta.get("metric", "l2") == "ip":
+            faiss.normalize_L2(embeddings)
+        index.add_with_ids(embeddings, np.array(ids, dtype=np.int64))
+
+    if write_index(index, meta, changes=(ids, removed_ids)):
+        log.info("✅ FAISS index updated: +%s / -%s vectors (%s total).", len(ids), removed, index.ntotal)
+
+def migrate_index_to_cosine():
+    """Rebuilds an existing L2 index as an inner-product index over normalized vectors.
+
+    Keeps the index type and parameters; the vectors come from SQLite, so no re-embedding is needed.
+    """
+    meta = read_index_meta()
+    if meta.get("metric", "l2") == "ip":
+        log.info("✅ FAISS index already uses cosine similarity.")
+        return
+    log.info("🔄 Migrating %s index from L2 to cosine similarity...", meta['index_type'])
+    build_and_save_index(meta["index_type"], meta.get("params"), metric="ip")
+
+CHUNK_QUERY = """
+    SELECT id, filename, chunk_index, content, token_count
+    FROM recipe_embeddings
+    WHERE is_embedded = 1 AND is_deleted = 0 AND model = ?{scope}
+    ORDER BY id
+"""
+
+def write_chunk_store(version):
+    """Writes the text of every indexed chunk as one UTF-8 buffer plus id-sorted offset/metadata arrays."""
+    rows = get_connection(DB_PATH).execute(CHUNK_QUERY.format(scope=""), ("text-embedding-ada-002",)).fetchall()
+    save_chunk_store(version, [(row[0], row[1], row[2], row[3].encode("utf-8"), row[4]) for row in rows])
+
+def patch_chunk_store(previous_version, version, added_ids, removed_ids):
+    """Rewrites the chunk store for an incremental update: only the added rows are read from SQLite.
+
+    Falls back to write_chunk_store when the saved store doesn't belong to previous_version.
+    """
+    if not previous_version or not os.path.exists(CHUNK_STORE_FILE):
+        write_chunk_store(version)
+        return
+    with np.load(CHUNK_STORE_FILE, allow_pickle=False) as data:
+        if str(data["version"]) != previous_version:
+            write_chunk_store(version)
+            return
+        ids, offsets, text = data["ids"], data["offsets"], data["text"].tobytes()
+        filenames, file_idx = data["filenames"], data["file_idx"]
+        chunk_index, token_count = data["chunk_index"], data["token_count"]
+
+    # Re-added ids are dropped too, so their rows come fresh from SQLite
+    dropped = np.array(sorted({int(row_id) for row_id in list(added_ids) + list(removed_ids)}), dtype=np.int64)
+    kept = np.flatnonzero(~np.isin(ids, dropped)).tolist()
+    rows = [
+        (int(ids[p]), str(filenames[file_idx[p]]), int(chunk_index[p]), text[offsets[p]:offsets[p + 1]], int(token_count[p]))
+        for p in kept
+    ]
+    added = select_in(
+        get_connection(DB_PATH), CHUNK_QUERY.format(scope=" AND id IN ({placeholders})"),
+        sorted({int(row_id) for row_id in added_ids}), params=("text-embedding-ada-002",)
+    )
+    rows.extend((row[0], row[1], row[2], row[3].encode("utf-8"), row[4]) for row in added)
+    rows.sort(key=lambda row: row[0])
+    save_chunk_store(version, rows)
+
+def save_chunk_store(version, rows):
+    """Saves id-sorted (id, filename, chunk_index, UTF-8 content, token_count) rows as the chunk store."""
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row[3]) for row in rows], out=offsets[1:])
+    filenames, file_idx = np.unique(np.array([row[1] for row in rows], dtype=str), return_inverse=True)
+
+    tmp_path = CHUNK_STORE_FILE + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        version=np.array(version),
+        ids=np.array([row[0] for row in rows], dtype=np.int64),
+        offsets=offsets,
+        text=np.frombuffer(b"".join(row[3] for row in rows), dtype=np.uint8),
+        filenames=filenames,
+        file_idx=file_idx.astype(np.int32),
+        chunk_index=np.array([row[2] for row in rows], dtype=np.int32),
+        token_count=np.array([row[4] or 0 for row in rows], dtype=np.int32)
+    )
+    os.replace(tmp_path, CHUNK_STORE_FILE)
+    log.info("🗂️ Chunk store written with %s chunks (%s bytes of text).", len(rows), offsets[-1])
+
+def load_chunk_store(version):
+    """Loads the side table if it belongs to the given index version, else returns None.
+
+    The arrays become plain lists in memory: hydrating a handful of hits with bisect over lists is
+    several times faster than the equivalent numpy fancy indexing.
+    """
+    if not CHUNK_STORE_ENABLED or not version or not os.path.exists(CHUNK_STORE_FILE):
+        return None
+    with np.load(CHUNK_STORE_FILE, allow_pickle=False) as data:
+        if str(data["version"]) != version:
+            log.warning("⚠️ Chunk store does not match the index version; hydrating hits from SQLite.")
+            return None
+        store = {key: data[key].tolist() for key in ("ids", "offsets", "filenames", "file_idx", "chunk_index", "token_count")}
+        store["text"] = data["text"].tobytes()
+
+    # Row ids per recipe and per section label, for scoped searches
+    store["file_rows"], store["label_rows"] = {}, {}
+    text, offsets = store["text"], store["offsets"]
+    for p, row_id in enumerate(store["ids"]):
+        store["file_rows"].setdefault(store["filenames"][store["file_idx"][p]], []).append(row_id)
+        label = SECTION_LABEL.match(text, offsets[p], min(offsets[p + 1], offsets[p] + 64))
+        if label:
+            store["label_rows"].setdefault(label.group(1).decode("ascii"), []).append(row_id)
+    return store
+
+def lookup_chunks(store, row_ids):
+    """Returns {row_id: (filename, chunk_index, content, token_count)} for ids present in the store."""
+    ids, offsets, text = store["ids"], store["offsets"], store["text"]
+    chunks = {}
+    for row_id in row_ids:
+        row_id = int(row_id)
+        p = bisect.bisect_left(ids, row_id)
+        if p < len(ids) and ids[p] == row_id:
+            chunks[row_id] = (
+                store["filenames"][store["file_idx"][p]],
+                store["chunk_index"][p],
+                text[offsets[p]:offsets[p + 1]].decode("utf-8"),
+                store["token_count"][p]
+            )
+    return chunks
 
 def load_faiss_index():
     """Loads FAISS index from disk, or rebuilds it if missing."""
     if os.path.exists(FAISS_INDEX_FILE):
-        print(f"🔄 Loading FAISS index from {FAISS_INDEX_FILE}...")
+        log.info("🔄 Loading FAISS index from %s...", FAISS_INDEX_FILE)
         index = faiss.read_index(FAISS_INDEX_FILE)
-        print(f"✅ FAISS index loaded with {index.ntotal} vectors.")
+        log.info("✅ FAISS index loaded with %s vectors.", index.ntotal)
     else:
-        print("⚠️ FAISS index not found. Rebuilding...")
+        log.warning("⚠️ FAISS index not found. Rebuilding...")
         build_and_save_index()
         index = faiss.read_index(FAISS_INDEX_FILE)
-        print(f"✅ FAISS index rebuilt with {index.ntotal} vectors.")
-    
+        log.info("✅ FAISS index rebuilt with %s vectors.", index.ntotal)
+
     return index
 
-def search_faiss(query_embedding, top_k=5):
-    """Finds the most relevant text chunks using FAISS and retrieves correct content."""
-    index = load_faiss_index()
-    query_vector = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+def _index_file_signature(path=FAISS_INDEX_FILE):
+    """Returns a cheap change marker for the index file (or another path), or None if it is missing."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _files_signature():
+    """Change marker over the index and its meta; either file changing triggers a reload."""
+    return _index_file_signature(), _index_file_signature(FAISS_META_FILE)
+
+def _meta_matches_index(meta):
+    """False while a write is between its index and meta renames. Metas written before the
+    signature was recorded are trusted."""
+    expected = meta.get("index_signature")
+    return expected is None or tuple(expected) == _index_file_signature()
+
+def get_resident_index():
+    """Returns (index, meta) for the resident index, loading it once and hot-swapping when the file changes."""
+    return get_resident_state()[:2]
+
+def get_resident_state():
+    """Returns (index, meta, chunk store) from one resident snapshot; the store may be None."""
+    global _resident
+    index, meta, chunks, signature, generation = _resident
+    current = _files_signature()
+    if index is not None and current == signature:
+        return index, meta, chunks
+
+    with _index_lock:
+        # Another thread may have swapped while we waited for the lock
+        index, meta, chunks, signature, generation = _resident
+        current = _files_signature()
+        if index is not None and current == signature:
+            return index, meta, chunks
+
+        # Mid-write (new index, old meta): keep serving the old index and retry on the next call
+        if index is not None and not _meta_matches_index(read_index_meta()):
+            log.warning("⚠️ FAISS index file doesn't match its meta yet; keeping generation %s.", generation)
+            return index, meta, chunks
+
+        start = time.perf_counter()
+        loaded = _index_file_signature()
+        new_index = load_faiss_index()
+        new_meta = read_index_meta()
+        if loaded is None:
+            current = _files_signature()  # load_faiss_index just built both files
+        if index is not None and (_index_file_signature() != loaded or not _meta_matches_index(new_meta)):
+            return index, meta, chunks  # Another write landed while the index was being read
+        apply_search_params(new_index, new_meta)
+        new_chunks = load_chunk_store(new_meta.get("version"))
+        elapsed = time.perf_counter() - start
+
+        generation += 1
+        _resident = (new_index, new_meta, new_chunks, current, generation)
+
+        INDEX_METRICS["loads"] += 1
+        if index is not None:
+            INDEX_METRICS["swaps"] += 1
+            INDEX_METRICS["last_swap_at"] = time.time()
+            log.info("🔁 FAISS index swapped to generation %s (%s vectors).", generation, new_index.ntotal)
+        INDEX_METRICS["generation"] = generation
+        INDEX_METRICS["ntotal"] = int(new_index.ntotal)
+        INDEX_METRICS["index_bytes"] = os.path.getsize(FAISS_INDEX_FILE)
+        INDEX_METRICS["index_type"] = new_meta["index_type"]
+        INDEX_METRICS["metric"] = new_meta.get("metric", "l2")
+        INDEX_METRICS["last_load_seconds"] = round(elapsed, 6)
+        INDEX_METRICS["total_load_seconds"] = round(INDEX_METRICS["total_load_seconds"] + elapsed, 6)
+        INDEX_METRICS["chunk_store_rows"] = len(new_chunks["ids"]) if new_chunks else 0
+        INDEX_METRICS["chunk_store_bytes"] = len(new_chunks["text"]) if new_chunks else 0
+        return new_index, new_meta, new_chunks
 
-    distances, indices = index.search(query_vector, top_k)
+def get_faiss_index():
+    """Returns the resident FAISS index (see get_resident_index)."""
+    return get_resident_index()[0]
 
-    print(f"🔍 Searching FAISS returned indices (Mapped IDs as row_id): {indices[0]}")  # Debugging
+def get_index_generation():
+    """Returns the generation of the resident index; it changes every time the index is swapped."""
+    return _resident[4]
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def get_index_metrics():
+    """Returns a snapshot of resident index load/swap metrics."""
+    return dict(INDEX_METRICS)
 
-    results = []
-    for i in range(top_k):
-        row_id = int(indices[0][i])  # Correctly storing as row_id
-        if row_id < 0:  # FAISS may return -1 if no matches
-            continue
+def to_similarity(scores, metric):
+    """Converts raw FAISS scores to cosine similarity.
 
-        # Debug: Print the ID FAISS is trying to fetch
-        print(f"🧐 Fetching text for SQLite row ID: {row_id}")
+    Inner product over normalized vectors already is cosine; for L2 indexes over unit-length
+    embeddings (ada's are) the squared distance is 2 - 2*cos.
+    """
+    if metric == "ip":
+        return scores
+    return 1.0 - scores / 2.0
 
-        # Query updated to fetch using the correct ID column
-        cursor.execute("""
-            SELECT id, filename, chunk_index, content
-            FROM recipe_embeddings
-            WHERE id = ?
-            """, (row_id,))  # Only using id, not chunk_index
+def fetch_chunks_by_ids(row_ids):
+    """Returns {row_id: (filename, chunk_index, content, token_count)} using batched IN (...) queries.
 
-        row = cursor.fetchone()
+    Soft-deleted rows are left out, so a stale hit or context ref never brings back a removed chunk.
+    """
+    row_ids = sorted({int(row_id) for row_id in row_ids})
+    chunks = {}
+    if not row_ids:
+        return chunks
+    rows = select_in(
+        get_connection(DB_PATH),
+        "SELECT id, filename, chunk_index, content, token_count FROM recipe_embeddings "
+        "WHERE is_deleted = 0 AND id IN ({placeholders})",
+        row_ids
+    )
+    chunks.update({row[0]: row[1:] for row in rows})
+    return chunks
 
-        if row:
+def get_chunks(row_ids, store=None):
+    """Hydrates row ids from the resident chunk store, falling back to SQLite for anything it lacks."""
+    store = store if store is not None else _resident[2]
+    chunks = lookup_chunks(store, row_ids) if store is not None else {}
+    missing = [row_id for row_id in row_ids if int(row_id) not in chunks]
+    if missing:
+        INDEX_METRICS["chunk_store_misses"] += len(missing)
+        chunks.update(fetch_chunks_by_ids(missing))
+    return chunks
+
+def normalize_label(label):
+    """"ingredients:" / "Ingredients" -> "INGREDIENTS", the form section headers are stored in."""
+    return label.strip().rstrip(":").strip().upper()
+
+def get_scope_row_ids(filenames=None, labels=None):
+    """Live row ids of chunks in any of filenames and starting with any of the section labels.
+
+    A criterion left as None doesn't restrict. Answered from the chunk store's per-recipe and
+    per-label lists when it is resident, otherwise from SQLite.
+    """
+    labels = None if labels is None else {normalize_label(label) for label in labels}
+    store = get_resident_state()[2]
+    scopes = []
+    if store is not None:
+        if filenames is not None:
+            scopes.append({row_id for filename in filenames for row_id in store["file_rows"].get(filename, ())})
+        if labels is not None:
+            scopes.append({row_id for label in labels for row_id in store["label_rows"].get(label, ())})
+    else:
+        conn = get_connection(DB_PATH)
+        live = "SELECT id FROM recipe_embeddings WHERE is_embedded = 1 AND is_deleted = 0"
+        if filenames is not None:
+            scopes.append({row[0] for row in select_in(conn, live + " AND filename IN ({placeholders})", list(filenames))})
+        if labels is not None and labels:
+            condition = " OR ".join("content LIKE ?" for _ in labels)
+            scopes.append({row[0] for row in conn.execute(f"{live} AND ({condition})", [label + ":%" for label in labels])})
+        elif labels is not None:
+            scopes.append(set())
+    if not scopes:
+        return None
+    return sorted(set.intersection(*scopes))
+
+def search_faiss_batch(query_embeddings, top_k=5, row_ids=None, timings=None):
+    """Searches N query vectors in one index.search call and hydrates all hits with one query.
+
+    row_ids, if given, restricts the search to those SQLite row ids (see make_search_params).
+    The search and the hydration are timed as the "ann" and "hydrate" stages (see metrics).
+    Returns one result list per query, each shaped like search_faiss's.
+    """
+    if row_ids is not None and len(row_ids) == 0:
+        return [[] for _ in query_embeddings]
+    index, meta, store = get_resident_state()
+    metric = meta.get("metric", "l2")
+    query_matrix = np.array(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+    if metric == "ip":
+        faiss.normalize_L2(query_matrix)
+
+    with stage_timer(timings, "ann"):
+        if row_ids is not None:
+            search_params, keepalive = make_search_params(index, meta, row_ids)
+            scores, indices = index.search(query_matrix, top_k, params=search_params)
+        else:
+            scores, indices = index.search(query_matrix, top_k)
+    similarities = to_similarity(scores, metric)
+    distances = 1.0 - scores if metric == "ip" else scores
+
+    # FAISS may return -1 if no matches
+    hit_ids = {int(row_id) for row_id in indices.ravel() if row_id >= 0}
+    log.debug("🔍 Searching FAISS for %s queries returned %s distinct row IDs", len(query_matrix), len(hit_ids))
+    with stage_timer(timings, "hydrate"):
+        chunks = get_chunks(hit_ids, store)
+
+    batch_results = []
+    for q in range(len(query_matrix)):
+        results = []
+        for i in range(top_k):
+            row_id = int(indices[q][i])
+            if row_id < 0:
+                continue
+            row = chunks.get(row_id)
+            if row is None:
+                log.warning("⚠️ No matching text found for SQLite row ID %s.", row_id)
+                continue
             results.append({
-                "row_id": row[0],  # Explicitly storing row_id
-                "chunk_index": row[2],
-                "filename": row[1],
-                "text": row[3],
-                "distance": float(distances[0][i])
+                "row_id": row_id,
+                "chunk_index": row[1],
+                "filename": row[0],
+                "text": row[2],
+                "token_count": row[3],
+                "distance": float(distances[q][i]),
+                "similarity": float(similarities[q][i])
             })
-        else:
-            print(f"⚠️ No matching text found for SQLite row ID {row_id}.")
+        batch_results.append(results)
+    return batch_results
+
+def search_faiss(query_embedding, top_k=5, row_ids=None, timings=None):
+    """Finds the most relevant text chunks using FAISS and retrieves correct content.
 
-    conn.close()
-    return results
+    Each hit carries "similarity" (cosine, higher is better) and "distance" (1 - similarity for
+    cosine indexes, raw L2 otherwise), so ascending distance is always best-first.
+    row_ids limits the search to those SQLite row ids.
+    """
+    return search_faiss_batch([query_embedding], top_k=top_k, row_ids=row_ids, timings=timings)[0]
+
+def recall_report(configs=None, k=10, n_queries=200):
+    """Compares recall@k and per-query latency of ANN settings against the exact flat index."""
+    embeddings, ids, metadata = load_embeddings()
+    n = embeddings.shape[0]
+    if n == 0:
+        print("❌ No embeddings loaded. Nothing to report.")
+        return []
+    k = min(k, n)
+
+    # Perturbed copies of stored vectors stand in for real queries
+    rng = np.random.default_rng(1)
+    sample = embeddings[rng.choice(n, min(n_queries, n), replace=False)]
+    queries = (sample + rng.normal(0, 0.01, sample.shape)).astype(np.float32)
+
+    if configs is None:
+        configs = [
+            ("flat", {}),
+            ("ivf_flat", {"nprobe": 1}), ("ivf_flat", {"nprobe": 8}), ("ivf_flat", {"nprobe": 32}),
+            ("ivf_pq", {"nprobe": 8}), ("ivf_pq", {"nprobe": 32}),
+            ("hnsw", {"ef_search": 16}), ("hnsw", {"ef_search": 64}), ("hnsw", {"ef_search": 256})
+        ]
+
+    # build_index normalizes embeddings in place for "ip"; queries get the same treatment
+    if METRIC == "ip":
+        faiss.normalize_L2(queries)
+    baseline, _ = build_index(embeddings, ids, "flat")
+    _, ground_truth = baseline.search(queries, k)
+
+    # Configs that differ only in search knobs share one built index
+    built = {}
+    rows = []
+    for index_type, params in configs:
+        build_params = {key: value for key, value in params.items() if key not in ("nprobe", "ef_search")}
+        build_key = (index_type, json.dumps(build_params, sort_keys=True))
+        if build_key not in built:
+            built[build_key] = build_index(embeddings, ids, index_type, build_params)
+        index, meta = built[build_key]
+        apply_search_params(index, meta, nprobe=params.get("nprobe"), ef_search=params.get("ef_search"))
+
+        latencies = []
+        found = np.empty((len(queries), k), dtype=np.int64)
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            _, labels = index.search(queries[i:i + 1], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found[i] = labels[0]
+
+        recall = float(np.mean([len(set(found[i]) & set(ground_truth[i])) / k for i in range(len(queries))]))
+        rows.append({
+            "index_type": index_type,
+            "params": params,
+            "build_seconds": meta["build_seconds"],
+            f"recall@{k}": round(recall, 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 4)
+        })
+
+    print(f"📈 Recall@{k} vs latency over {len(queries)} queries, {n} vectors:")
+    for row in rows:
+        print(f"  {row['index_type']:<9} {json.dumps(row['params']):<22} build {row['build_seconds']:>7}s  "
+              f"recall {row[f'recall@{k}']:.4f}  p50 {row['p50_ms']:.4f}ms  p99 {row['p99_ms']:.4f}ms")
+    return rows
 
 if __name__ == "__main__":
-    build_and_save_index()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the FAISS index or compare ANN settings.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_TYPE)
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--nprobe", type=int)
+    parser.add_argument("--pq-m", type=int)
+    parser.add_argument("--pq-nbits", type=int)
+    parser.add_argument("--hnsw-m", type=int)
+    parser.add_argument("--ef-construction", type=int)
+    parser.add_argument("--ef-search", type=int)
+    parser.add_argument("--train-sample", type=int)
+    parser.add_argument("--metric", choices=("ip", "l2"), default=METRIC)
+    parser.add_argument("--migrate-cosine", action="store_true", help="Rebuild an existing L2 index as a cosine index")
+    parser.add_argument("--report", action="store_true", help="Print a recall@k vs latency report instead of building")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.report:
+        recall_report(k=args.k)
+    elif args.migrate_cosine:
+        migrate_index_to_cosine()
+    else:
+        build_and_save_index(args.index_type, {
+            "nlist": args.nlist,
+            "nprobe": args.nprobe,
+            "pq_m": args.pq_m,
+            "pq_nbits": args.pq_nbits,
+            "hnsw_m": args.hnsw_m,
+            "ef_construction": args.ef_construction,
+            "ef_search": args.ef_search,
+            "train_sample": args.train_sample
+        }, metric=args.metric)
@@ -0,0 +1,133 @@
+import argparse
+import base64
+import hashlib
+import json
+import time
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI embeddings and chat completions endpoints so the ingest pipeline
+# and the chat servers can be benchmarked offline.
+# Usage:
+#   python fake_openai_server.py --port 8900 --latency-ms 150 --token-ms 20
+#   OPENAI_BASE_URL=http://localhost:8900/v1 python generate_embeddings_3.py
+
+EMBEDDING_DIM = 1536
+LATENCY_SECONDS = 0.0
+TOKEN_SECONDS = 0.0  # Delay between streamed chat tokens
+ANSWER_TOKENS = 120
+
+def fake_embedding(text, dim=EMBEDDING_DIM):
+    """Deterministic unit-length vector derived from the text, like ada's normalized output."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        if self.path.rstrip("/").endswith("/embeddings"):
+            self.handle_embeddings(self._read_json())
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            self.handle_chat(self._read_json())
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def handle_embeddings(self, payload):
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(LATENCY_SECONDS)
+
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text)
+            if payload.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        tokens = sum(len(text.split()) for text in inputs)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        })
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def handle_chat(self, payload):
+        """Answers with a canned HTML paragraph, streamed as SSE chunks when stream=true."""
+        model = payload.get("model", "gpt-4o")
+        words = [f"word{i} " for i in range(ANSWER_TOKENS)]
+        time.sleep(LATENCY_SECONDS)
+
+        if not payload.get("stream"):
+            content = "<p>" + "".join(words) + "</p>"
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)}
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, text in enumerate(["<p>"] + words + ["</p>"]):
+            event = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]
+            }
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            if i and TOKEN_SECONDS:
+                time.sleep(TOKEN_SECONDS)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+def main():
+    global LATENCY_SECONDS, TOKEN_SECONDS, ANSWER_TOKENS
+    parser = argparse.ArgumentParser(description="Fake OpenAI API server for offline benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Simulated latency per request")
+    parser.add_argument("--token-ms", type=float, default=10.0, help="Delay between streamed chat tokens")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="Length of the canned chat answer")
+    args = parser.parse_args()
+
+    LATENCY_SECONDS = args.latency_ms / 1000
+    TOKEN_SECONDS = args.token_ms / 1000
+    ANSWER_TOKENS = args.answer_tokens
+    server = ThreadingHTTPServer((args.host, args.port), FakeOpenAIHandler)
+    print(f"🧪 Fake OpenAI server listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,17 @@ import openai
 import time
 import os
 import json
-import tiktoken  # Tokenizer to count tokens
+import threading
+import numpy as np
 import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from collections import defaultdict
+from collections import Counter, defaultdict
+from embedding_cache import get_cached_embeddings, put_cached_embeddings, get_cache_stats
+from tokenization import get_encoding
+from db import DB_PATH, get_connection
 
-#Step 3: Generating Embeddings from Text Chunks to create Vector Chunks for the vector_chunks table. 
+#Step 3: Generating Embeddings from Text Chunks to create Vector Chunks for the vector_chunks table.
 
 # Load API Key
 load_dotenv()
@@ -16,20 +21,32 @@ API_KEY = os.getenv("OPENAI_API_KEY")
 if not API_KEY:
     raise ValueError("OpenAI API key is missing. Ensure it is set in the .env file.")
 
+# Set OPENAI_BASE_URL (e.g. http://localhost:8900/v1 for fake_openai_server.py) to benchmark offline
 client = openai.OpenAI(api_key=API_KEY)
 
-DB_PATH = "recipe_text_chunks.db"
+EMBEDDING_MODEL = "text-embedding-ada-002"
 MAX_TOKENS = 2000  # Reduce per-chunk size to minimize memory overload
 OVERLAP_TOKENS = 100  # Overlapping tokens for continuity
 
+# Batching and concurrency limits (the embeddings API accepts up to 2048 inputs per request)
+MAX_BATCH_INPUTS = int(os.getenv("EMBED_BATCH_INPUTS", "256"))
+MAX_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "200000"))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("EMBED_CONCURRENCY", "4"))
+MAX_REQUESTS_PER_MINUTE = int(os.getenv("EMBED_REQUESTS_PER_MINUTE", "500"))
+
+_rate_lock = threading.Lock()
+_next_request_at = 0.0
+
 def count_tokens(text):
     """Returns the number of tokens in a given text using OpenAI's tokenizer."""
-    enc = tiktoken.encoding_for_model("text-embedding-ada-002")
-    return len(enc.encode(text))
+    return len(get_encoding(EMBEDDING_MODEL).encode(text))
 
 def split_large_text(text, max_tokens=1024, overlap=100, seen_hashes=None):
-    """Splits text into chunks with reduced overlap to prevent duplication."""
-    enc = tiktoken.encoding_for_model("text-embedding-ada-002")
+    """Splits text into chunks with reduced overlap to prevent duplication.
+
+    Yields (sub_index, chunk_text, token_count) so callers don't re-encode the pieces.
+    """
+    enc = get_encoding(EMBEDDING_MODEL)
     tokens = enc.encode(text)
     start = 0
     sub_index = 0
@@ -45,89 +62,58 @@ def split_large_text(text, max_tokens=1024, overlap=100, seen_hashes=None):
         # Generate hash for uniqueness check
         chunk_hash = hashlib.md5(chunk_text.encode()).hexdigest()
         if chunk_hash not in seen_hashes:
-            yield sub_index, chunk_text
+            yield sub_index, chunk_text, len(chunk_tokens)
             seen_hashes.add(chunk_hash)
 
         sub_index += 1
         start += (max_tokens - overlap)  # Reduce overlap progression
 
-def fetch_text_chunks():
-    """Fetches chunks one at a time from the database to prevent memory overload."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, filename, chunk_index, content FROM recipe_embeddings WHERE is_embedded = 0 AND is_deleted = 0 ORDER BY filename, chunk_index ASC")
-
-    while True:
-        row = cursor.fetchone()
-        if not row:
-            break
-        yield row  # Yields only one row at a time instead of loading all into memory
+def fetch_text_chunks(filenames=None):
+    """Fetches chunks one at a time from the database to prevent memory overload.
 
-    conn.close()
+    With filenames, only the pending chunks of those flattened files are fetched.
+    """
+    conn = get_connection(DB_PATH)
+    query = "SELECT id, filename, chunk_index, content, token_count FROM recipe_embeddings WHERE is_embedded = 0 AND is_deleted = 0"
+    if filenames is None:
+        cursors = [conn.execute(f"{query} ORDER BY filename, chunk_index ASC")]
+    else:
+        # One query per file keeps rows streaming and uses the (filename, chunk_index) index
+        cursors = (conn.execute(f"{query} AND filename = ? ORDER BY chunk_index ASC", (filename,)) for filename in sorted(filenames))
 
-def store_embedding(id, filename, chunk_index, content, embedding, model="text-embedding-ada-002"):
-    """Stores a single embedding in SQLite, ensuring no duplicates and avoiding lock issues."""
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH, timeout=10)
-        cursor = conn.cursor()
-
-        # Ensure WAL mode is enabled (Write-Ahead Logging)
-        cursor.execute("PRAGMA journal_mode=WAL;")
+    for cursor in cursors:
+        while True:
+            row = cursor.fetchone()
+            if not row:
+                break
+            yield row  # Yields only one row at a time instead of loading all into memory
 
-        cursor.execute(
-            "UPDATE recipe_embeddings SET embedding = ?, model = ?, is_embedded = 1, created_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (json.dumps(embedding), model, id)
-        )
-        conn.commit()
-
-    except sqlite3.IntegrityError:
-        print(f"⚠️ Skipping duplicate chunk {chunk_index} for {filename}")
-    except sqlite3.OperationalError as e:
-        print(f"⚠️ Database error: {e}")
-    finally:
-        if conn:
-            conn.close()  # Ensure connection is always closed
-
-def generate_and_store_embeddings():
-    """Processes text chunks sequentially, preventing RAM overload and duplicates."""
+def collect_embedding_jobs(filenames=None):
+    """Turns pending rows into embedding jobs, splitting oversized chunks and skipping duplicates."""
     seen_chunks_per_file = defaultdict(set)  # Track unique chunks per filename
+    jobs = []
 
-    for id, filename, chunk_index, content in fetch_text_chunks():
-        token_count = count_tokens(content)
+    for id, filename, chunk_index, content, token_count in fetch_text_chunks(filenames):
+        # Chunks stored by split_recipe_text_2.py already carry their count (same cl100k encoding)
+        if not token_count:
+            token_count = count_tokens(content)
 
         if token_count > MAX_TOKENS:
             print(f"⚠️ Chunk {chunk_index} is too large ({token_count} tokens). Splitting...")
-            # Pass the seen set for this filename to split_large_text to avoid duplicates within the file
-            for sub_index, sub_chunk in split_large_text(content, max_tokens=MAX_TOKENS, overlap=OVERLAP_TOKENS, seen_hashes=seen_chunks_per_file[filename]):
-                indexed_chunk = f"{chunk_index}.{sub_index}"
-
-                # Ensure we aren't embedding duplicate chunks within the same filename
-                chunk_hash = hashlib.md5(sub_chunk.encode()).hexdigest()
-                if chunk_hash in seen_chunks_per_file[filename]:
-                    print(f"⚠️ Skipping duplicate chunk {indexed_chunk} for {filename}")
-                    continue
-                seen_chunks_per_file[filename].add(chunk_hash)
-
-                print(f"🔄 Generating embedding for {filename} - Chunk {indexed_chunk}...")
-                embedding = None
-                for attempt in range(3):
-                    try:
-                        response = client.embeddings.create(
-                            model="text-embedding-ada-002",
-                            input=sub_chunk,
-                            timeout=30
-                        )
-                        embedding = response.data[0].embedding
-                        break
-                    except openai.error.OpenAIError as e:
-                        print(f"⚠️ OpenAI API error on attempt {attempt + 1} for {filename} - Chunk {indexed_chunk}: {e}")
-                        time.sleep(2 ** attempt)
-                else:
-                    print(f"❌ Failed to embed after 3 retries: {filename} - Chunk {indexed_chunk}")
-                    continue
-                store_embedding(id, filename, indexed_chunk, sub_chunk, embedding)
-
+            # The first surviving sub-chunk replaces the original row, the rest become new rows.
+            # "split_of" groups them so they are stored together or not at all (see ready_to_store)
+            first = True
+            for sub_index, sub_chunk, sub_tokens in split_large_text(content, max_tokens=MAX_TOKENS, overlap=OVERLAP_TOKENS, seen_hashes=seen_chunks_per_file[filename]):
+                jobs.append({
+                    "id": id if first else None,
+                    "split_of": id,
+                    "filename": filename,
+                    "chunk_index": chunk_index,
+                    "sub_index": sub_index,
+                    "text": sub_chunk,
+                    "token_count": sub_tokens
+                })
+                first = False
         else:
             # Ensure we aren't embedding duplicate chunks within the same filename
             chunk_hash = hashlib.md5(content.encode()).hexdigest()
@@ -135,27 +121,151 @@ def generate_and_store_embeddings():
                 print(f"⚠️ Skipping duplicate chunk {chunk_index} for {filename}")
                 continue
             seen_chunks_per_file[filename].add(chunk_hash)
+            jobs.append({
+                "id": id,
+                "split_of": None,
+                "filename": filename,
+                "chunk_index": chunk_index,
+                "sub_index": None,
+                "text": content,
+                "token_count": token_count
+            })
+
+    return jobs
+
+def make_batches(jobs, max_inputs=MAX_BATCH_INPUTS, max_tokens=MAX_BATCH_TOKENS):
+    """Packs jobs into request-sized batches bounded by input count and total tokens."""
+    batches = []
+    batch, batch_tokens = [], 0
+    for job in jobs:
+        if batch and (len(batch) >= max_inputs or batch_tokens + job["token_count"] > max_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(job)
+        batch_tokens += job["token_count"]
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _wait_for_rate_limit():
+    """Spaces request starts evenly so all workers together stay under the per-minute limit."""
+    global _next_request_at
+    interval = 60.0 / MAX_REQUESTS_PER_MINUTE
+    with _rate_lock:
+        now = time.monotonic()
+        wait = _next_request_at - now
+        _next_request_at = max(now, _next_request_at) + interval
+    if wait > 0:
+        time.sleep(wait)
+
+def embed_batch(batch, model=EMBEDDING_MODEL):
+    """Embeds one batch in a single API call, retrying with backoff. Returns vectors in batch order."""
+    for attempt in range(3):
+        _wait_for_rate_limit()
+        try:
+            response = client.embeddings.create(
+                model=model,
+                input=[job["text"] for job in batch],
+                timeout=30
+            )
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except openai.OpenAIError as e:
+            print(f"⚠️ OpenAI API error on attempt {attempt + 1} for a batch of {len(batch)} chunks: {e}")
+            time.sleep(2 ** attempt)
+    return None
 
-            print(f"🔄 Generating embedding for {filename} - Chunk {chunk_index}...")
-            embedding = None
-            for attempt in range(3):
-                try:
-                    response = client.embeddings.create(
-                        model="text-embedding-ada-002",
-                        input=content,
-                        timeout=30
-                    )
-                    embedding = response.data[0].embedding
-                    break
-                except openai.error.OpenAIError as e:
-                    print(f"⚠️ OpenAI API error on attempt {attempt + 1} for {filename} - Chunk {chunk_index}: {e}")
-                    time.sleep(2 ** attempt)
-            else:
-                print(f"❌ Failed to embed after 3 retries: {filename} - Chunk {chunk_index}")
+def store_embeddings(conn, batch, embeddings, model=EMBEDDING_MODEL):
+    """Writes a whole batch of embeddings in one transaction. Returns the number of rows written (0 if it failed)."""
+    updates, inserts = [], []
+    for job, embedding in zip(batch, embeddings):
+        blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        metadata = json.dumps({"sub_index": job["sub_index"]}) if job["sub_index"] is not None else None
+        if job["id"] is not None:
+            updates.append((job["text"], job["token_count"], metadata, blob, model, job["id"]))
+        else:
+            inserts.append((job["filename"], job["chunk_index"], job["text"], job["token_count"], metadata, blob, model))
+
+    changes = conn.total_changes
+    try:
+        with conn:
+            conn.executemany(
+                "UPDATE recipe_embeddings SET content = ?, token_count = ?, metadata = COALESCE(?, metadata), embedding = ?, model = ?, is_embedded = 1, created_at = CURRENT_TIMESTAMP WHERE id = ?",
+                updates
+            )
+            conn.executemany(
+                "INSERT INTO recipe_embeddings (filename, chunk_index, content, token_count, metadata, embedding, model, is_embedded) VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
+                inserts
+            )
+    except sqlite3.OperationalError as e:
+        print(f"⚠️ Database error: {e}")
+        return 0
+    return conn.total_changes - changes
+
+def ready_to_store(batch, embeddings, split_sizes, waiting):
+    """(jobs, embeddings) from a finished batch that can be stored now.
+
+    Sub-chunks of a split row wait in waiting (split_of -> [(job, embedding)]) until all
+    split_sizes[split_of] of them are embedded. The first one reuses the original row and the others
+    are inserted, so storing part of a group would leave the original pending next to stored
+    siblings and a rerun would insert duplicates; whole groups go into one transaction instead.
+    """
+    ready_jobs, ready_embeddings = [], []
+    for job, embedding in zip(batch, embeddings):
+        group = job["split_of"]
+        if group is None:
+            ready_jobs.append(job)
+            ready_embeddings.append(embedding)
+            continue
+        waiting[group].append((job, embedding))
+        if len(waiting[group]) == split_sizes[group]:
+            for group_job, group_embedding in waiting.pop(group):
+                ready_jobs.append(group_job)
+                ready_embeddings.append(group_embedding)
+    return ready_jobs, ready_embeddings
+
+def generate_and_store_embeddings(filenames=None):
+    """Embeds pending chunks in batched, concurrent requests and stores them in bulk transactions.
+
+    filenames limits the run to those flattened files (incremental ingestion); None embeds everything pending.
+    """
+    start = time.perf_counter()
+    jobs = collect_embedding_jobs(filenames)
+
+    conn = get_connection(DB_PATH)
+    split_sizes = Counter(job["split_of"] for job in jobs if job["split_of"] is not None)
+    waiting = defaultdict(list)
+
+    # Reuse embeddings for chunks whose text was already embedded in an earlier run
+    cached = get_cached_embeddings(EMBEDDING_MODEL, [job["text"] for job in jobs])
+    stored = 0
+    if cached:
+        stored += store_embeddings(conn, *ready_to_store([jobs[i] for i in cached], list(cached.values()), split_sizes, waiting))
+
+    pending = [job for i, job in enumerate(jobs) if i not in cached]
+    batches = make_batches(pending)
+    print(f"🔄 Embedding {len(pending)} chunks in {len(batches)} requests ({MAX_CONCURRENT_REQUESTS} concurrent), {len(cached)} served from cache...")
+
+    # Workers only talk to the API; all writes happen on this thread through one connection
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        futures = {executor.submit(embed_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            embeddings = future.result()
+            if embeddings is None:
+                print(f"❌ Failed to embed a batch of {len(batch)} chunks after 3 retries (first: {batch[0]['filename']} - Chunk {batch[0]['chunk_index']})")
                 continue
-            store_embedding(id, filename, chunk_index, content, embedding)
+            ready_jobs, ready_embeddings = ready_to_store(batch, embeddings, split_sizes, waiting)
+            if ready_jobs:
+                stored += store_embeddings(conn, ready_jobs, ready_embeddings)
+            put_cached_embeddings(EMBEDDING_MODEL, [job["text"] for job in batch], embeddings)
+
+    if waiting:
+        print(f"⚠️ {sum(len(pairs) for pairs in waiting.values())} sub-chunks of split chunks were not stored because part of their chunk failed; the next run retries them.")
 
-    print("✅ All embeddings have been stored successfully.")
+    elapsed = time.perf_counter() - start
+    rate = stored / elapsed if elapsed > 0 else 0.0
+    print(f"✅ Stored {stored}/{len(jobs)} embeddings in {elapsed:.2f}s ({rate:.1f} chunks/s).")
+    print(f"📦 Embedding cache: {get_cache_stats()}")
 
 if __name__ == "__main__":
-    generate_and_store_embeddings()
\ No newline at end of file
+    generate_and_store_embeddings()
@@ -0,0 +1,211 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import openai
+from dotenv import load_dotenv
+from session_store import load_session, save_session, put_summary, take_summary
+from tokenization import count_tokens, count_message_tokens
+from metrics import get_logger
+
+log = get_logger(__name__)
+
+# Keeps per-turn prompts bounded however long a conversation runs:
+#   - older turns are folded into a running summary by a background job after an answer has
+#     finished streaming, so summarizing never delays a response; the next request to load the
+#     session applies it (load_compacted_session)
+#   - assistant answers are sent back as plain text, not the HTML they were rendered in
+#   - context references the conversation hasn't used for a few turns are dropped
+#   - the whole prompt has a hard input-token ceiling; history and then context give way to it
+# Each turn records what its prompt would have cost uncompacted, reported by /session-cost.
+
+load_dotenv()
+client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+HISTORY_KEEP_MESSAGES = int(os.getenv("HISTORY_KEEP_MESSAGES", "4"))  # Recent messages kept verbatim
+INPUT_TOKEN_CEILING = int(os.getenv("INPUT_TOKEN_CEILING", "24000"))  # Hard cap on prompt tokens per turn
+MIN_CONTEXT_TOKENS = 1000  # History is trimmed before context drops below this
+CONTEXT_REF_MAX_TURNS = int(os.getenv("CONTEXT_REF_MAX_TURNS", "3"))  # Turns a context reference survives unused
+SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_PRICE_PER_1K = (0.00015, 0.0006)  # gpt-4o-mini (input, output) USD
+SUMMARY_WORKERS = 4
+PLACEHOLDER_REPLY = "Generating response..."
+HISTORY_TOKEN_WINDOW = 16  # Verbatim message token counts kept per session
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators per chat message
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and a recipe assistant. "
+    "Merge the new messages into the existing summary. Keep recipe names, the user's preferences "
+    "and constraints (diet, budget, servings, ingredients to avoid) and any open questions. "
+    "Drop formatting and pleasantries. Reply with the updated summary only, at most 150 words."
+)
+
+_summary_pool = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="history-summary")
+_pending = set()  # Session ids with a summary job queued or running
+_pending_lock = threading.Lock()
+
+HTML_BREAK = re.compile(r"<\s*(?:br|/p|/li|/h\d|/ul|/ol)\s*/?>", re.IGNORECASE)
+HTML_TAG = re.compile(r"<[^>]+>")
+BLANK_LINES = re.compile(r"\n\s*\n+")
+
+def new_compaction_stats():
+    return {
+        "turns": 0,
+        "input_tokens_before": 0,  # What the prompts would have been with verbatim history
+        "input_tokens_after": 0,   # What was actually sent
+        "summaries": 0,
+        "summary_input_tokens": 0,
+        "summary_output_tokens": 0
+    }
+
+def plain_text(html):
+    """Rendered answer HTML as plain text: tags removed, line breaks kept."""
+    text = HTML_TAG.sub("", HTML_BREAK.sub("\n", html))
+    return BLANK_LINES.sub("\n", text).strip()
+
+def prompt_history(summary, chat_history):
+    """History messages for the prompt: the running summary, then the given turns with answers as plain text."""
+    messages = []
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    for msg in chat_history:
+        if msg["content"] == PLACEHOLDER_REPLY:
+            continue
+        content = plain_text(msg["content"]) if msg["role"] == "assistant" else msg["content"]
+        messages.append({"role": msg["role"], "content": content})
+    return messages
+
+def fit_history(fixed_tokens, history, ceiling=INPUT_TOKEN_CEILING):
+    """Drops the oldest turns until the prompt leaves MIN_CONTEXT_TOKENS for context under the ceiling.
+
+    The summary message, if any, is kept. Returns (history, history tokens, context token budget).
+    """
+    history = list(history)
+    tokens = count_message_tokens(history) if history else 0
+    while history and fixed_tokens + tokens > ceiling - MIN_CONTEXT_TOKENS:
+        drop = 1 if history[0]["role"] == "system" and len(history) > 1 else 0
+        dropped = history.pop(drop)
+        tokens -= count_message_tokens([dropped])
+    return history, tokens, max(ceiling - fixed_tokens - tokens, 0)
+
+def note_message_tokens(chat, tokens):
+    """Remembers the verbatim token count of each new history message, for the uncompacted comparison."""
+    counts = chat.setdefault("history_tokens", [])
+    counts.append(tokens)
+    del counts[:-HISTORY_TOKEN_WINDOW]
+
+def uncompacted_history_tokens(chat, max_messages):
+    """Tokens the last max_messages history messages (current query excluded) would cost sent verbatim."""
+    counts = chat.get("history_tokens", [])[:-1][-max_messages:]
+    return sum(counts) + MESSAGE_OVERHEAD_TOKENS * len(counts)
+
+def record_compaction(chat, tokens_before, tokens_after):
+    stats = chat.setdefault("compaction", new_compaction_stats())
+    stats["turns"] += 1
+    stats["input_tokens_before"] += tokens_before
+    stats["input_tokens_after"] += tokens_after
+
+def drop_stale_refs(context_refs, turn, max_turns=CONTEXT_REF_MAX_TURNS):
+    """Keeps context references used within the last max_turns turns."""
+    return [ref for ref in context_refs if turn - ref.get("turn", turn) < max_turns]
+
+def needs_summary(chat):
+    return len(chat["chat_history"]) > HISTORY_KEEP_MESSAGES + 1
+
+def schedule_summary(sid, chat):
+    """Queues a background fold of older turns into the summary if the history has grown past the limit."""
+    if not needs_summary(chat):
+        return False
+    with _pending_lock:
+        if sid in _pending:
+            return False
+        _pending.add(sid)
+    _summary_pool.submit(_summarize_session, sid)
+    return True
+
+def _summarize_session(sid):
+    try:
+        summarize_session(sid)
+    except Exception as e:
+        log.warning("⚠️ History summary failed for a session: %s", e)
+    finally:
+        with _pending_lock:
+            _pending.discard(sid)
+
+def summarize_session(sid):
+    """Summarizes all but the last HISTORY_KEEP_MESSAGES messages and parks the result for the session.
+
+    The session itself isn't written here: a request in flight would overwrite it with the copy it
+    loaded earlier. apply_summary folds the result in when the next request loads the session.
+    """
+    chat = load_session(sid)
+    history = chat["chat_history"]
+    fold = len(history) - HISTORY_KEEP_MESSAGES
+    folded = history[:fold]
+    if fold < 2 or any(msg["content"] == PLACEHOLDER_REPLY for msg in folded):
+        return False
+
+    transcript = "\n".join(
+        f"{msg['role']}: {plain_text(msg['content']) if msg['role'] == 'assistant' else msg['content']}"
+        for msg in folded
+    )
+    messages = [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": f"Existing summary:\n{chat.get('summary') or '(none)'}\n\nNew messages:\n{transcript}"}
+    ]
+    response = client.chat.completions.create(model=SUMMARY_MODEL, messages=messages, max_tokens=SUMMARY_MAX_TOKENS)
+    summary = response.choices[0].message.content.strip()
+    usage = getattr(response, "usage", None)
+    input_tokens = getattr(usage, "prompt_tokens", 0) or count_message_tokens(messages)
+    output_tokens = getattr(usage, "completion_tokens", 0) or count_tokens(summary, "gpt-4o")
+
+    put_summary(sid, {
+        "summary": summary,
+        "folded": folded,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens
+    })
+    log.debug("🗜️ Summarized %s messages for the history summary (%s tokens).", fold, output_tokens)
+    return True
+
+def apply_summary(sid, chat):
+    """Folds the session's parked summary into chat. Returns True if chat changed and needs saving.
+
+    A summary whose folded messages no longer open the history (reset, or a newer summary already
+    applied) is discarded; the cost of producing it is still counted.
+    """
+    result = take_summary(sid)
+    if result is None:
+        return False
+    stats = chat.setdefault("compaction", new_compaction_stats())
+    stats["summary_input_tokens"] += result["input_tokens"]
+    stats["summary_output_tokens"] += result["output_tokens"]
+    chat["token_usage"]["estimated_cost_usd"] += (
+        result["input_tokens"] * SUMMARY_PRICE_PER_1K[0] + result["output_tokens"] * SUMMARY_PRICE_PER_1K[1]
+    ) / 1000
+
+    folded = result["folded"]
+    if chat["chat_history"][:len(folded)] != folded:
+        log.debug("🗜️ Discarded a history summary that no longer matches the session.")
+        return True
+    chat["summary"] = result["summary"]
+    chat["chat_history"] = chat["chat_history"][len(folded):]
+    stats["summaries"] += 1
+    log.debug("🗜️ Folded %s messages into the history summary.", len(folded))
+    return True
+
+def load_compacted_session(sid):
+    """load_session with any finished history summary applied (and saved)."""
+    chat = load_session(sid)
+    if apply_summary(sid, chat):
+        save_session(sid, chat)
+    return chat
+
+def compaction_report(chat):
+    """Cumulative before/after prompt tokens for /session-cost."""
+    stats = dict(chat.get("compaction") or new_compaction_stats())
+    stats["saved_tokens"] = stats["input_tokens_before"] - stats["input_tokens_after"]
+    stats["summary_tokens"] = count_tokens(chat["summary"], "gpt-4o") if chat.get("summary") else 0
+    stats["history_messages"] = len(chat.get("chat_history", []))
+    return stats
@@ -0,0 +1,125 @@
+import os
+from batch_pdf_to_text_1 import INPUT_FOLDER, extract_all, file_content_hash, output_paths
+from setup_text_db import setup_text_database
+from db import DB_PATH, get_connection
+from split_recipe_text_2 import process_recipe_file
+from generate_embeddings_3 import generate_and_store_embeddings
+from faiss_index_4 import update_index
+
+# Incremental pipeline run: only PDFs that were added, changed or removed since the last run are
+# extracted, chunked and embedded, and the FAISS index is patched instead of rebuilt.
+# Usage: python incremental_ingest.py
+
+def load_manifest(conn):
+    """Returns {path: (size, mtime, content_hash)} for every ingested source PDF."""
+    rows = conn.execute("SELECT path, size, mtime, content_hash FROM source_manifest").fetchall()
+    return {path: (size, mtime, content_hash) for path, size, mtime, content_hash in rows}
+
+def diff_sources(conn):
+    """Compares the input folder with the manifest.
+
+    Files whose size and mtime match the manifest are trusted without hashing; everything else is
+    hashed, so a touched-but-identical PDF is not reprocessed.
+    """
+    manifest = load_manifest(conn)
+    added, changed, unchanged, entries = [], [], [], {}
+
+    for filename in sorted(os.listdir(INPUT_FOLDER)):
+        if not filename.lower().endswith(".pdf"):
+            continue
+        path = os.path.join(INPUT_FOLDER, filename)
+        st = os.stat(path)
+        known = manifest.get(path)
+
+        if known and known[0] == st.st_size and known[1] == st.st_mtime:
+            unchanged.append(filename)
+            continue
+
+        content_hash = file_content_hash(path)
+        entries[path] = (st.st_size, st.st_mtime, content_hash)
+        if known is None:
+            added.append(filename)
+        elif known[2] != content_hash:
+            changed.append(filename)
+        else:
+            unchanged.append(filename)
+
+    current = {os.path.join(INPUT_FOLDER, f) for f in added + changed + unchanged}
+    removed = [os.path.basename(path) for path in manifest if path not in current]
+    return added, changed, removed, entries
+
+def mark_file_deleted(conn, filename):
+    """Soft-deletes every live chunk of a flattened recipe file and returns their row ids."""
+    row_ids = [row[0] for row in conn.execute(
+        "SELECT id FROM recipe_embeddings WHERE filename = ? AND is_deleted = 0", (filename,)
+    )]
+    conn.execute("UPDATE recipe_embeddings SET is_deleted = 1 WHERE filename = ? AND is_deleted = 0", (filename,))
+    return row_ids
+
+def run_incremental_ingest():
+    """Runs the pipeline for the changed part of the library only."""
+    setup_text_database(reset=False)
+    conn = get_connection(DB_PATH)
+    added, changed, removed, entries = diff_sources(conn)
+    print(f"📋 Sources: {len(added)} added, {len(changed)} changed, {len(removed)} removed.")
+
+    if not (added or changed or removed):
+        # Refresh manifest mtimes for touched-but-identical files
+        with conn:
+            conn.executemany(
+                "UPDATE source_manifest SET size = ?, mtime = ?, updated_at = CURRENT_TIMESTAMP WHERE path = ?",
+                [(size, mtime, path) for path, (size, mtime, content_hash) in entries.items()]
+            )
+        print("✅ Nothing to ingest.")
+        return
+
+    # Retire old chunks first; added files are included in case the database predates the manifest
+    removed_ids = []
+    with conn:
+        for filename in removed + changed + added:
+            flattened_name = os.path.basename(output_paths(filename)[2])
+            removed_ids += mark_file_deleted(conn, flattened_name)
+
+    for filename in removed:
+        for path in output_paths(filename):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Failed files stay out of the manifest so the next run retries them
+    failures = extract_all(added + changed) if added or changed else {}
+    for filename in failures:
+        entries.pop(os.path.join(INPUT_FOLDER, filename), None)
+
+    new_files = []
+    for filename in added + changed:
+        if filename in failures:
+            continue
+        flattened_name = os.path.basename(output_paths(filename)[2])
+        process_recipe_file(flattened_name)
+        new_files.append(flattened_name)
+
+    # Only the new files' rows are patched into the index, so leave any other pending rows alone
+    if new_files:
+        generate_and_store_embeddings(new_files)
+
+    placeholders = ",".join("?" * len(new_files))
+    added_ids = [row[0] for row in conn.execute(
+        f"SELECT id FROM recipe_embeddings WHERE is_embedded = 1 AND is_deleted = 0 AND filename IN ({placeholders})",
+        new_files
+    )] if new_files else []
+
+    update_index(added_ids, removed_ids)
+
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO source_manifest (path, size, mtime, content_hash, updated_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+            [(path, size, mtime, content_hash) for path, (size, mtime, content_hash) in entries.items()]
+        )
+        conn.executemany(
+            "DELETE FROM source_manifest WHERE path = ?",
+            [(os.path.join(INPUT_FOLDER, filename),) for filename in removed]
+        )
+    print(f"✅ Incremental ingest complete: +{len(added_ids)} / -{len(removed_ids)} chunks.")
+
+if __name__ == "__main__":
+    run_incremental_ingest()
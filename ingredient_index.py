@@ -0,0 +1,339 @@
+import glob
+import json
+import os
+import re
+import sys
+import threading
+from db import DB_PATH, get_connection, select_in
+from keyword_index import recipe_title
+from metrics import get_logger
+
+log = get_logger(__name__)
+
+# Structured recipe index built from Outputs/structured/*.json (written by batch_pdf_to_text_1.py):
+# an ingredient-term -> recipe inverted index plus numeric columns for servings, cost and the
+# nutrition facts, queried with exact filters such as "beans AND NOT pork, calories < 400".
+# No embeddings or LLM calls; the matching row ids can also restrict a FAISS search.
+# Rebuilt whenever the FAISS index is written; `python ingredient_index.py` rebuilds it by hand.
+
+STRUCTURED_FOLDER = os.path.join("Outputs", "structured")
+FILTER_MAX_RECIPES = int(os.getenv("FILTER_MAX_RECIPES", "50"))
+
+# Numeric columns: column -> pattern for the nutrition label it is read from
+NUTRIENT_COLUMNS = {
+    "calories": re.compile(r"calories", re.IGNORECASE),
+    "total_fat_g": re.compile(r"^total fat", re.IGNORECASE),
+    "saturated_fat_g": re.compile(r"saturated fat", re.IGNORECASE),
+    "cholesterol_mg": re.compile(r"cholesterol", re.IGNORECASE),
+    "sodium_mg": re.compile(r"sodium", re.IGNORECASE),
+    "carbohydrate_g": re.compile(r"carbohydrate", re.IGNORECASE),
+    "fiber_g": re.compile(r"fiber", re.IGNORECASE),
+    "added_sugars_g": re.compile(r"added sugars?", re.IGNORECASE),
+    "sugars_g": re.compile(r"^(?:total )?sugars?", re.IGNORECASE),
+    "protein_g": re.compile(r"protein", re.IGNORECASE)
+}
+NUMERIC_COLUMNS = ["servings", "cost"] + list(NUTRIENT_COLUMNS)
+COST_SCALE = 4  # "$" to "$$$$"
+
+# Names accepted on the left of a comparison in a filter
+FIELD_ALIASES = {
+    "servings": "servings", "serves": "servings",
+    "cost": "cost", "price": "cost",
+    "calories": "calories", "kcal": "calories",
+    "fat": "total_fat_g", "total_fat": "total_fat_g",
+    "saturated_fat": "saturated_fat_g", "sat_fat": "saturated_fat_g",
+    "cholesterol": "cholesterol_mg",
+    "sodium": "sodium_mg",
+    "carbs": "carbohydrate_g", "carbohydrate": "carbohydrate_g", "carbohydrates": "carbohydrate_g",
+    "fiber": "fiber_g", "fibre": "fiber_g",
+    "sugar": "sugars_g", "sugars": "sugars_g", "total_sugars": "sugars_g",
+    "added_sugar": "added_sugars_g", "added_sugars": "added_sugars_g",
+    "protein": "protein_g"
+}
+
+INGREDIENT_SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS recipe_facts (
+        filename TEXT PRIMARY KEY,
+        title TEXT,
+        ingredients TEXT,
+        {", ".join(f"{column} REAL" for column in NUMERIC_COLUMNS)}
+    );
+    CREATE TABLE IF NOT EXISTS recipe_ingredients (
+        filename TEXT NOT NULL,
+        line INTEGER NOT NULL,
+        term TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_term ON recipe_ingredients(term, filename, line);
+"""
+
+_schema_ready = threading.local()  # This thread's DB_PATH connection once both tables exist on it
+
+def ingredient_connection():
+    """This thread's DB_PATH connection, with recipe_facts and recipe_ingredients created if missing.
+
+    Created explicitly, like keyword_index.keyword_connection: get_connection's schema hook only
+    runs if this module is the first on the thread to open DB_PATH.
+    """
+    conn = get_connection(DB_PATH)
+    if getattr(_schema_ready, "conn", None) is not conn:
+        conn.executescript(INGREDIENT_SCHEMA)
+        _schema_ready.conn = conn
+    return conn
+
+URL = re.compile(r"https?:\S+")
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+TERM = re.compile(r"[a-z]+")
+# Quantities and units carry no ingredient meaning
+UNIT_WORDS = {
+    "cup", "cups", "c", "tablespoon", "tablespoons", "tbsp", "teaspoon", "teaspoons", "tsp",
+    "ounce", "ounces", "oz", "pound", "pounds", "lb", "lbs", "gram", "grams", "g", "kg", "ml", "l",
+    "quart", "quarts", "pint", "pints", "pinch", "dash", "can", "cans", "package", "packages", "pkg",
+    "clove", "cloves", "slice", "slices", "piece", "pieces", "inch", "inches", "medium", "large", "small"
+}
+TERM_STOPWORDS = {"a", "an", "the", "and", "or", "of", "to", "for", "with", "in", "into", "on", "as", "if", "about", "choice"}
+
+def normalize_term(word):
+    """Lower-cases and crudely singularizes a word, so "Tomatoes" and "tomato" index alike."""
+    word = word.lower()
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith("oes"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us")):
+        return word[:-1]
+    return word
+
+def ingredient_terms(line):
+    """Normalized, de-duplicated terms of one ingredient line, quantities and units removed."""
+    terms = []
+    for word in TERM.findall(URL.sub(" ", line.lower())):
+        if word in UNIT_WORDS or word in TERM_STOPWORDS:
+            continue
+        term = normalize_term(word)
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+def parse_number(value):
+    match = NUMBER.search(str(value).replace(",", ""))
+    return float(match.group()) if match else None
+
+def recipe_facts(recipe):
+    """Numeric columns for one structured recipe; values that are missing or unparsable are None."""
+    facts = dict.fromkeys(NUMERIC_COLUMNS)
+    facts["servings"] = parse_number(recipe.get("servings", ""))
+    # MyPlate shades the dollar signs that don't apply, so the PDF text carries the full "$$$$"
+    # scale whatever the real cost; only a shorter value says anything
+    dollars = recipe.get("cost", "").count("$")
+    facts["cost"] = float(dollars) if 0 < dollars < COST_SCALE else None
+    for label, value in recipe.get("nutrition", {}).items():
+        for column, pattern in NUTRIENT_COLUMNS.items():
+            if facts[column] is None and pattern.search(label.strip()):
+                facts[column] = parse_number(value)
+                break
+    return facts
+
+def build_ingredient_index(structured_folder=STRUCTURED_FOLDER, filenames=None):
+    """Rebuilds both tables in one transaction from the structured JSON of recipes that are still indexed.
+
+    Given filenames, only those recipes' rows are replaced (an incremental update). Returns the
+    number of recipes indexed.
+    """
+    conn = ingredient_connection()
+    if filenames is None:
+        live = {row[0] for row in conn.execute("SELECT DISTINCT filename FROM recipe_embeddings WHERE is_deleted = 0")}
+    else:
+        filenames = sorted(set(filenames))
+        live = {row[0] for row in select_in(
+            conn, "SELECT DISTINCT filename FROM recipe_embeddings WHERE is_deleted = 0 AND filename IN ({placeholders})",
+            filenames
+        )}
+
+    facts_rows, term_rows = [], []
+    for path in sorted(glob.glob(os.path.join(structured_folder, "*.json"))):
+        filename = os.path.splitext(os.path.basename(path))[0] + ".txt"  # Chunks are keyed by the flattened file
+        if filename not in live:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            recipe = json.load(f)
+
+        ingredients = [line for line in recipe.get("ingredients", []) if not URL.fullmatch(line.split(" ")[0])]
+        facts = recipe_facts(recipe)
+        facts_rows.append([filename, recipe_title(filename), json.dumps(ingredients)] + [facts[c] for c in NUMERIC_COLUMNS])
+        for line_number, line in enumerate(ingredients):
+            term_rows.extend((filename, line_number, term) for term in ingredient_terms(line))
+
+    with conn:
+        if filenames is None:
+            conn.execute("DELETE FROM recipe_facts")
+            conn.execute("DELETE FROM recipe_ingredients")
+        else:
+            for table in ("recipe_facts", "recipe_ingredients"):
+                conn.execute(f"DELETE FROM {table} WHERE filename IN (SELECT value FROM json_each(?))", (json.dumps(filenames),))
+        conn.executemany(
+            f"INSERT INTO recipe_facts (filename, title, ingredients, {', '.join(NUMERIC_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * (3 + len(NUMERIC_COLUMNS)))})",
+            facts_rows
+        )
+        conn.executemany("INSERT INTO recipe_ingredients (filename, line, term) VALUES (?, ?, ?)", term_rows)
+    if filenames is None:
+        log.info("🥕 Ingredient index rebuilt with %s recipes and %s ingredient terms.", len(facts_rows), len(term_rows))
+    else:
+        log.info("🥕 Ingredient index updated for %s recipes (%s still indexed).", len(filenames), len(facts_rows))
+    return len(facts_rows)
+
+# --- Filter language ---
+# A filter is comma-separated clauses that must all hold. A clause combines ingredient phrases
+# with AND / OR / NOT and parentheses, or compares a field: "calories < 400", "cost <= $$".
+# A phrase matches when all of its words appear in the same ingredient line ("black beans").
+# A comparison on a value the recipe doesn't list is false, so "NOT calories < 400" keeps it.
+
+FILTER_TOKEN = re.compile(
+    r"\s*(?:(?P<op><=|>=|!=|==|<|>|=)|(?P<dollars>\$+)|(?P<number>\d+(?:\.\d+)?)"
+    r"|(?P<paren>[()])|(?P<sep>[,;])|(?P<word>[A-Za-z][A-Za-z'_-]*))"
+)
+KEYWORDS = {"and", "or", "not"}
+VALUE_UNITS = {"mg", "g", "kcal", "calories", "cal", "servings", "serving"}
+SQL_OPERATORS = {"<": "<", "<=": "<=", ">": ">", ">=": ">=", "=": "=", "==": "=", "!=": "!="}
+
+def tokenize_filter(text):
+    tokens, position = [], 0
+    text = text.strip()
+    while position < len(text):
+        match = FILTER_TOKEN.match(text, position)
+        if not match or match.end() == position:
+            raise ValueError(f"Unexpected character in filter at position {position}: {text[position:position + 10]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "word" and value.lower() in KEYWORDS:
+            kind, value = value.lower(), value.lower()
+        elif kind == "dollars":
+            kind, value = "number", str(len(value))
+        tokens.append((kind, value))
+    return tokens
+
+def parse_filter(text):
+    """Compiles a filter string to (sql_condition, params) over recipe_facts aliased as f.
+
+    Recursive descent, loosest first: clauses (",") > OR > AND > NOT > phrase / comparison / (...).
+    Raises ValueError with a readable message for malformed filters.
+    """
+    tokens = tokenize_filter(text)
+    if not tokens:
+        raise ValueError("Filter cannot be empty.")
+    params = []
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else (None, None)
+
+    def take(kind=None):
+        nonlocal position
+        token = peek()
+        if token[0] is None or (kind and token[0] != kind):
+            raise ValueError(f"Expected {kind or 'more input'} in filter, got {token[1] or 'end of filter'!r}")
+        position += 1
+        return token
+
+    def parse_or():
+        parts = [parse_and()]
+        while peek()[0] == "or":
+            take()
+            parts.append(parse_and())
+        return parts[0] if len(parts) == 1 else "(" + " OR ".join(parts) + ")"
+
+    def parse_and():
+        parts = [parse_not()]
+        while peek()[0] == "and":
+            take()
+            parts.append(parse_not())
+        return parts[0] if len(parts) == 1 else "(" + " AND ".join(parts) + ")"
+
+    def parse_not():
+        if peek()[0] == "not":
+            take()
+            return f"NOT {parse_not()}"
+        return parse_primary()
+
+    def parse_primary():
+        if peek() == ("paren", "("):
+            take()
+            condition = parse_or()
+            if peek() != ("paren", ")"):
+                raise ValueError(f"Expected ')' in filter, got {peek()[1] or 'end of filter'!r}")
+            take()
+            return condition
+
+        words = []
+        while peek()[0] == "word":
+            words.append(take()[1].lower())
+        if not words:
+            raise ValueError(f"Expected an ingredient or comparison in filter, got {peek()[1] or 'end of filter'!r}")
+        if peek()[0] == "op":
+            return comparison("_".join(words))
+        return phrase(words)
+
+    def comparison(field):
+        column = FIELD_ALIASES.get(field)
+        if column is None:
+            raise ValueError(f"Unknown filter field {field!r}; use one of: {', '.join(sorted(FIELD_ALIASES))}")
+        operator = SQL_OPERATORS[take("op")[1]]
+        params.append(float(take("number")[1]))
+        if peek()[0] == "word" and peek()[1].lower() in VALUE_UNITS:
+            take()
+        return f"(f.{column} IS NOT NULL AND f.{column} {operator} ?)"
+
+    def phrase(words):
+        terms = []
+        for word in words:
+            terms.extend(term for term in ingredient_terms(word) if term not in terms)
+        if not terms:
+            raise ValueError(f"Filter phrase {' '.join(words)!r} has no ingredient words")
+        params.extend(terms + [len(terms)])
+        return (
+            "f.filename IN (SELECT filename FROM recipe_ingredients "
+            f"WHERE term IN ({','.join('?' * len(terms))}) "
+            "GROUP BY filename, line HAVING COUNT(DISTINCT term) = ?)"
+        )
+
+    clauses = [parse_or()]
+    while peek()[0] == "sep":
+        take()
+        if peek()[0] is not None:
+            clauses.append(parse_or())
+    if peek()[0] is not None:
+        raise ValueError(f"Unexpected {peek()[1]!r} in filter")
+    return " AND ".join(clauses), params
+
+def filter_recipes(text, limit=FILTER_MAX_RECIPES):
+    """Recipes matching a filter, by title: [{"filename", "title", "ingredients", <numeric columns>}]."""
+    condition, params = parse_filter(text)
+    conn = ingredient_connection()
+    rows = conn.execute(
+        f"SELECT filename, title, ingredients, {', '.join(NUMERIC_COLUMNS)} FROM recipe_facts f "
+        f"WHERE {condition} ORDER BY title LIMIT ?",
+        params + [limit]
+    ).fetchall()
+    recipes = []
+    for row in rows:
+        recipe = {"filename": row[0], "title": row[1], "ingredients": json.loads(row[2])}
+        recipe.update(zip(NUMERIC_COLUMNS, row[3:]))
+        recipes.append(recipe)
+    return recipes
+
+def filter_row_ids(text):
+    """Live chunk row ids of every recipe matching a filter, for restricting a FAISS search."""
+    condition, params = parse_filter(text)
+    conn = ingredient_connection()
+    return [row[0] for row in conn.execute(
+        "SELECT e.id FROM recipe_embeddings e JOIN recipe_facts f ON f.filename = e.filename "
+        f"WHERE e.is_deleted = 0 AND {condition}",
+        params
+    )]
+
+if __name__ == "__main__":
+    build_ingredient_index()
+    if len(sys.argv) > 1:
+        for recipe in filter_recipes(" ".join(sys.argv[1:])):
+            print(f"  {recipe['title']}  (servings {recipe['servings']}, calories {recipe['calories']})")
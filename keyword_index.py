@@ -0,0 +1,147 @@
+import json
+import os
+import re
+import sys
+import threading
+from db import DB_PATH, get_connection, select_in
+from metrics import get_logger
+
+log = get_logger(__name__)
+
+# Recipe-level keyword index (SQLite FTS5, BM25 ranking) over recipe titles and the INGREDIENTS:
+# chunks written by split_recipe_text_2.py, plus reciprocal-rank fusion with FAISS results.
+# Ingredient lookups ("which recipes use carrots?") are answered from here without an embeddings call.
+# Rebuilt whenever the FAISS index is written; `python keyword_index.py` rebuilds it by hand.
+
+KEYWORD_MAX_RECIPES = int(os.getenv("KEYWORD_MAX_RECIPES", "10"))
+RRF_K = 60  # Standard reciprocal-rank-fusion damping constant
+TITLE_WEIGHT = 2.0  # A term in the recipe name counts double in BM25
+
+FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS recipe_fts USING fts5(
+        filename UNINDEXED,
+        ingredients_row_id UNINDEXED,
+        title,
+        ingredients,
+        tokenize = 'porter unicode61'
+    );
+"""
+
+# Question shapes that are really ingredient/name lookups; "terms" is what to search for
+KEYWORD_QUERY_PATTERNS = [
+    re.compile(r"^(?:which|what|find|show|list|any|give me)?\s*(?:me\s+)?(?:all\s+)?(?:the\s+)?(?:\d+\s+)?recipes?\s+"
+               r"(?:that\s+)?(?:use|uses|using|with|have|has|contain|contains|containing|include|includes|including|made with)\s+"
+               r"(?P<terms>[\w\s,'-]+?)\s*\??$"),
+    re.compile(r"^(?:find|show|list|give me)?\s*(?:me\s+)?(?:all\s+)?(?:\d+\s+)?(?P<terms>[\w\s,'-]+?)\s+recipes?\s*\??$")
+]
+QUERY_STOPWORDS = {
+    "a", "an", "the", "and", "or", "with", "without", "of", "in", "for", "to", "some", "any", "me", "my",
+    "recipe", "recipes", "which", "what", "find", "show", "list", "all", "use", "uses", "using", "that"
+}
+URL = re.compile(r"https?:\S+")
+WORD = re.compile(r"[a-z][a-z'-]*")
+
+_schema_ready = threading.local()  # This thread's DB_PATH connection once recipe_fts exists on it
+
+def keyword_connection():
+    """This thread's DB_PATH connection, with recipe_fts created if missing.
+
+    The table is created explicitly rather than through get_connection's schema hook, which only
+    runs if this module is the first on the thread to open DB_PATH.
+    """
+    conn = get_connection(DB_PATH)
+    if getattr(_schema_ready, "conn", None) is not conn:
+        conn.executescript(FTS_SCHEMA)
+        _schema_ready.conn = conn
+    return conn
+
+def recipe_title(filename):
+    """Recipe name from a flattened file name, e.g. "3-Can Chili _ MyPlate.txt" -> "3-Can Chili"."""
+    stem = os.path.splitext(filename)[0]
+    return re.sub(r"\s*_\s*MyPlate$", "", stem).strip()
+
+def build_keyword_index(filenames=None):
+    """Rebuilds the FTS table from live chunks in one transaction. Returns the number of recipes indexed.
+
+    Given filenames, only those recipes' rows are replaced (an incremental update).
+    """
+    conn = keyword_connection()
+    ingredients_query = """
+        SELECT filename, MIN(id), group_concat(content, '\n')
+        FROM recipe_embeddings
+        WHERE is_deleted = 0 AND content LIKE 'INGREDIENTS:%'{scope}
+        GROUP BY filename
+    """
+    files_query = "SELECT DISTINCT filename FROM recipe_embeddings WHERE is_deleted = 0{scope}"
+    if filenames is None:
+        rows = conn.execute(ingredients_query.format(scope="")).fetchall()
+        live = [row[0] for row in conn.execute(files_query.format(scope=""))]
+    else:
+        filenames = sorted(set(filenames))
+        scope = " AND filename IN ({placeholders})"
+        rows = select_in(conn, ingredients_query.format(scope=scope), filenames)
+        live = [row[0] for row in select_in(conn, files_query.format(scope=scope), filenames)]
+    indexed = {filename for filename, _, _ in rows}
+    titles_only = [filename for filename in live if filename not in indexed]
+
+    with conn:
+        if filenames is None:
+            conn.execute("DELETE FROM recipe_fts")
+        else:
+            # One pass over the table: filename is UNINDEXED, so each per-file DELETE would scan it
+            conn.execute("DELETE FROM recipe_fts WHERE filename IN (SELECT value FROM json_each(?))", (json.dumps(filenames),))
+        conn.executemany(
+            "INSERT INTO recipe_fts (filename, ingredients_row_id, title, ingredients) VALUES (?, ?, ?, ?)",
+            [(filename, row_id, recipe_title(filename), URL.sub(" ", text)) for filename, row_id, text in rows]
+            + [(filename, None, recipe_title(filename), "") for filename in titles_only]
+        )
+    if filenames is None:
+        log.info("🔤 Keyword index rebuilt with %s recipes.", len(rows) + len(titles_only))
+    else:
+        log.info("🔤 Keyword index updated for %s recipes (%s still indexed).", len(filenames), len(rows) + len(titles_only))
+    return len(rows) + len(titles_only)
+
+def query_terms(text):
+    """Lower-cased search words with question filler removed."""
+    return [word for word in WORD.findall(text.lower()) if word not in QUERY_STOPWORDS]
+
+def keyword_query_terms(query):
+    """Returns the search terms if the query is a plain ingredient/name lookup, else None."""
+    query = query.strip().lower()
+    for pattern in KEYWORD_QUERY_PATTERNS:
+        match = pattern.match(query)
+        if match:
+            terms = query_terms(match.group("terms"))
+            if terms:
+                return terms
+    return None
+
+def keyword_search(terms, limit=KEYWORD_MAX_RECIPES, match_all=False):
+    """BM25-ranked recipes for the terms, best first: [{"filename", "ingredients_row_id", "bm25"}].
+
+    match_all requires every term (lookups like "rice and beans"); otherwise any term may match.
+    """
+    if not terms:
+        return []
+    fts_query = (" " if match_all else " OR ").join(f'"{term}"' for term in terms)
+    conn = keyword_connection()
+    rows = conn.execute(
+        "SELECT filename, ingredients_row_id, bm25(recipe_fts, 0.0, 0.0, ?, 1.0) AS score "
+        "FROM recipe_fts WHERE recipe_fts MATCH ? ORDER BY score LIMIT ?",
+        (TITLE_WEIGHT, fts_query, limit)
+    ).fetchall()
+    return [{"filename": filename, "ingredients_row_id": row_id, "bm25": score} for filename, row_id, score in rows]
+
+def reciprocal_rank_fusion(*rankings, k=RRF_K):
+    """Fuses ranked lists of keys into {key: score}, where score = sum of 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return scores
+
+if __name__ == "__main__":
+    build_keyword_index()
+    if len(sys.argv) > 1:
+        for hit in keyword_search(query_terms(" ".join(sys.argv[1:]))):
+            print(f"  {hit['bm25']:.3f}  {hit['filename']}")
@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import time
+import httpx
+import numpy as np
+
+# Load test for the chat servers: N concurrent sessions each send a series of /search requests
+# and read the streamed answer, recording time-to-first-byte and total time per request.
+# Run the app against fake_openai_server.py so only the serving path is measured:
+#   python fake_openai_server.py --port 8900 --latency-ms 150 --token-ms 10
+#   OPENAI_API_KEY=x OPENAI_BASE_URL=http://localhost:8900/v1 python chatbot_async.py
+#   python load_test.py --url http://localhost:5001 --sessions 50 --requests 3
+
+QUERIES = [
+    "find all recipes with beans",
+    "which recipes use carrots?",
+    "show me 3 chicken recipes",
+    "what can i make with rice and black beans",
+    "low cost breakfast ideas"
+]
+
+async def run_session(client, base_url, n_requests, session_index, timings, errors):
+    """One simulated user: opens the page for a session cookie, then asks questions back to back."""
+    await client.get(base_url + "/")
+    for i in range(n_requests):
+        query = QUERIES[(session_index + i) % len(QUERIES)]
+        start = time.perf_counter()
+        first_byte = None
+        try:
+            async with client.stream("POST", base_url + "/search", json={"query": query}) as response:
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+                    await response.aread()
+                    continue
+                async for chunk in response.aiter_bytes():
+                    if first_byte is None and chunk:
+                        first_byte = time.perf_counter() - start
+        except httpx.HTTPError as e:
+            errors.append(repr(e))
+            continue
+        timings.append((first_byte if first_byte is not None else float("nan"), time.perf_counter() - start))
+
+async def run_load_test(base_url, sessions, n_requests, timeout):
+    timings, errors = [], []
+    start = time.perf_counter()
+    clients = [httpx.AsyncClient(timeout=timeout) for _ in range(sessions)]  # One cookie jar per session
+    try:
+        await asyncio.gather(*(
+            run_session(client, base_url, n_requests, i, timings, errors)
+            for i, client in enumerate(clients)
+        ))
+    finally:
+        await asyncio.gather(*(client.aclose() for client in clients))
+    elapsed = time.perf_counter() - start
+
+    if not timings:
+        print(f"❌ No successful requests ({len(errors)} errors: {errors[:3]})")
+        return None
+
+    ttfb = np.array([t[0] for t in timings]) * 1000
+    total = np.array([t[1] for t in timings]) * 1000
+    report = {
+        "sessions": sessions,
+        "requests": len(timings),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(timings) / elapsed, 2),
+        "ttfb_p50_ms": round(float(np.nanpercentile(ttfb, 50)), 1),
+        "ttfb_p99_ms": round(float(np.nanpercentile(ttfb, 99)), 1),
+        "total_p50_ms": round(float(np.percentile(total, 50)), 1),
+        "total_p99_ms": round(float(np.percentile(total, 99)), 1)
+    }
+    print(f"⏱️ {report['requests']} requests from {sessions} sessions in {elapsed:.2f}s "
+          f"({report['requests_per_second']} req/s, {report['errors']} errors)")
+    print(f"   TTFB p50 {report['ttfb_p50_ms']} ms | p99 {report['ttfb_p99_ms']} ms")
+    print(f"   Total p50 {report['total_p50_ms']} ms | p99 {report['total_p99_ms']} ms")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the chat server.")
+    parser.add_argument("--url", default="http://localhost:5001")
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent simulated users")
+    parser.add_argument("--requests", type=int, default=3, help="Questions per session")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    asyncio.run(run_load_test(args.url.rstrip("/"), args.sessions, args.requests, args.timeout))
@@ -0,0 +1,117 @@
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Process-wide instrumentation for the chat servers:
+#   - logging: modules log through get_logger(); LOG_LEVEL (default INFO) decides what is emitted.
+#     Per-request detail is DEBUG with lazy %-style arguments, so when it is off a call costs a
+#     level check and nothing is formatted
+#   - stages: stage_timer() and record_stage() time embed, ann, hydrate, pack, llm_first_token,
+#     llm_complete and the other pipeline stages into the request's timings dict and into one
+#     process-wide histogram per stage
+#   - render_metrics(): the histograms plus caller-supplied families in Prometheus text format
+
+load_dotenv()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # Seconds
+STAGE_ORDER = ("session", "keyword", "embed", "route", "ann", "hydrate", "retrieve", "pack", "llm_first_token",
+               "first_token", "llm_complete")
+
+_logger = logging.getLogger("recipes")
+if not _logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    _logger.addHandler(_handler)
+    _logger.setLevel(LOG_LEVEL)
+    _logger.propagate = False
+
+_histograms = {}  # stage -> {"buckets": per-bucket counts (last is +Inf), "sum": seconds, "count": n}
+_histograms_lock = threading.Lock()
+
+def get_logger(name):
+    """Logger under the shared "recipes" logger, e.g. get_logger(__name__)."""
+    return _logger.getChild(name)
+
+def observe(stage, seconds):
+    """Adds one duration to the stage's histogram."""
+    bucket = bisect.bisect_left(STAGE_BUCKETS, seconds)
+    with _histograms_lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = {"buckets": [0] * (len(STAGE_BUCKETS) + 1), "sum": 0.0, "count": 0}
+        histogram["buckets"][bucket] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+def record_stage(timings, stage, seconds):
+    """Records a measured stage: into the histogram, and as ms into timings unless it is None."""
+    observe(stage, seconds)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+@contextmanager
+def stage_timer(timings, stage):
+    """Times the block as a stage (see record_stage)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(timings, stage, time.perf_counter() - start)
+
+def format_timings(timings):
+    """"session 0.4 | embed 212.0 | ..." in pipeline order, for the per-request log line."""
+    timings = dict(timings)  # Prefetch threads may still be adding stages
+    order = sorted(timings, key=lambda stage: STAGE_ORDER.index(stage) if stage in STAGE_ORDER else len(STAGE_ORDER))
+    return " | ".join(f"{stage} {timings[stage]:.1f}" for stage in order)
+
+def server_timing(timings):
+    """Server-Timing header value for the stages finished before the response starts."""
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in dict(timings).items())
+
+def log_timings(log, timings):
+    """Logs a request's stage breakdown at DEBUG; nothing is formatted unless DEBUG is enabled."""
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("⏱️ Stages (ms): %s", format_timings(timings))
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+def _value(value):
+    return str(int(value)) if isinstance(value, (bool, int)) else repr(float(value))
+
+def render_metrics(families=()):
+    """Prometheus text exposition format.
+
+    The stage histograms come first as recipe_stage_duration_seconds{stage=...}; families are
+    (name, type, help, [(labels dict or None, value), ...]) and samples with a None value are skipped.
+    """
+    lines = [
+        "# HELP recipe_stage_duration_seconds Time spent in each /search pipeline stage.",
+        "# TYPE recipe_stage_duration_seconds histogram"
+    ]
+    with _histograms_lock:
+        snapshot = {stage: (list(h["buckets"]), h["sum"], h["count"]) for stage, h in _histograms.items()}
+    for stage in sorted(snapshot, key=lambda s: STAGE_ORDER.index(s) if s in STAGE_ORDER else len(STAGE_ORDER)):
+        buckets, total, count = snapshot[stage]
+        cumulative = 0
+        for bound, bucket_count in zip(STAGE_BUCKETS + ("+Inf",), buckets):
+            cumulative += bucket_count
+            lines.append(f'recipe_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'recipe_stage_duration_seconds_sum{{stage="{stage}"}} {total:.6f}')
+        lines.append(f'recipe_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+
+    for name, metric_type, help_text, samples in families:
+        samples = [(labels, value) for labels, value in samples if value is not None]
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(f"{name}{_labels(labels)} {_value(value)}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
@@ -1,18 +1,11 @@
-import sqlite3
+from db import DB_PATH, get_connection
 
-DB_PATH = "recipe_text_chunks.db"
-
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
-
-# Enable WAL mode
-cursor.execute("PRAGMA journal_mode=WAL;")
+# get_connection opens every connection in WAL mode
+conn = get_connection(DB_PATH)
 
 # Make a dummy write to force WAL/SHM creation
-cursor.execute("CREATE TABLE IF NOT EXISTS wal_trigger (id INTEGER)")
-cursor.execute("INSERT INTO wal_trigger (id) VALUES (1)")
-
-conn.commit()
-conn.close()
+with conn:
+    conn.execute("CREATE TABLE IF NOT EXISTS wal_trigger (id INTEGER)")
+    conn.execute("INSERT INTO wal_trigger (id) VALUES (1)")
 
-print("✅ WAL mode activated and files should now be created.")
\ No newline at end of file
+print("✅ WAL mode activated and files should now be created.")
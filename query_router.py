@@ -0,0 +1,132 @@
+import os
+import re
+import time
+import numpy as np
+from keyword_index import recipe_title, query_terms, keyword_search
+from ingredient_index import normalize_term
+from search_faiss_5 import peek_query_embedding
+from metrics import get_logger
+
+log = get_logger(__name__)
+
+# Routes each chat turn before any retrieval, locally and in microseconds:
+#   "followup" - answer from the chunks already in the session's context; no embedding, no FAISS
+#   "scoped"   - a follow-up that brings in something new: search the recipes in context plus the
+#                recipes whose title or ingredients match the new words (a full search if none do,
+#                since the keyword index can't say where semantic matches are)
+#   "search"   - full hybrid retrieval
+# Rules look for follow-up phrasing and for content words the current context doesn't cover;
+# similarity to the previous query (cached embeddings, else word overlap) catches rephrasings.
+# A bare pronoun ("is it possible to make vegan lasagna?") only counts when nothing new is asked.
+
+ROUTER_ENABLED = os.getenv("QUERY_ROUTER", "1") == "1"
+ROUTER_SIMILARITY = float(os.getenv("ROUTER_SIMILARITY", "0.92"))  # Cosine to the previous query
+ROUTER_OVERLAP = float(os.getenv("ROUTER_OVERLAP", "0.75"))  # Word overlap to the previous query
+RETRIEVAL_EMA_WEIGHT = 0.2  # Weight of the newest sample in the moving average of retrieval time
+
+FOLLOWUP_KEYWORDS = ["compare", "which one", "these", "those", "the second", "that one", "how about", "what about"]
+FOLLOWUP_WORDS = re.compile(r"\b(?:ones|either|neither|the (?:first|second|third|last|other)(?: one)?)\b")
+PRONOUNS = re.compile(r"\b(?:it|its|them|they|both)\b")  # Too common to mark a follow-up on their own
+# Question words and verbs that say nothing about which recipes are meant
+ROUTER_STOPWORDS = {
+    "compare", "about", "how", "long", "much", "many", "does", "do", "did", "is", "are", "was", "can", "could",
+    "would", "should", "it", "its", "them", "they", "those", "these", "that", "this", "one", "ones", "both",
+    "either", "neither", "first", "second", "third", "last", "other", "same", "instead", "also", "more",
+    "again", "above", "previous", "make", "cook", "need", "take", "takes", "tell", "give", "i", "you", "we",
+    "be", "have", "has", "than", "better", "best", "cheaper", "cheapest", "healthier", "healthiest",
+    "easier", "easiest", "faster", "fastest", "quick", "quicker", "quickest", "there", "here", "why", "when",
+    "who", "whose", "where", "if", "so", "but", "not", "no", "yes", "please", "thanks", "thank", "ok", "okay",
+    "each", "every", "between", "vs", "versus", "like", "want", "get", "out", "up", "one's", "which", "what"
+}
+WORD = re.compile(r"[a-z][a-z'-]*")
+
+ROUTER_STATS = {
+    "followup": 0,
+    "scoped": 0,
+    "search": 0,
+    "route_us_total": 0.0,
+    "retrieval_ms_avg": None,  # Moving average of full retrievals, the cost a followup avoids
+    "ms_saved_estimate": 0.0
+}
+
+def is_followup_query(query):
+    query = query.lower()
+    return any(kw in query for kw in FOLLOWUP_KEYWORDS) or bool(FOLLOWUP_WORDS.search(query))
+
+def content_terms(query):
+    """Normalized words of the query that could name a recipe or ingredient."""
+    return {normalize_term(word) for word in query_terms(query) if word not in ROUTER_STOPWORDS and len(word) > 2}
+
+def context_vocabulary(context_chunks):
+    """Normalized words of the context chunks and their recipe titles."""
+    text = " ".join(chunk["text"] for chunk in context_chunks).lower()
+    titles = " ".join({recipe_title(chunk.get("filename") or "") for chunk in context_chunks}).lower()
+    return {normalize_term(word) for word in WORD.findall(text + " " + titles)}
+
+def context_filenames(context_chunks):
+    return list(dict.fromkeys(chunk["filename"] for chunk in context_chunks))
+
+def outside_recipes(terms, filenames):
+    """Recipes outside filenames whose title or ingredients match any of the terms, best first."""
+    return [hit["filename"] for hit in keyword_search(sorted(terms)) if hit["filename"] not in filenames]
+
+def previous_query_similarity(query, previous_query):
+    """Cosine of cached query embeddings when both are cached, else word overlap (Jaccard). None without a previous query."""
+    if not previous_query:
+        return None, None
+    current, previous = peek_query_embedding(query), peek_query_embedding(previous_query)
+    if current is not None and previous is not None:
+        return float(np.dot(current, previous) / (np.linalg.norm(current) * np.linalg.norm(previous))), "embedding"
+    a, b = set(query_terms(query)), set(query_terms(previous_query))
+    return (len(a & b) / len(a | b) if a | b else 0.0), "overlap"
+
+def route_query(query, previous_query, context_chunks, explicit_scope=False):
+    """Classifies a turn. Returns {"route", "reason", "route_us", "filenames"}.
+
+    filenames is the recipes a "scoped" turn may search, else None.
+    """
+    start = time.perf_counter()
+    filenames = None
+    if not ROUTER_ENABLED or explicit_scope or not context_chunks:
+        route, reason = "search", "explicit scope" if explicit_scope else "no context" if ROUTER_ENABLED else "router disabled"
+    else:
+        new_terms = content_terms(query) - context_vocabulary(context_chunks)
+        in_context = context_filenames(context_chunks)
+        outside = outside_recipes(new_terms, in_context) if new_terms and is_followup_query(query) else []
+        similarity, measure = previous_query_similarity(query, previous_query)
+        threshold = ROUTER_SIMILARITY if measure == "embedding" else ROUTER_OVERLAP
+        if similarity is not None and similarity >= threshold and not new_terms:
+            route, reason = "followup", f"{measure} similarity {similarity:.2f} to previous query"
+        elif (is_followup_query(query) or PRONOUNS.search(query.lower())) and not new_terms:
+            route, reason = "followup", "follow-up phrasing, nothing outside context"
+        elif outside:
+            route, filenames = "scoped", in_context + outside
+            reason = f"follow-up phrasing with new terms {sorted(new_terms)[:5]}, {len(outside)} matching recipes outside context"
+        else:
+            route, reason = "search", f"new terms {sorted(new_terms)[:5]}" if new_terms else "no follow-up signal"
+    route_us = (time.perf_counter() - start) * 1e6
+
+    ROUTER_STATS[route] += 1
+    ROUTER_STATS["route_us_total"] += route_us
+    saved = ""
+    if route == "followup" and ROUTER_STATS["retrieval_ms_avg"] is not None:
+        ROUTER_STATS["ms_saved_estimate"] += ROUTER_STATS["retrieval_ms_avg"]
+        saved = f", ~{ROUTER_STATS['retrieval_ms_avg']:.0f} ms retrieval saved"
+    log.debug("🧭 Route: %s (%s) in %.0f µs%s", route, reason, route_us, saved)
+    return {"route": route, "reason": reason, "route_us": round(route_us, 1), "filenames": filenames}
+
+def record_retrieval(seconds):
+    """Feeds the moving average of full retrieval time used for the latency-saved estimate."""
+    ms = seconds * 1000
+    average = ROUTER_STATS["retrieval_ms_avg"]
+    ROUTER_STATS["retrieval_ms_avg"] = ms if average is None else average + RETRIEVAL_EMA_WEIGHT * (ms - average)
+
+def get_router_stats():
+    stats = dict(ROUTER_STATS)
+    routed = stats["followup"] + stats["scoped"] + stats["search"]
+    stats["avg_route_us"] = round(stats["route_us_total"] / routed, 1) if routed else 0.0
+    stats["route_us_total"] = round(stats["route_us_total"], 1)
+    stats["ms_saved_estimate"] = round(stats["ms_saved_estimate"], 1)
+    if stats["retrieval_ms_avg"] is not None:
+        stats["retrieval_ms_avg"] = round(stats["retrieval_ms_avg"], 1)
+    return stats
@@ -0,0 +1,173 @@
+import re
+import pandas as pd
+
+# Recipe structure parser shared by batch_pdf_to_text_1.py and pdf_text_extract_1.py.
+# Pure functions over page text: no PDF or file I/O, so it can be benchmarked on its own
+# (see bench_recipe_parser.py).
+
+# Section headers in one alternation; the first matching group wins, in the same order the
+# old chain of re.match calls checked them. "source" ends the current section.
+SECTION_HEADER = re.compile(
+    r"(?P<ingredients>Ingredients?)"
+    r"|(?P<directions>Directions?)"
+    r"|(?P<nutrition>Nutrition Information)"
+    r"|(?P<myplate>MyPlate Food Groups)"
+    r"|(?P<source>Source)",
+    re.IGNORECASE
+)
+BULLET = re.compile(r"^[-\*•]\s*(.+)")
+NUMBERED_LINE = re.compile(r"^\d+\. ")
+NUMBERED_STEP = re.compile(r"^\d+\.\s*(.+)")
+KEY_VALUE = re.compile(r"^([^:]+):\s*(.+)$")
+SERVINGS = re.compile(r"Makes:\s*(\d+)\s*Servings?", re.IGNORECASE)
+# Flexible cost extraction: match 1–4 literal $ symbols, possibly with spaces
+TOTAL_COST = re.compile(r"Total Cost:\s*([$\s]{1,4})", re.IGNORECASE)
+ITEM_HEADING = re.compile(r"^ITEM \d+[:\s]", re.IGNORECASE)
+SEPARATOR = re.compile(r"[-=]{3,}")
+
+def format_table(table):
+    """Formats extracted tables dynamically, merging stacked headers and reshaping if necessary."""
+    if not table:
+        return ""
+
+    df = pd.DataFrame(table).fillna("")  # Convert to DataFrame and fill empty values
+
+    # Detect and merge stacked headers dynamically
+    num_header_rows = 0
+    for idx, row in df.iterrows():
+        if row.isnull().sum() > len(row) // 2:  # Detects when rows are mostly empty
+            num_header_rows += 1
+        else:
+            break  # Stop when we reach real data
+
+    # Ensure we have valid header rows
+    if num_header_rows >= len(df):
+        return df.to_string(index=False, header=True)  # If no valid headers, return as-is
+
+    # Merge headers only if we have valid header data
+    new_columns = [' '.join(filter(None, col)).strip() for col in zip(*df.iloc[:num_header_rows].values)]
+
+    # Ensure new column length matches DataFrame width
+    if len(new_columns) == len(df.columns):
+        df.columns = new_columns
+        df = df.iloc[num_header_rows:].reset_index(drop=True)
+
+    # Reshape if necessary (detecting numeric-based category columns)
+    potential_numeric_columns = [col for col in df.columns if df[col].apply(lambda x: str(x).replace('.', '', 1).isdigit()).sum() > len(df) * 0.8]
+    if len(potential_numeric_columns) > 1:
+        df = df.melt(id_vars=[col for col in df.columns if col not in potential_numeric_columns],
+                     var_name="Dynamic Category", value_name="Value")
+
+    return df.to_string(index=False, header=True)  # Preserve headers for readability
+
+def table_lines(formatted_tables):
+    """Returns the set of lines covered by a page's formatted tables, built once per page."""
+    lines = set()
+    for table in formatted_tables:
+        lines.update(table.splitlines())
+    return frozenset(lines)
+
+def is_section_heading(text, next_line):
+    """Determine if a text line is a section heading."""
+    # Example: If it's fully capitalized, assume it's a heading
+    if text.isupper():
+        return True
+    # Detect common document section patterns like "ITEM 1: OVERVIEW"
+    if ITEM_HEADING.match(text):
+        return True
+    # If the next line is empty or a separator, treat it as a heading
+    if next_line.strip() == "" or SEPARATOR.match(next_line):
+        return True
+    return False
+
+def new_recipe(source):
+    """Returns an empty recipe dict in the shape written to Outputs/structured."""
+    return {
+        "title": "",
+        "servings": "",
+        "cost": "",
+        "image_path": "",
+        "ingredients": [],
+        "directions": [],
+        "nutrition": {},
+        "myplate": {},
+        "source": source
+    }
+
+def _parse_first_page(lines, recipe):
+    """Extracts title, servings and cost from the first page."""
+    # Extract title from largest header line (heuristic: longest line with uppercase words)
+    for line in lines:
+        stripped = line.strip()
+        if stripped and sum(1 for c in line if c.isupper()) > len(line) / 2:
+            recipe["title"] = stripped
+            break
+    else:
+        # fallback: first non-empty line
+        for line in lines:
+            if line.strip():
+                recipe["title"] = line.strip()
+                break
+
+    # Extract servings and cost by scanning lines for "Makes" and "Total Cost"
+    for line in lines:
+        servings_match = SERVINGS.search(line)
+        if servings_match:
+            recipe["servings"] = servings_match.group(1)
+        cost_match = TOTAL_COST.search(line)
+        if cost_match:
+            recipe["cost"] = cost_match.group(1).strip()
+
+    # Image path placeholder (skip actual image saving)
+    recipe["image_path"] = ""
+
+def parse_page(lines, page_index, recipe, table_texts=frozenset()):
+    """Runs the section state machine over one page's lines, adding what it finds to recipe."""
+    if page_index == 0:
+        _parse_first_page(lines, recipe)
+
+    ingredients = recipe["ingredients"]
+    directions = recipe["directions"]
+    current_section = None
+
+    for line in lines:
+        line_strip = line.strip()
+        if not line_strip or line_strip in table_texts:
+            continue
+
+        header = SECTION_HEADER.match(line_strip)
+        if header:
+            current_section = None if header.lastgroup == "source" else header.lastgroup
+            continue
+
+        if current_section == "ingredients":
+            # Accept bullet lines (starting with -, *, •)
+            bullet = BULLET.match(line_strip)
+            if bullet:
+                ingredients.append(bullet.group(1))
+            elif not NUMBERED_LINE.match(line_strip):
+                # Also accept lines that are not numbered steps as ingredients
+                ingredients.append(line_strip)
+        elif current_section == "directions":
+            step_match = NUMBERED_STEP.match(line_strip)
+            if step_match:
+                directions.append(step_match.group(1))
+            elif not directions:
+                # Also accept lines without numbering if no steps yet
+                directions.append(line_strip)
+            else:
+                # Possibly continuation of last step
+                directions[-1] += " " + line_strip
+        elif current_section is not None:
+            # nutrition / myplate: pairs like "Nutrient: Value"
+            pair = KEY_VALUE.match(line_strip)
+            if pair:
+                recipe[current_section][pair.group(1).strip()] = pair.group(2).strip()
+
+def parse_recipe(pages, source):
+    """Builds a recipe dict from (page_text, table_texts) pairs, one per PDF page."""
+    recipe = new_recipe(source)
+    for page_index, (text, table_texts) in enumerate(pages):
+        if text:
+            parse_page(text.splitlines(), page_index, recipe, table_texts)
+    return recipe
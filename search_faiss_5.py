@@ -1,35 +1,229 @@
 import openai
+import httpx
+import asyncio
 from dotenv import load_dotenv
 import numpy as np
 import os
 import re
 import json
-from faiss_index_4 import search_faiss
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from faiss_index_4 import search_faiss, search_faiss_batch, get_chunks, get_scope_row_ids
+from ingredient_index import filter_row_ids
+from keyword_index import KEYWORD_MAX_RECIPES, keyword_query_terms, keyword_search, query_terms, reciprocal_rank_fusion
+from db import get_connection
+from metrics import get_logger, stage_timer
+
+log = get_logger(__name__)
 
 load_dotenv()
 API_KEY = os.getenv("OPENAI_API_KEY")
 
 client = openai.OpenAI(api_key=API_KEY)
 
-def generate_query_embedding(query):
-    """Creates an embedding for the user's query."""
+# Shared async client for chatbot_async.py; one pooled httpx client serves every request
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+_async_client = None
+
+def get_async_client():
+    """Returns the process-wide AsyncOpenAI client, created on first use inside the event loop."""
+    global _async_client
+    if _async_client is None:
+        _async_client = openai.AsyncOpenAI(
+            api_key=API_KEY,
+            http_client=openai.DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+            ))
+        )
+    return _async_client
+
+# Cosine similarity below which hits are dropped. ada-002 scores cluster high (unrelated text is
+# often ~0.70), so useful cutoffs sit around 0.75-0.80. Set to 0 to disable.
+MIN_SIMILARITY = float(os.getenv("SEARCH_MIN_SIMILARITY", "0.76"))
+
+# Query embedding cache: an in-process LRU in front of an optional SQLite store, keyed by
+# (model, normalized query). Repeat queries skip the embeddings round trip entirely.
+QUERY_EMBEDDING_MODEL = "text-embedding-ada-002"
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "86400"))  # Seconds
+QUERY_CACHE_DB = os.getenv("QUERY_CACHE_DB", "")  # e.g. query_cache.db; empty disables the disk tier
+QUERY_CACHE_DB_SIZE = int(os.getenv("QUERY_CACHE_DB_SIZE", "100000"))
+
+_query_cache = OrderedDict()  # cache key -> (created_at, vector)
+_query_cache_lock = threading.Lock()
+QUERY_CACHE_STATS = {
+    "memory_hits": 0,
+    "disk_hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "api_calls": 0,
+    "api_seconds": 0.0
+}
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a query, used as the cache key."""
+    return " ".join(query.lower().split())
+
+def _query_cache_key(query, model=QUERY_EMBEDDING_MODEL):
+    return f"{model}\0{normalize_query(query)}"
+
+def _memory_get(key):
+    with _query_cache_lock:
+        entry = _query_cache.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > QUERY_CACHE_TTL:
+            del _query_cache[key]
+            QUERY_CACHE_STATS["evictions"] += 1
+            return None
+        _query_cache.move_to_end(key)
+        return entry[1]
+
+def _memory_put(key, vector, created_at=None):
+    vector.setflags(write=False)  # Shared between requests; callers copy before normalizing
+    with _query_cache_lock:
+        _query_cache[key] = (created_at or time.time(), vector)
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+            QUERY_CACHE_STATS["evictions"] += 1
+
+def _disk_connect():
+    return get_connection(QUERY_CACHE_DB, schema="""
+        CREATE TABLE IF NOT EXISTS query_embedding_cache (
+            cache_key TEXT PRIMARY KEY,
+            embedding BLOB NOT NULL,
+            created_at REAL NOT NULL
+        );
+    """)
+
+def _disk_get(key):
+    if not QUERY_CACHE_DB:
+        return None
+    conn = _disk_connect()
+    row = conn.execute(
+        "SELECT embedding, created_at FROM query_embedding_cache WHERE cache_key = ?", (key,)
+    ).fetchone()
+    if row and time.time() - row[1] > QUERY_CACHE_TTL:
+        with conn:
+            conn.execute("DELETE FROM query_embedding_cache WHERE cache_key = ?", (key,))
+        QUERY_CACHE_STATS["evictions"] += 1
+        row = None
+    if row is None:
+        return None
+    vector = np.frombuffer(row[0], dtype=np.float32).copy()
+    _memory_put(key, vector, created_at=row[1])
+    return vector
+
+def _disk_put(key, vector):
+    if not QUERY_CACHE_DB:
+        return
+    conn = _disk_connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO query_embedding_cache (cache_key, embedding, created_at) VALUES (?, ?, ?)",
+            (key, vector.tobytes(), time.time())
+        )
+        conn.execute("""
+            DELETE FROM query_embedding_cache WHERE cache_key IN (
+                SELECT cache_key FROM query_embedding_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (QUERY_CACHE_DB_SIZE,))
+
+def _cached_query_embedding(key):
+    vector = _memory_get(key)
+    if vector is not None:
+        QUERY_CACHE_STATS["memory_hits"] += 1
+        return vector
+    vector = _disk_get(key)
+    if vector is not None:
+        QUERY_CACHE_STATS["disk_hits"] += 1
+    return vector
+
+def peek_query_embedding(query):
+    """Returns the in-memory cached embedding for a query, or None. Never calls the API."""
+    return _memory_get(_query_cache_key(query))
+
+def _embed_uncached(inputs):
+    start = time.perf_counter()
     response = client.embeddings.create(
-        model="text-embedding-ada-002",
+        model=QUERY_EMBEDDING_MODEL,
+        input=inputs
+    )
+    QUERY_CACHE_STATS["api_calls"] += 1
+    QUERY_CACHE_STATS["api_seconds"] += time.perf_counter() - start
+    ordered = sorted(response.data, key=lambda item: item.index)
+    return [np.array(item.embedding, dtype=np.float32) for item in ordered]
+
+def generate_query_embedding(query):
+    """Creates an embedding for the user's query, served from cache when possible."""
+    key = _query_cache_key(query)
+    vector = _cached_query_embedding(key)
+    if vector is not None:
+        return vector
+
+    QUERY_CACHE_STATS["misses"] += 1
+    vector = _embed_uncached(query)[0]
+    _memory_put(key, vector)
+    _disk_put(key, vector)
+    return vector
+
+async def generate_query_embedding_async(query):
+    """Async form of generate_query_embedding for the ASGI server; shares the same cache."""
+    key = _query_cache_key(query)
+    vector = await asyncio.to_thread(_cached_query_embedding, key)
+    if vector is not None:
+        return vector
+
+    QUERY_CACHE_STATS["misses"] += 1
+    start = time.perf_counter()
+    response = await get_async_client().embeddings.create(
+        model=QUERY_EMBEDDING_MODEL,
         input=query
     )
-    return np.array(response.data[0].embedding, dtype=np.float32)
+    QUERY_CACHE_STATS["api_calls"] += 1
+    QUERY_CACHE_STATS["api_seconds"] += time.perf_counter() - start
+    vector = np.array(response.data[0].embedding, dtype=np.float32)
+    _memory_put(key, vector)
+    await asyncio.to_thread(_disk_put, key, vector)
+    return vector
+
+def generate_query_embeddings(queries):
+    """Creates embeddings for many queries; cache misses share a single API request. Returns an (N, d) matrix."""
+    keys = [_query_cache_key(query) for query in queries]
+    vectors = [_cached_query_embedding(key) for key in keys]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+    if missing:
+        QUERY_CACHE_STATS["misses"] += len(missing)
+        for i, vector in zip(missing, _embed_uncached([queries[i] for i in missing])):
+            vectors[i] = vector
+            _memory_put(keys[i], vector)
+            _disk_put(keys[i], vector)
+
+    return np.array(vectors, dtype=np.float32)
+
+def get_query_cache_stats():
+    """Returns query-embedding cache counters, hit ratio and average API latency."""
+    stats = dict(QUERY_CACHE_STATS)
+    hits = stats["memory_hits"] + stats["disk_hits"]
+    lookups = hits + stats["misses"]
+    stats["hit_ratio"] = round(hits / lookups, 4) if lookups else 0.0
+    stats["avg_api_ms"] = round(stats["api_seconds"] / stats["api_calls"] * 1000, 2) if stats["api_calls"] else 0.0
+    stats["memory_entries"] = len(_query_cache)
+    return stats
 
 def extract_top_k(query):
     match = re.search(r'\b(\d+)\b', query)
     return int(match.group(1)) if match else 3  # Default to 3 if no number found
 
-def search_and_filter(query, row_id_scope=None):
-    print("🔍 Checking FAISS for best matches...")
-    query_embedding = generate_query_embedding(query)
-    requested_top_k = extract_top_k(query)
-
-    results = search_faiss(query_embedding, top_k=requested_top_k + 5)
-    print("✅ Processing results...")
+def group_results(results):
+    """Filters weak hits and groups the rest by recipe file, best recipe first."""
+    results = [r for r in results if r["similarity"] >= MIN_SIMILARITY]
+    log.debug("✅ Processing %d results above similarity %s...", len(results), MIN_SIMILARITY)
 
     grouped = {}
     for r in results:
@@ -45,7 +239,9 @@ def search_and_filter(query, row_id_scope=None):
             "row_id": r["row_id"],
             "chunk_index": r["chunk_index"],
             "distance_score": round(r["distance"], 4),
-            "text": r.get("text", "[No content found]")
+            "similarity": round(r["similarity"], 4),
+            "text": r.get("text", "[No content found]"),
+            "token_count": r.get("token_count")
         }
 
         grouped[filename]["chunks"].append(chunk_data)
@@ -60,6 +256,256 @@ def search_and_filter(query, row_id_scope=None):
 
     return structured_results
 
+def resolve_scope(row_ids=None, filenames=None, labels=None, where=None):
+    """Turns restrictions into the sorted row ids a search may return, or None for no restriction.
+
+    row_ids, filenames (recipe files), labels (section headers such as "INGREDIENTS:") and where
+    (an ingredient_index filter such as "cost <= 2, servings >= 4") must all hold.
+    Raises ValueError for a malformed restriction or where filter.
+    """
+    if row_ids is not None and (
+        not isinstance(row_ids, list)
+        or not all(isinstance(row_id, int) and not isinstance(row_id, bool) and 0 <= row_id < 2**63 for row_id in row_ids)
+    ):
+        raise ValueError("scope row_ids must be a list of non-negative integers")
+    for name, values in (("filenames", filenames), ("labels", labels)):
+        if values is not None and (not isinstance(values, list) or not all(isinstance(value, str) for value in values)):
+            raise ValueError(f"scope {name} must be a list of strings")
+    if where is not None and not isinstance(where, str):
+        raise ValueError("scope where must be a filter string")
+
+    scopes = []
+    if row_ids is not None:
+        scopes.append(set(row_ids))
+    if filenames is not None or labels is not None:
+        scopes.append(set(get_scope_row_ids(filenames=filenames, labels=labels)))
+    if where:
+        scopes.append(set(filter_row_ids(where)))
+    if not scopes:
+        return None
+    return sorted(set.intersection(*scopes))
+
+def search_and_filter(query, row_id_scope=None, query_embedding=None, timings=None):
+    """Vector search grouped by recipe; row_id_scope (see resolve_scope) restricts it inside FAISS.
+
+    query_embedding skips the embedding step when it is already known (see prefetch_retrieval).
+    """
+    log.debug("🔍 Checking FAISS for best matches...")
+    if query_embedding is None:
+        with stage_timer(timings, "embed"):
+            query_embedding = generate_query_embedding(query)
+    requested_top_k = extract_top_k(query)
+
+    results = search_faiss(query_embedding, top_k=requested_top_k + 5, row_ids=row_id_scope, timings=timings)
+    return group_results(results)
+
+async def search_and_filter_async(query, row_id_scope=None, query_embedding=None, timings=None):
+    """Async form of search_and_filter: awaits the embedding, runs FAISS and SQLite off the event loop."""
+    log.debug("🔍 Checking FAISS for best matches...")
+    if query_embedding is None:
+        with stage_timer(timings, "embed"):
+            query_embedding = await generate_query_embedding_async(query)
+    requested_top_k = extract_top_k(query)
+
+    results = await asyncio.to_thread(search_faiss, query_embedding, requested_top_k + 5, row_id_scope, timings)
+    return group_results(results)
+
+def search_and_filter_batch(queries):
+    """Batch form of search_and_filter: one embeddings request, one FAISS search, one hydration query.
+
+    Returns a list with one grouped result (same shape as search_and_filter) per query.
+    """
+    queries = list(queries)
+    if not queries:
+        return []
+    log.debug("🔍 Checking FAISS for best matches for %d queries...", len(queries))
+    query_embeddings = generate_query_embeddings(queries)
+    top_ks = [extract_top_k(query) + 5 for query in queries]
+
+    # Search once at the largest k, then trim each query back to its own k
+    batch_results = search_faiss_batch(query_embeddings, top_k=max(top_ks))
+    return [group_results(results[:top_k]) for results, top_k in zip(batch_results, top_ks)]
+
+# Hybrid retrieval: ingredient/name lookups are served by the keyword index alone; everything else
+# is vector search fused with keyword hits by reciprocal rank
+KEYWORD_FUSION_RECIPES = int(os.getenv("KEYWORD_FUSION_RECIPES", "5"))
+SEARCH_STATS = {
+    "keyword_only": 0,
+    "hybrid": 0,
+    "scoped": 0
+}
+
+def fuse_groups(grouped, keyword_hits):
+    """Re-ranks grouped vector results together with keyword hits by reciprocal-rank fusion.
+
+    Recipes found only by keyword get their INGREDIENTS chunk. In fused output every chunk's
+    distance_score is its recipe's fused distance (0 for the best recipe), so sorting chunks by
+    distance keeps the fused recipe order; the vector distance is kept as vector_distance.
+    """
+    if not keyword_hits:
+        return grouped
+
+    scores = reciprocal_rank_fusion([g["filename"] for g in grouped], [h["filename"] for h in keyword_hits])
+    by_file = {g["filename"]: g for g in grouped}
+
+    keyword_only = [h for h in keyword_hits if h["filename"] not in by_file and h["ingredients_row_id"] is not None]
+    chunks = get_chunks([h["ingredients_row_id"] for h in keyword_only])
+    for hit in keyword_only:
+        row = chunks.get(hit["ingredients_row_id"])
+        if row is None:
+            continue
+        by_file[hit["filename"]] = {
+            "filename": hit["filename"],
+            "chunks": [{
+                "row_id": hit["ingredients_row_id"],
+                "chunk_index": row[1],
+                "distance_score": None,
+                "similarity": None,
+                "text": row[2],
+                "token_count": row[3]
+            }]
+        }
+
+    ranked = sorted(by_file, key=lambda filename: scores.get(filename, 0.0), reverse=True)
+    best = scores[ranked[0]] if ranked else 1.0
+    fused = []
+    for filename in ranked:
+        group = by_file[filename]
+        distance = round(1.0 - scores.get(filename, 0.0) / best, 4)
+        for chunk in group["chunks"]:
+            chunk["vector_distance"] = chunk["distance_score"]
+            chunk["distance_score"] = distance
+        group["best_score"] = distance
+        group["rrf_score"] = round(scores.get(filename, 0.0), 6)
+        fused.append(group)
+    return fused
+
+def keyword_limit(query):
+    """An explicit count in the query ("show me 3 chicken recipes") caps keyword results."""
+    match = re.search(r'\b(\d+)\b', query)
+    return int(match.group(1)) if match else KEYWORD_MAX_RECIPES
+
+def keyword_candidates(query):
+    """Keyword side of hybrid_search: (lookup terms, lookup hits, fusion hits).
+
+    Lookup hits answer a plain ingredient/name lookup on their own; otherwise fusion hits are
+    merged with the vector results.
+    """
+    terms = keyword_query_terms(query)
+    if terms:
+        hits = keyword_search(terms, limit=keyword_limit(query), match_all=True)
+        if hits:
+            return terms, hits, None
+    return terms, None, keyword_search(query_terms(query), limit=KEYWORD_FUSION_RECIPES)
+
+# Retrieval pipeline: the keyword lookup and the query embedding depend only on the query text,
+# so they start on background threads before the caller loads its session and context
+PREFETCH_WORKERS = int(os.getenv("RETRIEVAL_PREFETCH_WORKERS", "16"))
+_prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="retrieval")
+
+def _timed_call(timings, stage, fn, *args):
+    with stage_timer(timings, stage):
+        return fn(*args)
+
+async def _timed_await(timings, stage, awaitable):
+    with stage_timer(timings, stage):
+        return await awaitable
+
+def prefetch_retrieval(query, embed=True, timings=None):
+    """Starts the keyword lookup and, unless embed is False, the query embedding on background threads.
+
+    Returns futures for hybrid_search(prefetch=...); unused ones can simply be dropped, an
+    embedding that finishes anyway lands in the query cache. With embed=False the embedding can
+    be started later with prefetch_embedding, e.g. once the turn is known to need a search.
+    """
+    prefetch = {"keywords": _prefetch_pool.submit(_timed_call, timings, "keyword", keyword_candidates, query)}
+    if embed:
+        prefetch_embedding(prefetch, query, timings)
+    return prefetch
+
+def prefetch_embedding(prefetch, query, timings=None):
+    """Adds the query embedding to a prefetch if it isn't there yet.
+
+    A plain ingredient/name lookup isn't embedded ahead of time since the keyword index usually
+    answers it alone.
+    """
+    if "embedding" not in prefetch and not keyword_query_terms(query):
+        prefetch["embedding"] = _prefetch_pool.submit(_timed_call, timings, "embed", generate_query_embedding, query)
+    return prefetch
+
+def prefetch_retrieval_async(query, embed=True, timings=None):
+    """Async form of prefetch_retrieval; returns tasks on the running loop."""
+    prefetch = {"keywords": asyncio.create_task(
+        _timed_await(timings, "keyword", asyncio.to_thread(keyword_candidates, query))
+    )}
+    if embed:
+        prefetch_embedding_async(prefetch, query, timings)
+    return prefetch
+
+def prefetch_embedding_async(prefetch, query, timings=None):
+    """Async form of prefetch_embedding."""
+    if "embedding" not in prefetch and not keyword_query_terms(query):
+        prefetch["embedding"] = asyncio.create_task(
+            _timed_await(timings, "embed", generate_query_embedding_async(query))
+        )
+    return prefetch
+
+def cancel_prefetch(prefetch):
+    """Cancels the prefetch's unfinished work, for a turn that won't use it (sync futures or async tasks).
+
+    A sync future that is already running can't be stopped and finishes into the caches.
+    """
+    for pending in prefetch.values():
+        pending.cancel()
+
+def hybrid_search(query, row_id_scope=None, prefetch=None, timings=None):
+    """Keyword-only answer for lookups, otherwise vector search fused with keyword hits. Same shape as search_and_filter.
+
+    A scoped search (row_id_scope not None) is vector-only inside the scope, since keyword hits
+    are whole recipes that may lie outside it. Without a prefetch the keyword lookup and the
+    embedding are still started together.
+    """
+    if row_id_scope is not None:
+        SEARCH_STATS["scoped"] += 1
+        log.debug("🎯 Searching within %d scoped chunks.", len(row_id_scope))
+        embedding = prefetch["embedding"].result() if prefetch and "embedding" in prefetch else None
+        return search_and_filter(query, row_id_scope, embedding, timings)
+
+    prefetch = prefetch or prefetch_retrieval(query, timings=timings)
+    terms, lookup_hits, fusion_hits = prefetch["keywords"].result()
+    if lookup_hits:
+        SEARCH_STATS["keyword_only"] += 1
+        log.debug("🔤 Keyword lookup for %s matched %d recipes; no embedding needed.", terms, len(lookup_hits))
+        return fuse_groups([], lookup_hits)
+
+    SEARCH_STATS["hybrid"] += 1
+    embedding = prefetch["embedding"].result() if "embedding" in prefetch else None
+    grouped = search_and_filter(query, None, embedding, timings)
+    return fuse_groups(grouped, fusion_hits)
+
+async def hybrid_search_async(query, row_id_scope=None, prefetch=None, timings=None):
+    """Async form of hybrid_search."""
+    if row_id_scope is not None:
+        SEARCH_STATS["scoped"] += 1
+        log.debug("🎯 Searching within %d scoped chunks.", len(row_id_scope))
+        embedding = await prefetch["embedding"] if prefetch and "embedding" in prefetch else None
+        return await search_and_filter_async(query, row_id_scope, embedding, timings)
+
+    prefetch = prefetch or prefetch_retrieval_async(query, timings=timings)
+    terms, lookup_hits, fusion_hits = await prefetch["keywords"]
+    if lookup_hits:
+        SEARCH_STATS["keyword_only"] += 1
+        log.debug("🔤 Keyword lookup for %s matched %d recipes; no embedding needed.", terms, len(lookup_hits))
+        return await asyncio.to_thread(fuse_groups, [], lookup_hits)
+
+    SEARCH_STATS["hybrid"] += 1
+    embedding = await prefetch["embedding"] if "embedding" in prefetch else None
+    grouped = await search_and_filter_async(query, None, embedding, timings)
+    return await asyncio.to_thread(fuse_groups, grouped, fusion_hits)
+
+def get_search_stats():
+    return dict(SEARCH_STATS)
+
 if __name__ == "__main__":
     query = input("Enter search query: ")
     results = search_and_filter(query)
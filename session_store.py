@@ -0,0 +1,224 @@
+import json
+import os
+import secrets
+import threading
+import time
+from faiss_index_4 import get_chunks
+from db import get_connection
+from metrics import get_logger
+
+log = get_logger(__name__)
+
+# Compact server-side chat sessions shared by chatbot.py and chatbot_async.py.
+# A session keeps recent chat history and (row_id, score) references to retrieved chunks; chunk
+# text is rehydrated from recipe_embeddings when needed, so a session stays a few KB however long
+# the conversation runs. Idle sessions expire after SESSION_IDLE_TTL seconds.
+# Background history summaries are parked beside the session (put_summary) rather than written into
+# it, and taken by the next request that loads the session (take_summary); a request that saves the
+# copy it loaded earlier therefore can't overwrite a summary.
+
+SESSION_COOKIE = "recipe_sid"
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")  # "sqlite" or "memory"
+SESSION_DB = os.getenv("SESSION_DB", "chat_sessions.db")
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "7200"))  # Seconds
+MAX_STORED_HISTORY = int(os.getenv("SESSION_MAX_HISTORY", "20"))  # Messages kept per session
+MAX_CONTEXT_REFS = int(os.getenv("SESSION_MAX_CONTEXT", "100"))  # Chunk references kept per session
+PURGE_INTERVAL = 60  # Seconds between sweeps for idle sessions
+
+_memory_sessions = {}  # sid -> (updated_at, json payload)
+_memory_summaries = {}  # sid -> (updated_at, json payload) of a finished summary not yet applied
+_memory_lock = threading.Lock()
+_last_purge = 0.0
+
+def new_token_usage():
+    return {
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "estimated_cost_usd": 0.0
+    }
+
+def new_session():
+    return {
+        "chat_history": [],  # Turns not yet folded into summary
+        "summary": "",
+        "turn": 0,
+        "context_refs": [],  # [{"row_id": int, "distance_score": float, "turn": int}], oldest first
+        "token_usage": new_token_usage()
+    }
+
+def new_session_id():
+    return secrets.token_urlsafe(24)
+
+def _connect():
+    return get_connection(SESSION_DB, schema="""
+        CREATE TABLE IF NOT EXISTS chat_sessions (
+            sid TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS session_summaries (
+            sid TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """)
+
+def load_session(sid):
+    """Returns the stored session for sid, or a fresh one if it is unknown or has expired."""
+    if not sid:
+        return new_session()
+    cutoff = time.time() - SESSION_IDLE_TTL
+
+    if SESSION_BACKEND == "memory":
+        with _memory_lock:
+            row = _memory_sessions.get(sid)
+    else:
+        conn = _connect()
+        row = conn.execute("SELECT updated_at, data FROM chat_sessions WHERE sid = ?", (sid,)).fetchone()
+
+    if row is None or row[0] < cutoff:
+        return new_session()
+    return json.loads(row[1])
+
+def compact_session(session):
+    """Trims history and context references to their caps, oldest first.
+
+    References are trimmed by their "turn", not list position: a chunk first seen long ago but used
+    again this turn keeps its early position and must not be the one dropped.
+    """
+    history = session.get("chat_history", [])
+    if len(history) > MAX_STORED_HISTORY:
+        # Normally history_compaction folds old turns into the summary first; this drops them unsummarized
+        log.info("✂️ Dropping %s unsummarized history messages over SESSION_MAX_HISTORY.", len(history) - MAX_STORED_HISTORY)
+        history = history[-MAX_STORED_HISTORY:] if MAX_STORED_HISTORY else []
+    session["chat_history"] = history
+
+    refs = session.get("context_refs", [])
+    if len(refs) > MAX_CONTEXT_REFS:
+        newest = sorted(range(len(refs)), key=lambda i: refs[i].get("turn", 0), reverse=True)[:MAX_CONTEXT_REFS]
+        refs = [refs[i] for i in sorted(newest)]
+    session["context_refs"] = refs
+    return session
+
+def save_session(sid, session):
+    """Stores a compacted session and now and then sweeps idle ones."""
+    payload = json.dumps(compact_session(session), separators=(",", ":"))
+    now = time.time()
+
+    if SESSION_BACKEND == "memory":
+        with _memory_lock:
+            _memory_sessions[sid] = (now, payload)
+    else:
+        conn = _connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chat_sessions (sid, data, updated_at) VALUES (?, ?, ?)",
+                (sid, payload, now)
+            )
+
+    if now - _last_purge > PURGE_INTERVAL:
+        expire_idle_sessions()
+
+def put_summary(sid, result):
+    """Parks a finished history summary for the session; a newer one replaces it."""
+    payload = json.dumps(result, separators=(",", ":"))
+    now = time.time()
+    if SESSION_BACKEND == "memory":
+        with _memory_lock:
+            _memory_summaries[sid] = (now, payload)
+        return
+    conn = _connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO session_summaries (sid, data, updated_at) VALUES (?, ?, ?)",
+            (sid, payload, now)
+        )
+
+def take_summary(sid):
+    """Removes and returns the session's parked summary, or None. Only one caller gets it."""
+    if not sid:
+        return None
+    if SESSION_BACKEND == "memory":
+        with _memory_lock:
+            row = _memory_summaries.pop(sid, None)
+        return json.loads(row[1]) if row else None
+    conn = _connect()
+    row = conn.execute("SELECT data FROM session_summaries WHERE sid = ?", (sid,)).fetchone()
+    if row is None:
+        return None
+    with conn:
+        # Deleting the exact payload read decides which of two concurrent takers gets it
+        taken = conn.execute("DELETE FROM session_summaries WHERE sid = ? AND data = ?", (sid, row[0])).rowcount
+    return json.loads(row[0]) if taken else None
+
+def delete_session(sid):
+    if not sid:
+        return
+    if SESSION_BACKEND == "memory":
+        with _memory_lock:
+            _memory_sessions.pop(sid, None)
+            _memory_summaries.pop(sid, None)
+        return
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM chat_sessions WHERE sid = ?", (sid,))
+        conn.execute("DELETE FROM session_summaries WHERE sid = ?", (sid,))
+
+def expire_idle_sessions():
+    """Deletes sessions idle for longer than SESSION_IDLE_TTL. Returns how many were removed."""
+    global _last_purge
+    _last_purge = time.time()
+    cutoff = _last_purge - SESSION_IDLE_TTL
+
+    if SESSION_BACKEND == "memory":
+        with _memory_lock:
+            expired = [sid for sid, (updated_at, _) in _memory_sessions.items() if updated_at < cutoff]
+            for sid in expired:
+                del _memory_sessions[sid]
+            for sid in [sid for sid, (updated_at, _) in _memory_summaries.items() if updated_at < cutoff]:
+                del _memory_summaries[sid]
+        return len(expired)
+
+    conn = _connect()
+    with conn:
+        removed = conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (cutoff,)).rowcount
+        conn.execute("DELETE FROM session_summaries WHERE updated_at < ?", (cutoff,))
+    if removed:
+        log.info("🧹 Expired %s idle chat sessions.", removed)
+    return removed
+
+def merge_context_refs(context_refs, ordered_chunks, turn=0):
+    """Appends references for chunks the session hasn't seen yet and marks all of them used this turn.
+
+    Text is never stored.
+    """
+    merged = [dict(ref) for ref in context_refs]
+    by_id = {ref["row_id"]: ref for ref in merged}
+    for chunk in ordered_chunks:
+        row_id = int(chunk["row_id"])
+        if row_id in by_id:
+            by_id[row_id]["turn"] = turn
+            continue
+        ref = {"row_id": row_id, "distance_score": round(chunk["distance_score"], 4), "turn": turn}
+        merged.append(ref)
+        by_id[row_id] = ref
+    log.debug("🧠 Context size now: %s", len(merged))
+    return merged
+
+def hydrate_context(context_refs):
+    """Turns stored references back into chunk dicts (row_id, filename, chunk_index, distance_score, text, token_count)."""
+    chunks = get_chunks([ref["row_id"] for ref in context_refs])
+    hydrated = []
+    for ref in context_refs:
+        row = chunks.get(ref["row_id"])
+        if row is None:
+            continue  # Chunk was deleted since the session saw it
+        hydrated.append({
+            "row_id": ref["row_id"],
+            "filename": row[0],
+            "chunk_index": row[1],
+            "distance_score": ref["distance_score"],
+            "text": row[2],
+            "token_count": row[3]
+        })
+    return hydrated
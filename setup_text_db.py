@@ -1,30 +1,44 @@
-import sqlite3
 import os
+import sys
+import json
+import numpy as np
+from db import DB_PATH, get_connection
+from keyword_index import FTS_SCHEMA
+from ingredient_index import INGREDIENT_SCHEMA
 
 # Create text chunk database to store text chunks extracted from recipe PDFs.
 
-# Database path
-DB_PATH = "recipe_text_chunks.db"
+def setup_text_database(reset=True):
+    """Creates a SQLite database for storing text chunks extracted from PDFs.
 
-def setup_text_database():
-    """Creates a SQLite database for storing text chunks extracted from PDFs."""
-    conn = sqlite3.connect(DB_PATH)
+    With reset=False existing tables are kept, which is what incremental ingestion uses.
+    """
+    conn = get_connection(DB_PATH)
     cursor = conn.cursor()
 
-    # Drop the old text_chunks table if it exists to avoid conflicts
-    cursor.execute('DROP TABLE IF EXISTS text_chunks')
+    if reset:
+        # Drop the old text_chunks table if it exists to avoid conflicts
+        cursor.execute('DROP TABLE IF EXISTS text_chunks')
 
-    # Drop the recipe_embeddings table if it exists, then create the enhanced schema
-    cursor.execute('DROP TABLE IF EXISTS recipe_embeddings')
+        # Drop the recipe_embeddings table if it exists, then create the enhanced schema
+        cursor.execute('DROP TABLE IF EXISTS recipe_embeddings')
+
+        # The manifest describes what recipe_embeddings holds, so it goes too
+        cursor.execute('DROP TABLE IF EXISTS source_manifest')
+
+        # Keyword and ingredient index rows describe the chunks being dropped
+        cursor.execute('DROP TABLE IF EXISTS recipe_fts')
+        cursor.execute('DROP TABLE IF EXISTS recipe_facts')
+        cursor.execute('DROP TABLE IF EXISTS recipe_ingredients')
 
     cursor.execute('''
-        CREATE TABLE recipe_embeddings (
+        CREATE TABLE IF NOT EXISTS recipe_embeddings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             filename TEXT NOT NULL,
             chunk_index INTEGER NOT NULL,
             content TEXT NOT NULL,
             token_count INTEGER NOT NULL,
-            embedding TEXT,
+            embedding BLOB,
             model TEXT DEFAULT 'openai-ada-002',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             metadata TEXT,
@@ -33,9 +47,48 @@ def setup_text_database():
         )
     ''')
 
+    # Source PDFs already ingested, used to detect added/changed/removed files
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS source_manifest (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            content_hash TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Pending-work scans (embedding, index loads) and per-file lookups (ingest, listing)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_recipe_embeddings_state ON recipe_embeddings(is_embedded, is_deleted, model)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_recipe_embeddings_file_chunk ON recipe_embeddings(filename, chunk_index)')
+
     conn.commit()
-    conn.close()
-    print(f"✅ Database `{DB_PATH}` has been created and initialized.")
+
+    # Keyword and ingredient index side tables, filled when the FAISS index is written
+    conn.executescript(FTS_SCHEMA)
+    conn.executescript(INGREDIENT_SCHEMA)
+    if reset:
+        print(f"✅ Database `{DB_PATH}` has been created and initialized.")
+
+def migrate_embeddings_to_blob(db_path=DB_PATH):
+    """Rewrites legacy JSON-text embeddings as raw float32 BLOBs in one transaction."""
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, embedding FROM recipe_embeddings WHERE typeof(embedding) = 'text'")
+    rows = cursor.fetchall()
+
+    if rows:
+        cursor.executemany(
+            "UPDATE recipe_embeddings SET embedding = ? WHERE id = ?",
+            [(np.asarray(json.loads(embedding), dtype=np.float32).tobytes(), row_id) for row_id, embedding in rows]
+        )
+        conn.commit()
+        print(f"✅ Migrated {len(rows)} JSON embeddings to float32 BLOBs.")
+    return len(rows)
 
 if __name__ == "__main__":
-    setup_text_database()
\ No newline at end of file
+    if "--migrate-embeddings" in sys.argv:
+        setup_text_database(reset=False)  # Also adds indexes missing from older databases
+        migrate_embeddings_to_blob()
+    else:
+        setup_text_database()
\ No newline at end of file
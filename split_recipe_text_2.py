@@ -1,20 +1,15 @@
 import os
-import sqlite3
-import tiktoken
+from db import DB_PATH, get_connection
+from tokenization import count_tokens_batch
+from batch_pdf_to_text_1 import INPUT_FOLDER as PDF_FOLDER, output_paths, source_entry
 
 # Step 2: Splitting the recipe text into chunks
 
 # Configurations
-DB_PATH = "recipe_text_chunks.db"
 INPUT_FOLDER = "Outputs/flattened/"  # Process all cleaned text files
 TOKEN_LIMIT = 10000  # Max tokens per chunk
 OVERLAP = 1500  # Tokens that overlap between chunks
 
-def count_tokens(text):
-    """Returns the token count for a given text."""
-    enc = tiktoken.encoding_for_model("gpt-4-turbo")
-    return len(enc.encode(text))
-
 def extract_labeled_chunks(text):
     labels = ["TITLE:", "SERVINGS:", "COST:", "INGREDIENTS:", "DIRECTIONS:", "NUTRITION:", "FOOD GROUPS:", "SOURCE:"]
     chunks = []
@@ -36,20 +31,29 @@ def extract_labeled_chunks(text):
 
 def store_chunks_in_db(filename, chunks):
     """Stores generated text chunks in SQLite database."""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection(DB_PATH)
     cursor = conn.cursor()
 
-    for i, chunk in enumerate(chunks):
-        token_count = count_tokens(chunk)
-        cursor.execute("""
-            INSERT INTO recipe_embeddings (filename, chunk_index, content, token_count, metadata)
-            VALUES (?, ?, ?, ?, ?)
-        """, (filename, i, chunk, token_count, None))
+    # Counted once here; retrieval and context budgeting reuse the stored token_count
+    token_counts = count_tokens_batch(chunks)
+    cursor.executemany("""
+        INSERT INTO recipe_embeddings (filename, chunk_index, content, token_count, metadata)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(filename, i, chunk, token_count, None) for i, (chunk, token_count) in enumerate(zip(chunks, token_counts))])
 
     conn.commit()
-    conn.close()
     print(f"✅ Stored {len(chunks)} text chunks from {filename} in the database.")
 
+def process_recipe_file(file):
+    """Splits one cleaned recipe text file into chunks and stores them in the database."""
+    file_path = os.path.join(INPUT_FOLDER, file)
+    with open(file_path, "r", encoding="utf-8") as f:
+        full_text = f.read()
+
+    chunks = extract_labeled_chunks(full_text)
+    store_chunks_in_db(file, chunks)
+    print(f"✅ Processed and stored chunks from {file}.")
+
 def process_recipe_text():
     """Reads all cleaned recipe text files, splits them into chunks, and stores them in the database."""
     if not os.path.exists(INPUT_FOLDER):
@@ -63,13 +67,29 @@ def process_recipe_text():
         return
 
     for file in text_files:
-        file_path = os.path.join(INPUT_FOLDER, file)
-        with open(file_path, "r", encoding="utf-8") as f:
-            full_text = f.read()
+        process_recipe_file(file)
+
+    record_sources(text_files)
+
+def record_sources(text_files):
+    """Writes the source_manifest entries of the PDFs behind text_files.
 
-        chunks = extract_labeled_chunks(full_text)
-        store_chunks_in_db(file, chunks)
-        print(f"✅ Processed and stored chunks from {file}.")
+    A full build starts from an empty manifest, so without this the first incremental_ingest.py run
+    would treat every PDF as added and ingest the whole library again.
+    """
+    text_files = set(text_files)
+    pdf_files = [f for f in os.listdir(PDF_FOLDER) if f.lower().endswith(".pdf")] if os.path.exists(PDF_FOLDER) else []
+    entries = [
+        (os.path.join(PDF_FOLDER, pdf),) + source_entry(pdf)
+        for pdf in pdf_files if os.path.basename(output_paths(pdf)[2]) in text_files
+    ]
+    conn = get_connection(DB_PATH)
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO source_manifest (path, size, mtime, content_hash, updated_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+            entries
+        )
+    print(f"📋 Recorded {len(entries)} source PDFs in the manifest.")
 
 if __name__ == "__main__":
     process_recipe_text()
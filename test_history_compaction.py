@@ -0,0 +1,37 @@
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import history_compaction
+from history_compaction import fit_history, MIN_CONTEXT_TOKENS
+
+# One token per character keeps the arithmetic readable
+def fake_message_tokens(messages):
+    return sum(len(msg["content"]) for msg in messages)
+
+def message(role, tokens):
+    return {"role": role, "content": role[0] * tokens}
+
+def test_fit_history_keeps_summary_and_drops_oldest_turn(monkeypatch):
+    monkeypatch.setattr(history_compaction, "count_message_tokens", fake_message_tokens)
+    summary, oldest, newer, latest = message("system", 10), message("user", 50), message("assistant", 50), message("user", 50)
+    history, tokens, budget = fit_history(0, [summary, oldest, newer, latest], ceiling=MIN_CONTEXT_TOKENS + 120)
+    assert history == [summary, newer, latest]
+    assert tokens == 110
+    assert budget == MIN_CONTEXT_TOKENS + 10
+
+def test_fit_history_without_summary_drops_oldest_turn(monkeypatch):
+    monkeypatch.setattr(history_compaction, "count_message_tokens", fake_message_tokens)
+    oldest, newer, latest = message("user", 50), message("assistant", 50), message("user", 50)
+    history, tokens, _ = fit_history(0, [oldest, newer, latest], ceiling=MIN_CONTEXT_TOKENS + 100)
+    assert history == [newer, latest]
+    assert tokens == 100
+
+def test_fit_history_lone_oversized_message(monkeypatch):
+    monkeypatch.setattr(history_compaction, "count_message_tokens", fake_message_tokens)
+    history, tokens, budget = fit_history(0, [message("user", 500)], ceiling=MIN_CONTEXT_TOKENS + 100)
+    assert history == [] and tokens == 0
+    assert budget == MIN_CONTEXT_TOKENS + 100
+
+    history, tokens, _ = fit_history(0, [message("system", 500)], ceiling=MIN_CONTEXT_TOKENS + 100)
+    assert history == [] and tokens == 0
@@ -0,0 +1,28 @@
+import tiktoken
+from functools import lru_cache
+
+# Shared tokenizer helpers. Encoders are built once per model and reused by every module;
+# building one loads its BPE ranks, which costs far more than encoding a recipe chunk.
+
+CHAT_MODEL = "gpt-4o"
+EMBEDDING_MODEL = "text-embedding-ada-002"
+CHUNK_MODEL = "gpt-4-turbo"  # Token counts stored in recipe_embeddings.token_count
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """Returns the (memoized) tiktoken encoder for a model."""
+    return tiktoken.encoding_for_model(model)
+
+def count_tokens(text, model=CHUNK_MODEL):
+    """Returns the number of tokens in a text."""
+    return len(get_encoding(model).encode(text))
+
+def count_tokens_batch(texts, model=CHUNK_MODEL):
+    """Returns token counts for many texts, encoded in parallel by tiktoken."""
+    if not texts:
+        return []
+    return [len(tokens) for tokens in get_encoding(model).encode_batch(list(texts))]
+
+def count_message_tokens(messages, model=CHAT_MODEL):
+    """Returns the total content tokens of a list of chat messages."""
+    return sum(count_tokens_batch([m["content"] for m in messages], model))